@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Installer backends of the packaging venv: pip (default) or uv.
+
+Both build the same command lines for venv creation, install, uninstall,
+freeze, list, download and wheel, so run_installer stays unchanged:
+
+    bibiinstaller configs.py --installer uv
+    bibiinstaller configs.py --installer uv --find_links D:\\wheels
+
+uv creates the venv with --seed (pip, setuptools, wheel) and installs in
+parallel through its global cache. uv has no "pip download" and "pip wheel",
+those run with the seeded pip of the venv. find_links restricts every install
+and download to a local wheel directory (--no-index). Otherwise they go
+through index_url: BIBIINSTALLER_INDEX_URL, or the `bibiinstaller index-proxy`
+running on the cache (see bibiinstaller_index).
+"""
+import os
+import shutil
+import sys
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+
+INSTALLER_ENV = 'BIBIINSTALLER_INSTALLER'
+FIND_LINKS_ENV = 'BIBIINSTALLER_FIND_LINKS'
+INDEX_COMMANDS = ['install', 'download', 'wheel']
+# ''' pip commands uv has no equivalent of '''
+PIP_COMMANDS = ['download', 'wheel']
+# ''' pip only options, dropped from uv command lines '''
+PIP_ONLY_OPTIONS = ['--no-warn-script-location', '--all', '-y', '--yes']
+
+_backend = None
+
+
+class PipBackend:
+    name = 'pip'
+
+    def __init__(self, find_links=None, index_url=None):
+        self.find_links = Path(find_links).resolve() if find_links else None
+        self.index_url = index_url
+
+    def index_options(self, command):
+        if command not in INDEX_COMMANDS:
+            return []
+        if self.find_links is not None:
+            return ['--no-index', '--find-links', str(self.find_links)]
+        if self.index_url:
+            return ['--index-url', self.index_url]
+        return []
+
+    def venv_command(self, python_exe, venv_dir):
+        return [python_exe, '-m', 'venv', venv_dir]
+
+    def pip_command(self, python, command, *args):
+        return [python, '-m', 'pip', command, *args, *self.index_options(command)]
+
+    def freeze_command(self, python):
+        return self.pip_command(python, 'freeze', '--all')
+
+    def list_command(self, python):
+        return self.pip_command(python, 'list', '--format=freeze')
+
+
+class UvBackend(PipBackend):
+    name = 'uv'
+
+    def __init__(self, find_links=None, index_url=None, uv_exe=None):
+        super().__init__(find_links, index_url)
+        self._uv_exe = uv_exe
+
+    def uv_exe(self):
+        if self._uv_exe is None:
+            self._uv_exe = find_uv_exe()
+            logger.info(f'uv [{self._uv_exe}]')
+        return self._uv_exe
+
+    def venv_command(self, python_exe, venv_dir):
+        return [self.uv_exe(), 'venv', '--seed', '--python', python_exe, venv_dir]
+
+    def pip_command(self, python, command, *args):
+        if command in PIP_COMMANDS:
+            return super().pip_command(python, command, *args)
+        args = [a for a in args if a not in PIP_ONLY_OPTIONS]
+        return [self.uv_exe(), 'pip', command, '--python', python, *args, *self.index_options(command)]
+
+
+def find_uv_exe():
+    '''
+    The uv binary of the "uv" package, or uv from PATH.
+    '''
+    try:
+        from uv import find_uv_bin
+        return Path(find_uv_bin())
+    except (ImportError, FileNotFoundError):
+        pass
+    uv_exe = shutil.which('uv')
+    if uv_exe is None:
+        sys.exit('NOT FOUND uv, install it with: pip install uv')
+    return Path(uv_exe)
+
+
+def create_backend(name: str = None, find_links=None, index_url=None):
+    if name is None:
+        name = os.environ.get(INSTALLER_ENV) or PipBackend.name
+    if find_links is None:
+        find_links = os.environ.get(FIND_LINKS_ENV) or None
+    if index_url is None and find_links is None:
+        from bibiinstaller.bibiinstaller_index import get_index_url
+        index_url = get_index_url()
+    if name == PipBackend.name:
+        return PipBackend(find_links, index_url)
+    if name == UvBackend.name:
+        return UvBackend(find_links, index_url)
+    sys.exit(f"UNKNOWN installer [{name}], choose from: pip, uv")
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        logger.info(f'installer: {_backend.name}, index_url: {_backend.index_url}')
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+    logger.info(f'installer: {backend.name}, find_links: {backend.find_links}, index_url: {backend.index_url}')
+    return backend
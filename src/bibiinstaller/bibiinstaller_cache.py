@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Build cache for bibiinstaller, under BIBIINSTALLER_CACHE (or --cache_dir).
+
+Every build gets a fingerprint over all of its inputs (project tree, configs.py,
+requirement files, icon, license, nsi template, options and bibiinstaller version).
+Finished installers are stored under that fingerprint, so an unchanged build only
+copies the cached installer into dist/.
+
+Work dirs (packaging venv, pip downloads, pynsist build) live in work/<key>, keyed
+by what decides the venv contents, so later builds reuse them regardless of date.
+Project and dependency wheels live in wheels/<key> (see bibiinstaller_wheels), base venvs in venvs/ (see
+bibiinstaller_venvs), embeddable Python archives in pynsist/ (see bibiinstaller_embed), shared
+runtime installers in runtimes/<id> (see bibiinstaller_runtime), unpacked wheels in unpacked/<sha256>
+(see bibiinstaller_unpack).
+After every build the garbage collector removes work dirs, artifacts and wheels unused for
+BIBIINSTALLER_CACHE_MAX_AGE_DAYS, then the least recently used ones until the cache
+fits in BIBIINSTALLER_CACHE_MAX_SIZE; while another build runs, only unlocked work
+dirs and base venvs are removed. Staged files are stored once by content in
+objects/ (see bibiinstaller_objects), objects no staged dir references anymore are
+removed with the same age budget.
+
+    bibiinstaller cache stats|prune|clear
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from bibiinstaller import __version__
+from bibiinstaller.bibiinstaller_copy import copy
+from bibiinstaller.bibiinstaller_fingerprint import DEFAULT_EXCLUDES, DigestCache, fingerprint_tree
+from bibiinstaller.bibiinstaller_logger import logger
+
+ARTIFACTS_DIR_NAME = 'artifacts'
+ARTIFACT_JSON = 'artifact.json'
+WORK_DIR_NAME = 'work'
+WORK_JSON = 'work.json'
+GC_LOCK_NAME = 'gc.lock'
+PUBLISH_LOCK_NAME = 'publish.lock'
+# ''' entries without a lock of their own, a running build may stage from them '''
+SHARED_KINDS = ('artifact', 'wheel', 'embed', 'runtime', 'unpacked')
+MAX_AGE_DAYS_ENV = 'BIBIINSTALLER_CACHE_MAX_AGE_DAYS'
+MAX_SIZE_ENV = 'BIBIINSTALLER_CACHE_MAX_SIZE'
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_SIZE = '20G'
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def get_cache_home():
+    '''
+    BIBIINSTALLER_CACHE, or %LOCALAPPDATA%\\bibiinstaller\\cache, or ~/.cache/bibiinstaller
+    '''
+    cache_home = os.environ.get('BIBIINSTALLER_CACHE')
+    if cache_home:
+        return Path(cache_home).resolve()
+    local_app_data = os.environ.get('LOCALAPPDATA')
+    if local_app_data:
+        return (Path(local_app_data) / 'bibiinstaller' / 'cache').resolve()
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME') or (Path.home() / '.cache')
+    return (Path(xdg_cache_home) / 'bibiinstaller').resolve()
+
+
+class FileLock:
+    '''
+    Exclusive inter-process lock on path, held inside the with block.
+
+        with FileLock(get_cache_home() / 'micromamba.lock'):
+            ...
+    '''
+
+    def __init__(self, path, poll_interval=0.1):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._file = None
+
+    def _try_lock(self):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, blocking=True):
+        '''
+        Returns False when not blocking and another process holds the lock.
+        '''
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a+')
+        if self._try_lock():
+            return True
+        if not blocking:
+            self._file.close()
+            self._file = None
+            return False
+        logger.info(f'WAITING for lock [{self.path}]')
+        while not self._try_lock():
+            time.sleep(self.poll_interval)
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if os.name == 'nt':
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def build_fingerprint(parameters: dict, paths: dict, excludes=None, name='build'):
+    '''
+    parameters: plain build options, hashed by their repr.
+    paths: files, directories or lists of them, hashed by content.
+    excludes: extra gitignore-style patterns, e.g. EXCLUDE_CONFIGS.
+    '''
+    excludes = DEFAULT_EXCLUDES + list(excludes or [])
+    digest = hashlib.sha256()
+    digest.update(f'bibiinstaller=={__version__}\n'.encode('utf8'))
+    for key in sorted(parameters):
+        digest.update(f'{key}={parameters[key]!r}\n'.encode('utf8'))
+    with DigestCache() as cache:
+        for key in sorted(paths):
+            digest.update(f'{key}:\n'.encode('utf8'))
+            key_paths = paths[key] if isinstance(paths[key], (list, tuple)) else [paths[key]]
+            for path in key_paths:
+                if path and len(str(path).strip()) > 0:
+                    digest.update(f'{fingerprint_tree(path, excludes=excludes, cache=cache).digest}\n'.encode('utf8'))
+    fingerprint = digest.hexdigest()
+    logger.info(f'{name} fingerprint: [{fingerprint}]')
+    return fingerprint
+
+
+def get_artifact_dir(fingerprint):
+    return get_cache_home() / ARTIFACTS_DIR_NAME / fingerprint
+
+
+def restore_artifact(fingerprint, destination_dir):
+    '''
+    Copy the cached installer of fingerprint into destination_dir.
+
+    Returns the copied installer path, or None on a cache miss.
+    '''
+    artifact_dir = get_artifact_dir(fingerprint)
+    artifact_json = artifact_dir / ARTIFACT_JSON
+    if not artifact_json.exists():
+        logger.info(f'artifact cache MISS: [{fingerprint}]')
+        return None
+    artifact = json.loads(artifact_json.read_text(encoding='utf8'))
+    installer_file = artifact_dir / artifact['installer_exe']
+    if not installer_file.exists():
+        logger.warning(f'artifact cache BROKEN, NOT EXIST: [{installer_file}]')
+        return None
+    runtime = None
+    if artifact.get('runtime'):
+        from bibiinstaller.bibiinstaller_runtime import RUNTIME_JSON, find_runtime
+        runtime = find_runtime(artifact['runtime'])
+        if runtime is None:
+            logger.info(f'artifact cache MISS: [{fingerprint}], its runtime [{artifact["runtime"]}] was removed')
+            return None
+        os.utime(runtime.runtime_dir / RUNTIME_JSON)
+    # ''' last used time for the garbage collector '''
+    artifact_json.touch()
+    os.makedirs(destination_dir, exist_ok=True)
+    copy(installer_file, destination_dir)
+    if artifact.get('manifest') and (artifact_dir / artifact['manifest']).exists():
+        copy(artifact_dir / artifact['manifest'], destination_dir)
+    if runtime is not None:
+        copy(runtime.installer_file, destination_dir)
+    logger.info(f'artifact cache HIT: [{fingerprint}], copied [{installer_file.name}] into [{destination_dir}]')
+    return (Path(destination_dir) / installer_file.name).resolve()
+
+
+def store_artifact(fingerprint, installer_file, pynsist_cfg, manifest_file=None, runtime=None):
+    '''
+    Store the finished installer, its pynsist.cfg and its release pkgs manifest under fingerprint.
+
+    The runtime installer of a layered build stays in runtimes/, only its id is recorded.
+    '''
+    artifact_dir = get_artifact_dir(fingerprint)
+    staging_dir = artifact_dir.with_name(f'{fingerprint}.tmp-{os.getpid()}')
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir(parents=True)
+    copy(installer_file, staging_dir)
+    copy(pynsist_cfg, staging_dir / 'pynsist.cfg')
+    if manifest_file is not None:
+        copy(manifest_file, staging_dir)
+    artifact = dict(
+        fingerprint=fingerprint,
+        installer_exe=Path(installer_file).name,
+        manifest=Path(manifest_file).name if manifest_file is not None else None,
+        runtime=runtime.runtime_id if runtime is not None else None,
+        bibiinstaller_version=__version__,
+    )
+    (staging_dir / ARTIFACT_JSON).write_text(json.dumps(artifact, indent=2), encoding='utf8')
+    if artifact_dir.exists():
+        shutil.rmtree(artifact_dir)
+    os.replace(staging_dir, artifact_dir)
+    logger.info(f'artifact cache STORED: [{artifact_dir}]')
+    return artifact_dir
+
+
+def get_work_dir(key):
+    return get_cache_home() / WORK_DIR_NAME / key
+
+
+def open_work_dir(key, project_root):
+    '''
+    Lock and create the work dir of key, returns (work_dir, lock).
+
+    Builds with the same key wait for each other, the caller releases the lock.
+    '''
+    work_dir = get_work_dir(key)
+    lock = FileLock(work_dir.with_name(f'{key}.lock'))
+    lock.acquire()
+    # ''' a build starting while the garbage collector removes waits for it, see collect_garbage '''
+    with get_gc_lock():
+        pass
+    work_json = work_dir / WORK_JSON
+    reused = work_json.exists()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    if not reused:
+        work_json.write_text(json.dumps(dict(key=key, project_root=str(project_root), created=time.time()),
+                                        indent=2), encoding='utf8')
+    logger.info(f'work dir {"REUSED" if reused else "CREATED"}: [{work_dir}]')
+    return work_dir, lock
+
+
+def publish_entry(tmp_dir, entry_dir, *markers):
+    '''
+    Move the finished tmp_dir to entry_dir, returns False when a concurrent build published it first.
+
+    A complete entry (one with all of its marker files) is never replaced, another build may be staging from it.
+    '''
+    entry_dir = Path(entry_dir)
+    with FileLock(entry_dir.parent / PUBLISH_LOCK_NAME):
+        if not all((entry_dir / marker).exists() for marker in markers):
+            # ''' left incomplete, e.g. by an interrupted removal: nobody stages from it '''
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            return True
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return False
+
+
+def record_work_dir(work_dir):
+    '''
+    Record the last used time of work_dir for the garbage collector.
+    '''
+    work_json = Path(work_dir) / WORK_JSON
+    if work_json.exists():
+        work = json.loads(work_json.read_text(encoding='utf8'))
+        work.update(last_used=time.time())
+        work_json.write_text(json.dumps(work, indent=2), encoding='utf8')
+
+
+def get_gc_lock():
+    '''
+    Held by the garbage collector while it removes, builds pass it once their work dir is locked.
+    '''
+    return FileLock(get_cache_home() / GC_LOCK_NAME)
+
+
+def running_builds(current_work_dir=None):
+    '''
+    Work dirs locked by a build, other than current_work_dir.
+    '''
+    work_root = get_cache_home() / WORK_DIR_NAME
+    running = []
+    for lock_file in sorted(work_root.glob('*.lock')) if work_root.exists() else []:
+        work_dir = lock_file.with_suffix('')
+        if current_work_dir is not None and work_dir == Path(current_work_dir):
+            continue
+        lock = FileLock(lock_file)
+        if lock.acquire(blocking=False):
+            lock.release()
+        else:
+            running.append(work_dir)
+    return running
+
+
+def linked_inodes(path):
+    '''
+    (st_dev, st_ino) of the hardlinked files under path.
+    '''
+    inodes = set()
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                stat = os.lstat(os.path.join(dir_path, file_name))
+            except OSError:
+                continue
+            if stat.st_nlink > 1:
+                inodes.add((stat.st_dev, stat.st_ino))
+    return inodes
+
+
+def dir_size(path, seen=None):
+    '''
+    Bytes of the files under path, a hardlinked file counts once: not again when its inode is in seen.
+    '''
+    seen = set() if seen is None else seen
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                stat = os.lstat(os.path.join(dir_path, file_name))
+            except OSError:
+                continue
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+def parse_size(size):
+    '''
+    "20G", "512M", "1.5T" or bytes.
+    '''
+    size = str(size).strip().upper().rstrip('IB')
+    unit = size[-1] if size and size[-1] in SIZE_UNITS else ''
+    return int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def format_size(size):
+    for unit in ['', 'K', 'M', 'G']:
+        if abs(size) < 1024:
+            return f'{size:.1f}{unit}B' if unit else f'{size}B'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+
+@dataclass
+class CacheEntry:
+    kind: str
+    path: Path
+    size: int
+    last_used: float
+
+
+def list_cache_entries(kinds=('work', 'artifact', 'wheel', 'venv', 'embed', 'runtime', 'unpacked')):
+    '''
+    Cache entries sorted by last used time, oldest first.
+
+    Files hardlinked to the object store count there (see object_stats), files hardlinked
+    between entries count in the first one listed.
+    '''
+    from bibiinstaller.bibiinstaller_objects import get_objects_dir
+    entries = []
+    cache_home = get_cache_home()
+    seen = linked_inodes(get_objects_dir())
+    if 'work' in kinds and (cache_home / WORK_DIR_NAME).exists():
+        for work_dir in (cache_home / WORK_DIR_NAME).iterdir():
+            if not work_dir.is_dir():
+                continue
+            work_json = work_dir / WORK_JSON
+            work = json.loads(work_json.read_text(encoding='utf8')) if work_json.exists() else {}
+            entries.append(CacheEntry('work', work_dir, dir_size(work_dir, seen),
+                                      work.get('last_used') or work_dir.stat().st_mtime))
+    if 'artifact' in kinds and (cache_home / ARTIFACTS_DIR_NAME).exists():
+        for artifact_dir in (cache_home / ARTIFACTS_DIR_NAME).iterdir():
+            if not artifact_dir.is_dir():
+                continue
+            artifact_json = artifact_dir / ARTIFACT_JSON
+            entries.append(CacheEntry('artifact', artifact_dir, dir_size(artifact_dir, seen),
+                                      (artifact_json if artifact_json.exists() else artifact_dir).stat().st_mtime))
+    if 'wheel' in kinds:
+        from bibiinstaller.bibiinstaller_wheels import WHEEL_JSON, get_wheels_dir
+        for wheel_dir in get_wheels_dir().iterdir() if get_wheels_dir().exists() else []:
+            wheel_json = wheel_dir / WHEEL_JSON
+            if wheel_dir.is_dir() and wheel_json.exists():
+                entries.append(CacheEntry('wheel', wheel_dir, dir_size(wheel_dir, seen), wheel_json.stat().st_mtime))
+    if 'venv' in kinds:
+        from bibiinstaller.bibiinstaller_venvs import TEMPLATE_JSON, get_venvs_dir
+        for template_dir in get_venvs_dir().iterdir() if get_venvs_dir().exists() else []:
+            template_json = template_dir / TEMPLATE_JSON
+            if template_dir.is_dir():
+                entries.append(CacheEntry('venv', template_dir, dir_size(template_dir, seen),
+                                          (template_json if template_json.exists() else template_dir).stat().st_mtime))
+    if 'embed' in kinds:
+        from bibiinstaller.bibiinstaller_embed import embed_archives
+        for archive in embed_archives():
+            stat = archive.stat()
+            entries.append(CacheEntry('embed', archive, stat.st_size, stat.st_mtime))
+    if 'runtime' in kinds:
+        from bibiinstaller.bibiinstaller_runtime import RUNTIME_JSON, get_runtimes_dir
+        for runtime_dir in get_runtimes_dir().iterdir() if get_runtimes_dir().exists() else []:
+            runtime_json = runtime_dir / RUNTIME_JSON
+            if runtime_dir.is_dir() and runtime_json.exists():
+                entries.append(CacheEntry('runtime', runtime_dir, dir_size(runtime_dir, seen),
+                                          runtime_json.stat().st_mtime))
+    if 'unpacked' in kinds:
+        from bibiinstaller.bibiinstaller_unpack import UNPACKED_JSON, get_unpacked_dir
+        for entry_dir in get_unpacked_dir().iterdir() if get_unpacked_dir().exists() else []:
+            unpacked_json = entry_dir / UNPACKED_JSON
+            if entry_dir.is_dir() and unpacked_json.exists():
+                entries.append(CacheEntry('unpacked', entry_dir, dir_size(entry_dir, seen),
+                                          unpacked_json.stat().st_mtime))
+    if 'interpreter' in kinds:
+        from bibiinstaller.bibiinstaller_interpreters import LAST_USED_FILE, get_micromamba_root
+        envs_dir = get_micromamba_root() / 'envs'
+        for environment_dir in envs_dir.iterdir() if envs_dir.exists() else []:
+            last_used = environment_dir / LAST_USED_FILE
+            entries.append(CacheEntry('interpreter', environment_dir, dir_size(environment_dir, seen),
+                                      (last_used if last_used.exists() else environment_dir).stat().st_mtime))
+    return sorted(entries, key=lambda e: e.last_used)
+
+
+def get_budgets(max_age_days=None, max_size=None):
+    if max_age_days is None:
+        max_age_days = float(os.environ.get(MAX_AGE_DAYS_ENV) or DEFAULT_MAX_AGE_DAYS)
+    if max_size is None:
+        max_size = os.environ.get(MAX_SIZE_ENV) or DEFAULT_MAX_SIZE
+    return max_age_days, parse_size(max_size)
+
+
+def collect_garbage(max_age_days=None, max_size=None, dry_run=False, current_work_dir=None):
+    '''
+    Remove work dirs, artifacts, project wheels, base venvs, embeddable Pythons, runtimes and unpacked wheels
+    unused for max_age_days, then the least recently used ones until the rest fits in max_size.
+
+    Work dirs and base venvs locked by a build are skipped; the entries without a lock of their own
+    (SHARED_KINDS) are kept while a build other than the one of current_work_dir runs.
+
+    Returns the removed (or with dry_run, reclaimable) entries.
+    '''
+    max_age_days, max_size = get_budgets(max_age_days, max_size)
+    with get_gc_lock():
+        entries = list_cache_entries()
+        deadline = time.time() - max_age_days * 24 * 3600
+        total = sum(e.size for e in entries)
+        busy = running_builds(current_work_dir)
+        if busy:
+            logger.info(f'{len(busy)} builds running, {", ".join(SHARED_KINDS)} entries kept')
+        removed = []
+        for entry in entries:
+            if not (entry.last_used < deadline or total > max_size) or (busy and entry.kind in SHARED_KINDS):
+                continue
+            lock = None
+            if entry.kind in ('work', 'venv'):
+                lock = FileLock(entry.path.with_name(f'{entry.path.name}.lock'))
+                if not lock.acquire(blocking=False):
+                    logger.info(f'SKIP {entry.kind} in use: [{entry.path}]')
+                    continue
+            try:
+                if not dry_run:
+                    remove_entry(entry)
+            finally:
+                if lock is not None:
+                    lock.release()
+            # ''' only what is removed counts against the size budget '''
+            total -= entry.size
+            removed.append(entry)
+        # ''' a running build may not have saved the references of the objects it staged yet '''
+        if not dry_run and not busy:
+            from bibiinstaller.bibiinstaller_objects import prune_objects
+            prune_objects(max_age_days)
+    return removed
+
+
+def remove_entry(entry):
+    if entry.kind == 'embed':
+        from bibiinstaller.bibiinstaller_embed import remove_embed
+        remove_embed(entry.path)
+    else:
+        shutil.rmtree(entry.path, ignore_errors=True)
+    logger.info(f'REMOVED {entry.kind} [{entry.path}] {format_size(entry.size)}')
+
+
+def clear_cache():
+    '''
+    Remove every work dir and base venv (except those in use), artifact, wheel, object, interpreter, pynsist
+    download and the digest cache.
+    '''
+    from bibiinstaller.bibiinstaller_embed import get_embed_dir
+    from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+    from bibiinstaller.bibiinstaller_interpreters import get_micromamba_lock, get_micromamba_root
+    from bibiinstaller.bibiinstaller_objects import get_objects_dir
+    from bibiinstaller.bibiinstaller_wheels import get_wheels_dir
+    removed = collect_garbage(max_age_days=0, max_size=0)
+    shutil.rmtree(get_objects_dir(), ignore_errors=True)
+    shutil.rmtree(get_wheels_dir(), ignore_errors=True)
+    shutil.rmtree(get_embed_dir(), ignore_errors=True)
+    with get_micromamba_lock():
+        shutil.rmtree(get_micromamba_root(), ignore_errors=True)
+    digests_file = DigestCache().cache_file
+    if digests_file.exists():
+        digests_file.unlink()
+    return removed
+
+
+def object_stats():
+    '''
+    (objects, bytes, unreferenced objects, unreferenced bytes) of the object store.
+    '''
+    from bibiinstaller.bibiinstaller_objects import iter_objects, referenced_digests
+    referenced = referenced_digests()
+    counts = [0, 0, 0, 0]
+    for digest, object_path in iter_objects():
+        stat = os.stat(object_path)
+        counts[0] += 1
+        counts[1] += stat.st_size
+        if digest not in referenced and stat.st_nlink <= 1:
+            counts[2] += 1
+            counts[3] += stat.st_size
+    return counts
+
+
+def print_stats(max_age_days=None, max_size=None):
+    max_age_days, max_size = get_budgets(max_age_days, max_size)
+    entries = list_cache_entries(kinds=('work', 'artifact', 'wheel', 'venv', 'embed', 'runtime', 'unpacked', 'interpreter'))
+    print(f'cache: [{get_cache_home()}]')
+    for kind in ['work', 'artifact', 'wheel', 'venv', 'embed', 'runtime', 'unpacked', 'interpreter']:
+        kind_entries = [e for e in entries if e.kind == kind]
+        print(f'{kind:12} {len(kind_entries):5}  {format_size(sum(e.size for e in kind_entries)):>10}')
+    objects = object_stats()
+    print(f'{"object":12} {objects[0]:5}  {format_size(objects[1]):>10}  ({objects[2]} unreferenced, '
+          f'{format_size(objects[3])})')
+    print(f'{"total":12} {len(entries) + objects[0]:5}  '
+          f'{format_size(sum(e.size for e in entries) + objects[1]):>10}')
+    reclaimable = collect_garbage(max_age_days, max_size, dry_run=True)
+    print(f'{"reclaimable":12} {len(reclaimable):5}  {format_size(sum(e.size for e in reclaimable)):>10}'
+          f'  (max age {max_age_days:g} days, max size {format_size(max_size)})')
+    for entry in reclaimable:
+        print(f'    {entry.kind:10} {format_size(entry.size):>10}  {entry.path}')
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='bibiinstaller cache',
+        description=f'manage the bibiinstaller cache [{get_cache_home()}].')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    budgets = argparse.ArgumentParser(add_help=False)
+    budgets.add_argument('--days', type=float,
+                         help=f'max age in days (default: ${MAX_AGE_DAYS_ENV} or {DEFAULT_MAX_AGE_DAYS})')
+    budgets.add_argument('--max_size',
+                         help=f'max size of work dirs, artifacts and wheels, e.g. 20G (default: ${MAX_SIZE_ENV} '
+                              f'or {DEFAULT_MAX_SIZE})')
+    subparsers.add_parser('stats', parents=[budgets], help='report sizes and reclaimable space')
+    prune_parser = subparsers.add_parser('prune', parents=[budgets],
+                                         help='remove work dirs, artifacts, wheels, base venvs and interpreters over the budgets, '
+                                              'and the downloaded micromamba package archives')
+    prune_parser.add_argument('--keep_archives', action='store_true', help='keep the package archives')
+    subparsers.add_parser('clear', help='remove everything but the work dirs in use')
+    args = parser.parse_args(argv)
+
+    if args.action == 'stats':
+        print_stats(args.days, args.max_size)
+    elif args.action == 'prune':
+        from bibiinstaller.bibiinstaller_interpreters import prune_interpreters
+        max_age_days, _ = get_budgets(args.days, args.max_size)
+        removed = collect_garbage(args.days, args.max_size)
+        removed_interpreters = prune_interpreters(days=max_age_days, archives=not args.keep_archives)
+        print(f'{len(removed) + len(removed_interpreters)} removed, '
+              f'{format_size(sum(e.size for e in removed))} reclaimed from work dirs, artifacts and wheels')
+    elif args.action == 'clear':
+        removed = clear_cache()
+        print(f'cleared [{get_cache_home()}], {format_size(sum(e.size for e in removed))} '
+              f'reclaimed from work dirs, artifacts and wheels')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,6 +30,8 @@ EXTRA_PACKAGES: list = []
 SKIP_PYPI_PACKAGES: list = []
 EDITABLE_PACKAGES: list = []
 UNWANTED_PACKAGES: list = []
+# ''' e.g: [ 'PyQt6==6.6.1', 'numpy' ], a runtime installer shared by the apps listing the same packages '''
+RUNTIME_PACKAGES: list = []
 
 '''
 FILES 
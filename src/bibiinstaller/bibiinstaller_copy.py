@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Copy engine for staging and installers.
+
+Trees are walked with os.scandir; files of PARALLEL_MIN_FILE_SIZE and more are
+copied on a thread pool, smaller ones in the calling thread, where a copy costs
+less than handing it to a worker (as shutil.copytree does it). Each file is
+copied in the kernel with copy_file_range or sendfile where the platform has
+them, otherwise through a large buffer, then its mode and times are copied like
+shutil.copy2. Copies of trees report their throughput.
+
+    stats = copy_tree(assets_dir, pynsist_pkgs_dir)
+    copy_file(installer_file, dist_dir / installer_file.name)
+"""
+import errno
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+KERNEL_COPY_CHUNK = 1024 * 1024 * 1024
+# ''' a thread pool copy of small files was ~50% slower than shutil.copytree, see test_bench_pipeline '''
+PARALLEL_MIN_FILE_SIZE = 1024 * 1024
+# ''' errors of copy_file_range/sendfile meaning "not supported here", the next method is tried '''
+UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF,
+                      errno.ENOTSOCK}
+
+_kernel_copy = {
+    'copy_file_range': hasattr(os, 'copy_file_range'),
+    'sendfile': hasattr(os, 'sendfile') and os.name == 'posix',
+}
+
+
+@dataclass
+class CopyStats:
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, size):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+    @property
+    def throughput(self):
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f'{self.files} files, {self.bytes / 1024 / 1024:.1f}MB in {self.seconds:.2f}s '
+                f'({self.throughput / 1024 / 1024:.1f}MB/s)')
+
+
+def _kernel_copy_loop(method, src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = min(KERNEL_COPY_CHUNK, size - copied)
+        if method == 'copy_file_range':
+            sent = os.copy_file_range(src_fd, dst_fd, count)
+        else:
+            sent = os.sendfile(dst_fd, src_fd, copied, count)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def copy_file_data(src, dst, size):
+    '''
+    Copy the bytes of the open file src into dst, in the kernel when possible.
+    '''
+    for method in ['copy_file_range', 'sendfile']:
+        if not _kernel_copy[method] or size == 0:
+            continue
+        try:
+            if _kernel_copy_loop(method, src.fileno(), dst.fileno(), size) == size:
+                return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            logger.debug(f'{method} unsupported [{e}], falling back')
+            _kernel_copy[method] = False
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+    buffer = bytearray(min(COPY_BUFFER_SIZE, size + 1))
+    view = memoryview(buffer)
+    while True:
+        n = src.readinto(buffer)
+        if not n:
+            break
+        dst.write(view[:n])
+
+
+def copy_file(source, target, preserve=True):
+    '''
+    Copy source to target (a file path), with mode and times when preserve, returns its size.
+    '''
+    size = os.stat(source).st_size
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        copy_file_data(src, dst, size)
+    if preserve:
+        shutil.copystat(source, target)
+    return size
+
+
+def copy(source, target, preserve=True):
+    '''
+    shutil.copy2 replacement: target may be a directory. Returns the copied file path.
+    '''
+    target = Path(target)
+    if target.is_dir():
+        target = target / Path(source).name
+    copy_file(source, target, preserve=preserve)
+    return target
+
+
+def scan_tree(source_dir, rel_dir=''):
+    '''
+    Yield (rel_dir, [(name, size) of files]) for every directory of source_dir, parents first.
+    '''
+    dirs = [(Path(source_dir), rel_dir)]
+    while dirs:
+        dir_path, rel_dir = dirs.pop()
+        files = []
+        sub_dirs = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    sub_dirs.append((Path(entry.path), os.path.join(rel_dir, entry.name)))
+                elif entry.is_file():
+                    files.append((entry.name, entry.stat().st_size))
+        yield rel_dir, files
+        dirs.extend(reversed(sub_dirs))
+
+
+def copy_tree(source_dir, target_dir, max_workers=None, preserve=True):
+    '''
+    shutil.copytree(dirs_exist_ok=True), large files on a thread pool, returns CopyStats.
+
+    Single CPU machines and max_workers=1 copy every file in the calling thread.
+    '''
+    source_dir = Path(source_dir)
+    target_dir = Path(target_dir)
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    parallel = max_workers > 1 and (os.cpu_count() or 1) > 1
+    stats = CopyStats()
+    started = time.perf_counter()
+
+    def copy_one(rel_path):
+        stats.add(copy_file(source_dir / rel_path, target_dir / rel_path, preserve=preserve))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        for rel_dir, files in scan_tree(source_dir):
+            (target_dir / rel_dir).mkdir(parents=True, exist_ok=True)
+            for name, size in files:
+                if parallel and size >= PARALLEL_MIN_FILE_SIZE:
+                    futures.append(pool.submit(copy_one, os.path.join(rel_dir, name)))
+                else:
+                    copy_one(os.path.join(rel_dir, name))
+        for future in futures:
+            future.result()
+    if preserve:
+        shutil.copystat(source_dir, target_dir)
+    stats.seconds = time.perf_counter() - started
+    logger.info(f'COPIED [{source_dir}] -> [{target_dir}]: {stats}')
+    return stats
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Duplicate binaries in the staged payload (pynsist_pkgs).
+
+Scientific and Qt stacks ship the same DLLs in several packages
+(vcruntime140.dll, msvcp140.dll, OpenMP runtimes, OpenBLAS copies). Binaries
+sharing their size are hashed on a process pool (digests come from the
+DigestCache when unchanged), identical ones are grouped and written with the
+payload sizes to <work_dir>/payload_report.json:
+
+    dedup_binaries=report     report only (default)
+    dedup_binaries=collapse   also keep one copy of the safe duplicates
+    dedup_binaries=off
+
+Safe duplicates are runtime DLLs with the same name that Windows finds
+through the loader search path: their single copy moves to the directory of
+the embedded python.exe ($INSTDIR\\Python), which the loader searches for the
+dependencies of every extension module. Names the embeddable Python ships
+itself (vcruntime140.dll, vcruntime140_1.dll) are left in place: an older copy
+from a package must not replace the interpreter's own.
+"""
+import fnmatch
+import json
+import os
+import shutil
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_cache import format_size
+from bibiinstaller.bibiinstaller_fingerprint import DigestCache, hash_file
+from bibiinstaller.bibiinstaller_logger import logger
+
+DEDUP_MODES = ['off', 'report', 'collapse']
+BINARY_SUFFIXES = ('.dll', '.pyd', '.exe', '.so')
+# ''' runtime DLLs loaded by name, never by absolute path '''
+SAFE_DLL_PATTERNS = ['vcruntime140*.dll', 'msvcp140*.dll', 'concrt140.dll', 'vccorlib140.dll', 'vcomp140.dll',
+                     'libiomp5md.dll', 'ucrtbase.dll', 'api-ms-win-*.dll']
+SHARED_DIR_NAME = 'shared_binaries'
+PYTHON_INSTALL_DIR = '$INSTDIR\\Python'
+PAYLOAD_REPORT = 'payload_report.json'
+
+
+@dataclass
+class DuplicateGroup:
+    digest: str
+    size: int
+    paths: list = field(default_factory=list)
+
+    @property
+    def wasted(self):
+        return self.size * (len(self.paths) - 1)
+
+    @property
+    def names(self):
+        return sorted({Path(p).name.lower() for p in self.paths})
+
+    def is_safe(self):
+        names = self.names
+        return len(names) == 1 and any(fnmatch.fnmatch(names[0], p) for p in SAFE_DLL_PATTERNS)
+
+
+def scan_binaries(payload_dir):
+    '''
+    {path: stat} of every binary under payload_dir, and the total payload size.
+    '''
+    binaries = {}
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(payload_dir):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            stat = os.stat(file_path)
+            total += stat.st_size
+            if file_name.lower().endswith(BINARY_SUFFIXES):
+                binaries[file_path] = stat
+    return binaries, total
+
+
+def find_duplicate_binaries(payload_dir, cache: DigestCache = None, max_workers=None, binaries=None):
+    '''
+    Groups of identical binaries under payload_dir, most wasted bytes first.
+
+    Only binaries sharing their size with another one are hashed, cache misses on a process pool.
+    '''
+    if binaries is None:
+        binaries, _ = scan_binaries(payload_dir)
+    by_size = defaultdict(list)
+    for file_path, stat in binaries.items():
+        by_size[stat.st_size].append(file_path)
+    candidates = [p for paths in by_size.values() if len(paths) > 1 for p in paths]
+    digests = {}
+    misses = []
+    for file_path in candidates:
+        digest = cache.get(file_path, binaries[file_path]) if cache is not None else None
+        if digest is None:
+            misses.append(file_path)
+        else:
+            digests[file_path] = digest
+    if misses:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            sizes = [binaries[p].st_size for p in misses]
+            for file_path, digest in zip(misses, pool.map(hash_file, misses, sizes, chunksize=8)):
+                digests[file_path] = digest
+                if cache is not None:
+                    cache.put(file_path, binaries[file_path], digest)
+    groups = {}
+    for file_path in sorted(digests):
+        digest = digests[file_path]
+        groups.setdefault(digest, DuplicateGroup(digest, binaries[file_path].st_size)).paths.append(file_path)
+    return sorted([g for g in groups.values() if len(g.paths) > 1], key=lambda g: g.wasted, reverse=True)
+
+
+def embed_file_names(embed_archive):
+    '''
+    Lowercase names of the files at the top of the embeddable Python archive, installed into $INSTDIR\\Python.
+    '''
+    if not embed_archive or not Path(embed_archive).is_file():
+        return set()
+    with zipfile.ZipFile(embed_archive) as z:
+        return {n.lower() for n in z.namelist() if '/' not in n.rstrip('/')}
+
+
+def collapse_duplicates(groups, shared_dir, reserved_names=()):
+    '''
+    Move one copy of every safe group into shared_dir and remove the others.
+
+    Returns {shared file: group}, one per name: a second group with the same name stays as is, and so
+    does a group named like one of reserved_names (the files of the embeddable Python).
+    '''
+    shared_dir = Path(shared_dir)
+    shutil.rmtree(shared_dir, ignore_errors=True)
+    shared_dir.mkdir(parents=True)
+    shared_files = {}
+    for group in groups:
+        if not group.is_safe() or (shared_dir / group.names[0]).exists():
+            continue
+        if group.names[0] in reserved_names:
+            logger.info(f'KEPT {len(group.paths)} x {group.names[0]}, the embeddable Python ships its own')
+            continue
+        shared_file = shared_dir / group.names[0]
+        os.replace(group.paths[0], shared_file)
+        for file_path in group.paths[1:]:
+            os.unlink(file_path)
+        shared_files[shared_file] = group
+    return shared_files
+
+
+def dedup_payload(payload_dir, work_dir, mode='report', embed_archive=None):
+    '''
+    Report duplicate binaries of payload_dir, collapse the safe ones with mode "collapse", except the
+    names embed_archive ships.
+
+    Returns pynsist "files" lines installing the shared copies next to python.exe.
+    '''
+    if mode == 'off':
+        return []
+    started = time.perf_counter()
+    binaries, payload_bytes = scan_binaries(payload_dir)
+    with DigestCache() as cache:
+        groups = find_duplicate_binaries(payload_dir, cache=cache, binaries=binaries)
+    shared_files = {}
+    if mode == 'collapse':
+        shared_files = collapse_duplicates(groups, Path(work_dir) / SHARED_DIR_NAME, embed_file_names(embed_archive))
+    report = dict(
+        payload_dir=str(payload_dir), payload_bytes=payload_bytes,
+        binary_count=len(binaries), binary_bytes=sum(s.st_size for s in binaries.values()),
+        wasted_bytes=sum(g.wasted for g in groups),
+        collapsed_bytes=sum(g.wasted for g in shared_files.values()),
+        duplicates=[dict(digest=g.digest, size=g.size, wasted=g.wasted, safe=g.is_safe(),
+                         collapsed=g in shared_files.values(),
+                         paths=[os.path.relpath(p, payload_dir) for p in g.paths]) for g in groups])
+    report_file = Path(work_dir) / PAYLOAD_REPORT
+    report_file.write_text(json.dumps(report, indent=2), encoding='utf8')
+    logger.info(f'DUPLICATES {len(groups)} groups of binaries, {format_size(report["wasted_bytes"])} wasted, '
+                f'{format_size(report["collapsed_bytes"])} collapsed in {time.perf_counter() - started:.2f}s, '
+                f'report [{report_file}]')
+    for group in groups[:10]:
+        logger.info(f'    {format_size(group.wasted):>10}  {len(group.paths)} x {", ".join(group.names)}')
+    return [f'{f} > {PYTHON_INSTALL_DIR}' for f in shared_files]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Patch installers between two releases.
+
+    bibiinstaller delta --from releases/1.0/app_64bit.pkgs.manifest.json --to <work dir>/build/nsis
+
+Every installer build records the pkgs manifest of its payload (sha256 and
+size per file, see bibiinstaller_manifest), kept next to the installer in
+dist/ as <installer>.pkgs.manifest.json. delta compares the manifest of an
+old release with a new build and compiles a patch installer holding only the
+added and changed files of pkgs, the new manifest and the upgrade script.
+
+The patch applies to one base only: before anything is written, the
+installed Python checks that the installed manifest has the sha256 of the
+--from manifest and that its files are all in place, then deletes the
+changed and removed files. A mismatched base is refused untouched.
+
+--from: a manifest, or a dir holding one (dist/, an installation, a build/nsis or work dir).
+--to: the build/nsis dir (or the work dir) of the new build, with its pkgs.
+
+Patches cover pkgs only: builds with another Python, name or bitness need
+the full installer.
+"""
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+from bibiinstaller.bibiinstaller_manifest import (
+    MANIFEST_NAME, PKGS_DIR_NAME, UPGRADE_SCRIPT_NAME, manifest_sha256, plan_upgrade, read_manifest
+)
+
+PATCH_NSI_TEMPLATE = Path(__file__).parent / 'nsi_templates' / 'bibiinstaller_patch.nsi'
+INSTALL_PKGS = '''SetOutPath "$INSTDIR\\pkgs"
+  File /r "pkgs\\*.*"'''
+
+
+@dataclass
+class Delta:
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    patch_bytes: int = 0
+    total_bytes: int = 0
+
+    @property
+    def files(self):
+        return sorted(self.added + self.changed)
+
+
+def find_manifest(path):
+    '''
+    The pkgs manifest of a release or build path.
+    '''
+    path = Path(path)
+    if path.is_file():
+        return path
+    for manifest_file in [path / MANIFEST_NAME, path / 'build' / 'nsis' / MANIFEST_NAME]:
+        if manifest_file.is_file():
+            return manifest_file
+    releases = sorted(path.glob(f'*.{MANIFEST_NAME}'))
+    if len(releases) == 1:
+        return releases[0]
+    sys.exit(f"NOT FOUND {MANIFEST_NAME} in [{path}]" if not releases else
+             f"AMBIGUOUS [{path}]: {', '.join(r.name for r in releases)}, pass the manifest itself")
+
+
+def find_build_dir(path):
+    '''
+    The dir holding the pkgs payload and pkgs.manifest.json of a build.
+    '''
+    path = Path(path)
+    for build_dir in [path, path / 'build' / 'nsis']:
+        if (build_dir / MANIFEST_NAME).is_file() and (build_dir / PKGS_DIR_NAME).is_dir():
+            return build_dir
+    sys.exit(f"NOT FOUND {PKGS_DIR_NAME} and {MANIFEST_NAME} of a build in [{path}]")
+
+
+def plan_delta(old, new):
+    changed, removed = plan_upgrade(old, new)
+    added = sorted(set(new['files']) - set(old['files']))
+    return Delta(added=added, changed=changed, removed=removed,
+                 patch_bytes=sum(new['files'][f][1] for f in added + changed),
+                 total_bytes=sum(size for _, size in new['files'].values()))
+
+
+def check_compatible(old, new):
+    '''
+    Exit when the base can not be patched into the new build.
+    '''
+    for key in ['name', 'bitness', 'python']:
+        if old.get(key) != new.get(key):
+            sys.exit(f"CHANGED {key} [{old.get(key)}] -> [{new.get(key)}]: "
+                     f"patches only cover pkgs, ship the full installer")
+    if not new.get('name'):
+        sys.exit("NO application name in the manifest, rebuild with this bibiinstaller version")
+
+
+def stage_file(build_dir: Path, patch_dir: Path, rel_path, digest):
+    from bibiinstaller.bibiinstaller_copy import copy_file
+    from bibiinstaller.bibiinstaller_fingerprint import hash_file
+    source = build_dir / PKGS_DIR_NAME / rel_path
+    if not source.is_file() or hash_file(source) != digest:
+        sys.exit(f"CHANGED since its manifest was written: [{source}], build again")
+    target = patch_dir / PKGS_DIR_NAME / rel_path
+    target.parent.mkdir(parents=True, exist_ok=True)
+    return copy_file(source, target)
+
+
+def stage_patch(build_dir, delta: Delta, new_manifest_file, patch_dir, max_workers=None):
+    '''
+    Copy the added and changed files, checked against the manifest, the manifest and the upgrade script.
+    '''
+    from bibiinstaller import bibiinstaller_manifest
+    from bibiinstaller.bibiinstaller_copy import copy_file
+    build_dir, patch_dir = Path(build_dir), Path(patch_dir)
+    new = read_manifest(new_manifest_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(lambda f: stage_file(build_dir, patch_dir, f, new['files'][f][0]), delta.files))
+    copy_file(new_manifest_file, patch_dir / MANIFEST_NAME, preserve=False)
+    copy_file(bibiinstaller_manifest.__file__, patch_dir / UPGRADE_SCRIPT_NAME, preserve=False)
+    return patch_dir
+
+
+def patch_installer_name(old, new, old_manifest_file):
+    base_version = old.get('version') or manifest_sha256(old_manifest_file)[:8]
+    return f"{new['name']}_{new.get('bitness') or 64}bit_patch_{base_version}_to_{new.get('version')}.exe"
+
+
+def render_patch_nsi(patch_dir, old, new, old_manifest_file, installer_name, delta: Delta,
+                     compression=None, compression_dict_size=None):
+    from string import Template
+    from bibiinstaller.bibiinstaller_nsis import compression_directives
+
+    class CustomTemplate(Template):
+        delimiter = '@'
+
+    template = CustomTemplate(PATCH_NSI_TEMPLATE.read_text(encoding='utf8'))
+    nsi_text = template.substitute(dict(
+        PRODUCT_NAME=new['name'], PRODUCT_VERSION=new.get('version') or '',
+        BASE_VERSION=old.get('version') or '', BASE_MANIFEST_SHA256=manifest_sha256(old_manifest_file),
+        BITNESS=new.get('bitness') or 64, INSTALLER_NAME=installer_name,
+        COMPRESSION=compression_directives(compression, compression_dict_size),
+        INSTALL_PKGS=INSTALL_PKGS if delta.files else '; no added or changed files'))
+    nsi_file = Path(patch_dir) / 'patch.nsi'
+    nsi_file.write_text(nsi_text, encoding='utf8', newline='\n')
+    return nsi_file
+
+
+def find_makensis(build_dir):
+    '''
+    makensis from PATH, or the one a build extracted into its work dir.
+    '''
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    makensis = shutil.which('makensis')
+    work_nsis_dir = Path(build_dir).resolve().parents[1] / 'windows_assets' / 'nsis-3.10-win'
+    if makensis is None and work_nsis_dir.is_dir():
+        makensis = shutil.which('makensis', path=str(get_toolchain().makensis_dir(work_nsis_dir)))
+    if makensis is None:
+        sys.exit('NOT FOUND makensis in PATH')
+    return makensis
+
+
+def make_patch(from_path, to_path, destination_dir, compression=None, compression_dict_size=None,
+               dry_run=False):
+    '''
+    Compile the patch installer from the release at from_path to the build at to_path into destination_dir.
+
+    Returns (patch installer or None on dry_run, Delta).
+    '''
+    from bibiinstaller.bibiinstaller_cache import format_size
+    from bibiinstaller.bibiinstaller_windows import subprocess_run
+    old_manifest_file = find_manifest(from_path)
+    build_dir = find_build_dir(to_path)
+    old, new = read_manifest(old_manifest_file), read_manifest(build_dir / MANIFEST_NAME)
+    if old is None or new is None:
+        sys.exit(f"UNREADABLE {MANIFEST_NAME}: [{old_manifest_file}] or [{build_dir / MANIFEST_NAME}]")
+    check_compatible(old, new)
+    delta = plan_delta(old, new)
+    logger.info(f"delta {old.get('version')} -> {new.get('version')}: {len(delta.added)} added, "
+                f"{len(delta.changed)} changed, {len(delta.removed)} removed, "
+                f"{format_size(delta.patch_bytes)} of {format_size(delta.total_bytes)}")
+    if dry_run:
+        return None, delta
+    if not (delta.files or delta.removed):
+        sys.exit(f"NOTHING changed between [{old_manifest_file}] and [{build_dir}]")
+    makensis = find_makensis(build_dir)
+
+    installer_name = patch_installer_name(old, new, old_manifest_file)
+    destination_dir = Path(destination_dir)
+    patch_dir = destination_dir / f'.{Path(installer_name).stem}.build'
+    shutil.rmtree(patch_dir, ignore_errors=True)
+    patch_dir.mkdir(parents=True)
+    stage_patch(build_dir, delta, build_dir / MANIFEST_NAME, patch_dir)
+    nsi_file = render_patch_nsi(patch_dir, old, new, old_manifest_file, installer_name, delta,
+                                compression=compression, compression_dict_size=compression_dict_size)
+    if subprocess_run([makensis, '/V2', nsi_file], exit=False) != 0:
+        sys.exit(f"FAILED makensis, the patch is staged in [{patch_dir}]")
+    patch_installer = destination_dir / installer_name
+    os.replace(patch_dir / installer_name, patch_installer)
+    shutil.rmtree(patch_dir, ignore_errors=True)
+    logger.info(f"Patch installer created [{patch_installer}]")
+    return patch_installer, delta
+
+
+def main(argv=None):
+    import argparse
+    from bibiinstaller.bibiinstaller_cache import format_size
+    from bibiinstaller.bibiinstaller_nsis import COMPRESSION_PROFILES, DEFAULT_COMPRESSION
+    parser = argparse.ArgumentParser(
+        prog='bibiinstaller delta',
+        description='build a patch installer with the pkgs files changed between two releases.')
+    parser.add_argument('--from', dest='from_path', required=True,
+                        help=f'the {MANIFEST_NAME} of the installed release, or a dir holding it')
+    parser.add_argument('--to', dest='to_path', required=True, help='the build/nsis or work dir of the new build')
+    parser.add_argument('--dist', default='dist', help='where the patch installer is written (default: dist)')
+    parser.add_argument('--compression', choices=list(COMPRESSION_PROFILES), default=DEFAULT_COMPRESSION)
+    parser.add_argument('--compression_dict_size', type=int)
+    parser.add_argument('--dry_run', action='store_true', help='print the delta only')
+    args = parser.parse_args(argv)
+
+    patch_installer, delta = make_patch(args.from_path, args.to_path, args.dist, compression=args.compression,
+                                        compression_dict_size=args.compression_dict_size, dry_run=args.dry_run)
+    print(f'{len(delta.added)} added, {len(delta.changed)} changed, {len(delta.removed)} removed, '
+          f'{format_size(delta.patch_bytes)} of {format_size(delta.total_bytes)}')
+    if patch_installer is not None:
+        print(patch_installer)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
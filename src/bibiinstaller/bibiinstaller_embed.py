@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Verified cache of the python.org embeddable Python archives, shared with pynsist.
+
+With format=bundled pynsist downloads python-X.Y.Z-embed-amd64.zip (win32 for
+32 bit) into its own cache dir, and the embed version was found by probing
+python.org for every micro version. Now the archives live in the cache home:
+
+    <cache>/pynsist/python-3.9.13-embed-amd64.zip
+    <cache>/pynsist/embed.json
+
+and pynsist runs with PYNSIST_CACHE_DIR pointing there, so it never downloads
+them itself. run_installer prefetches the archive in a background thread
+while the packaging venv is built. Downloads are checked to be embeddable
+builds (python.exe, pythonXY.zip, pythonXY._pth) and their sha256 is recorded
+in embed.json; cached archives are checked against it before every use and
+fetched again on a mismatch. The embed version of X.Y is the newest cached
+one, python.org is only probed (in parallel) while none is cached, so builds
+make no python.org traffic once the cache is warm.
+BIBIINSTALLER_PYTHON_FTP points at a python.org mirror.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_cache import FileLock, get_cache_home
+from bibiinstaller.bibiinstaller_logger import logger
+
+EMBED_DIR_NAME = 'pynsist'
+EMBED_JSON = 'embed.json'
+PYTHON_FTP_ENV = 'BIBIINSTALLER_PYTHON_FTP'
+DEFAULT_PYTHON_FTP = 'https://www.python.org/ftp/python'
+EMBED_PATTERN = re.compile(r'python-(\d+)\.(\d+)\.(\d+)-embed-(amd64|win32)\.zip')
+MAX_MICRO_VERSION = 20
+CHUNK_SIZE = 1024 * 1024
+
+_manifest_lock = threading.Lock()
+
+
+def get_embed_dir():
+    return get_cache_home() / EMBED_DIR_NAME
+
+
+def embed_arch(bitness=64):
+    return 'amd64' if int(bitness) == 64 else 'win32'
+
+
+def embed_filename(version, bitness=64):
+    return f'python-{version}-embed-{embed_arch(bitness)}.zip'
+
+
+def embed_url(version, bitness=64):
+    python_ftp = os.environ.get(PYTHON_FTP_ENV) or DEFAULT_PYTHON_FTP
+    return f'{python_ftp.rstrip("/")}/{version}/{embed_filename(version, bitness)}'
+
+
+def read_manifest():
+    embed_json = get_embed_dir() / EMBED_JSON
+    return json.loads(embed_json.read_text(encoding='utf8')) if embed_json.exists() else {}
+
+
+def update_manifest(filename, record):
+    with _manifest_lock, FileLock(get_embed_dir() / f'{EMBED_JSON}.lock'):
+        manifest = read_manifest()
+        if record is None:
+            manifest.pop(filename, None)
+        else:
+            manifest[filename] = record
+        embed_json = get_embed_dir() / EMBED_JSON
+        tmp_json = embed_json.with_name(f'{EMBED_JSON}.tmp-{os.getpid()}-{threading.get_ident()}')
+        tmp_json.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf8')
+        os.replace(tmp_json, embed_json)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_embed_archive(archive, version):
+    '''
+    Whether archive is a readable embeddable build of version: python.exe, pythonXY.zip and pythonXY._pth.
+    '''
+    xy = ''.join(str(version).split('.')[:2])
+    try:
+        with zipfile.ZipFile(archive) as z:
+            names = {name.lower() for name in z.namelist()}
+            return z.testzip() is None and {'python.exe', f'python{xy}.zip', f'python{xy}._pth'} <= names
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def verified_archive(version, bitness=64):
+    '''
+    The cached archive of version, when its size and sha256 match embed.json, else None.
+    '''
+    filename = embed_filename(version, bitness)
+    archive = get_embed_dir() / filename
+    record = read_manifest().get(filename)
+    if record is None or not archive.is_file() or archive.stat().st_size != record['size']:
+        return None
+    if file_sha256(archive) != record['sha256']:
+        logger.warning(f'sha256 MISMATCH of cached [{archive}], fetching it again')
+        return None
+    return archive
+
+
+def cached_embed_versions(python_version, bitness=64):
+    '''
+    X.Y.Z versions of python_version's X.Y with a cached archive of bitness, newest first.
+    '''
+    major, minor = str(python_version).split('.')[:2]
+    manifest = read_manifest()
+    versions = []
+    for filename in manifest:
+        match = EMBED_PATTERN.fullmatch(filename)
+        if match and match.group(1, 2) == (major, minor) and match.group(4) == embed_arch(bitness):
+            if (get_embed_dir() / filename).is_file():
+                versions.append(tuple(int(v) for v in match.group(1, 2, 3)))
+    return ['.'.join(map(str, v)) for v in sorted(versions, reverse=True)]
+
+
+def url_exists(url, timeout=5):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout):
+            return True
+    except (OSError, ValueError):
+        return False
+
+
+def resolve_embed_version(python_version, bitness=64):
+    '''
+    The newest cached X.Y.Z of python_version, else the newest one on python.org, else python_version.
+    '''
+    cached = cached_embed_versions(python_version, bitness)
+    if cached:
+        logger.info(f'embed version cache HIT: {python_version} -> {cached[0]}')
+        return cached[0]
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    major, minor = str(python_version).split('.')[:2]
+    versions = [f'{major}.{minor}.{micro}' for micro in range(MAX_MICRO_VERSION, -1, -1)]
+    urls = [get_toolchain().python_embed_url(version, bitness) for version in versions]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        exists = list(pool.map(url_exists, urls))
+    version = next((v for v, e in zip(versions, exists) if e), python_version)
+    logger.info(f'embed version PROBED: {python_version} -> {version}')
+    return version
+
+
+def fetch_embed(version, bitness=64):
+    '''
+    The verified archive of version and bitness, downloaded on a miss. None when it cannot be fetched.
+    '''
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    filename = embed_filename(version, bitness)
+    embed_dir = get_embed_dir()
+    embed_dir.mkdir(parents=True, exist_ok=True)
+    with FileLock(embed_dir / f'{filename}.lock'):
+        archive = verified_archive(version, bitness)
+        if archive is not None:
+            logger.info(f'embed archive HIT: [{archive}]')
+            os.utime(archive)
+            return archive
+        url = get_toolchain().python_embed_url(version, bitness)
+        started = time.perf_counter()
+        archive = embed_dir / filename
+        tmp_file = archive.with_name(f'{filename}.tmp-{os.getpid()}')
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response, open(tmp_file, 'wb') as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+        except (OSError, ValueError) as e:
+            tmp_file.unlink(missing_ok=True)
+            logger.warning(f'FAILED to fetch [{url}]: {e}')
+            return None
+        if not check_embed_archive(tmp_file, version):
+            tmp_file.unlink()
+            logger.warning(f'NOT an embeddable Python archive: [{url}]')
+            return None
+        update_manifest(filename, dict(sha256=file_sha256(tmp_file), size=tmp_file.stat().st_size,
+                                       url=url, fetched=time.time()))
+        os.replace(tmp_file, archive)
+        logger.info(f'FETCHED [{url}] -> [{archive}] in {time.perf_counter() - started:.2f}s')
+        return archive
+
+
+def get_embed(python_version, bitness=64):
+    '''
+    (embed version, cached archive or None) of python_version.
+    '''
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    version = get_toolchain().python_embed_version(python_version, bitness)
+    return version, fetch_embed(version, bitness)
+
+
+def prefetch_embed(python_version, bitness=64):
+    '''
+    Future of get_embed(python_version, bitness), run in a background thread.
+    '''
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed-prefetch')
+    future = executor.submit(get_embed, python_version, bitness)
+    executor.shutdown(wait=False)
+    return future
+
+
+def pynsist_env():
+    '''
+    Environment of `python -m nsist`: pynsist's cache dir is the embed cache.
+    '''
+    return dict(os.environ, PYNSIST_CACHE_DIR=str(get_embed_dir()))
+
+
+def embed_archives():
+    embed_dir = get_embed_dir()
+    return [p for p in embed_dir.glob('python-*-embed-*.zip') if EMBED_PATTERN.fullmatch(p.name)] \
+        if embed_dir.exists() else []
+
+
+def remove_embed(archive):
+    update_manifest(Path(archive).name, None)
+    Path(archive).unlink(missing_ok=True)
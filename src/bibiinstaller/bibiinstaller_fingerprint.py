@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Fingerprints of source trees (project_root, assets, FILE_CONFIGS).
+
+Directories are scanned in parallel, honouring .gitignore files and
+EXCLUDE_CONFIGS patterns. Large files are hashed through mmap. File digests
+are remembered in a persistent cache keyed by (path, size, mtime, inode),
+so only new or touched files are read again.
+
+    bibiinstaller fingerprint project_dir assets_dir
+    bibiinstaller fingerprint --configs configs.py
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+
+DIGEST_CACHE_FILE_NAME = 'fingerprint_digests.json'
+MMAP_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_EXCLUDES = [
+    '.git/', '.hg/', '.svn/', '.idea/', '.vscode/', '.venv/', 'venv/', '__pycache__/',
+    '.tox/', '.nox/', '.mypy_cache/', '.pytest_cache/', '.ruff_cache/', '/build/', '/dist/',
+    'bibiinstaller-pynsist-*/', '*.pyc',
+]
+
+
+@dataclass
+class Fingerprint:
+    path: str
+    digest: str
+    files: dict = field(default_factory=dict)
+    total_bytes: int = 0
+    hashed_files: int = 0
+
+
+def translate_segment(segment: str):
+    '''
+    Regex of one path segment: "*" and "?" never match "/".
+    '''
+    regex, i = '', 0
+    while i < len(segment):
+        c = segment[i]
+        i += 1
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            # ''' "[!...]" negates, a "]" right after the opening bracket is a member '''
+            start = i + 1 if segment[i:i + 1] in ('!', '^') else i
+            j = segment.find(']', start + 1 if segment[start:start + 1] == ']' else start)
+            if j < 0:
+                regex += re.escape(c)
+                continue
+            chars = segment[i:j].replace('\\', '\\\\')
+            if chars[:1] in ('!', '^'):
+                chars = '^' + chars[1:]
+            regex += f'[{chars}]'
+            i = j + 1
+        else:
+            regex += re.escape(c)
+    return regex
+
+
+def translate_pattern(pattern: str):
+    '''
+    Regex of a gitignore pattern, segment by segment: "**" matches any number of directories.
+    '''
+    segments = pattern.split('/')
+    regex = ''
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            regex += '.*' if last else '(?:[^/]*/)*'
+        else:
+            regex += translate_segment(segment) + ('' if last else '/')
+    return f'(?s:{regex})\\Z'
+
+
+class IgnoreRules:
+    '''
+    The commonly used subset of .gitignore syntax:
+    comments, "!" negation, trailing "/" for directories, leading "/" or
+    inner "/" anchoring, "*", "?", "[...]" within a segment and "**" across them.
+    '''
+
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else []
+
+    @staticmethod
+    def compile(pattern: str, base: str = ''):
+        pattern = pattern.rstrip('\n').rstrip()
+        if not pattern or pattern.startswith('#'):
+            return None
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # ''' a leading "**/" matches at any depth, it is anchored by translate_pattern itself '''
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        if not pattern:
+            return None
+        regex = re.compile(translate_pattern(pattern))
+        return base, regex, negate, dir_only, anchored
+
+    def extend(self, patterns, base: str = ''):
+        rules = [IgnoreRules.compile(p, base) for p in patterns]
+        rules = [rule for rule in rules if rule is not None]
+        if not rules:
+            return self
+        return IgnoreRules(self.rules + rules)
+
+    def is_ignored(self, rel_path: str, is_dir: bool):
+        ignored = False
+        for base, regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + '/'):
+                    continue
+                sub_path = rel_path[len(base) + 1:]
+            else:
+                sub_path = rel_path
+            target = sub_path if anchored else sub_path.rsplit('/', 1)[-1]
+            if regex.match(target):
+                ignored = not negate
+        return ignored
+
+
+class DigestCache:
+    '''
+    Persistent (path, size, mtime, inode) -> digest cache.
+
+        with DigestCache() as cache:
+            fingerprint_tree(project_root, cache=cache)
+
+    save() drops the entries of paths that no longer exist, the file does not grow with every path ever hashed.
+    '''
+
+    def __init__(self, cache_file=None):
+        if cache_file is None:
+            from bibiinstaller.bibiinstaller_cache import get_cache_home
+            cache_file = get_cache_home() / DIGEST_CACHE_FILE_NAME
+        self.cache_file = Path(cache_file)
+        self.entries = {}
+        self.dirty = False
+        self.used = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.cache_file.exists():
+            try:
+                self.entries = json.loads(self.cache_file.read_text(encoding='utf8'))
+            except ValueError:
+                logger.warning(f'INVALID digest cache, ignored: [{self.cache_file}]')
+                self.entries = {}
+        return self
+
+    def save(self):
+        if not self.dirty:
+            return
+        # ''' the paths looked up or hashed in this run exist, only the others are checked '''
+        self.entries = {path: entry for path, entry in self.entries.items()
+                        if path in self.used or os.path.lexists(path)}
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.tmp-{os.getpid()}')
+        tmp_file.write_text(json.dumps(self.entries, separators=(',', ':')), encoding='utf8')
+        os.replace(tmp_file, self.cache_file)
+        self.dirty = False
+
+    def get(self, path: str, stat: os.stat_result):
+        entry = self.entries.get(path)
+        if entry and entry[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+            self.used.add(path)
+            return entry[3]
+        return None
+
+    def put(self, path: str, stat: os.stat_result, digest: str):
+        with self.lock:
+            self.entries[path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, digest]
+            self.used.add(path)
+            self.dirty = True
+
+    def __enter__(self):
+        return self.load()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+
+def hash_file(file_path, size=None):
+    digest = hashlib.sha256()
+    if size is None:
+        size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+        else:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_dir(dir_path: Path, rel_dir: str, rules: IgnoreRules, use_gitignore: bool):
+    gitignore = dir_path / '.gitignore'
+    if use_gitignore and gitignore.is_file():
+        rules = rules.extend(gitignore.read_text(encoding='utf8', errors='replace').splitlines(), rel_dir)
+    files = []
+    sub_dirs = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if not rules.is_ignored(rel_path, True):
+                    sub_dirs.append((Path(entry.path), rel_path, rules))
+            elif entry.is_file():
+                if not rules.is_ignored(rel_path, False):
+                    files.append((entry.path, rel_path, entry.stat()))
+    return files, sub_dirs
+
+
+def fingerprint_tree(root, excludes=None, use_gitignore=True, cache: DigestCache = None, max_workers=None):
+    '''
+    Fingerprint a file or a directory tree.
+
+    excludes: gitignore-style patterns, e.g. DEFAULT_EXCLUDES + EXCLUDE_CONFIGS.
+    '''
+    root = Path(root).resolve()
+    if excludes is None:
+        excludes = DEFAULT_EXCLUDES
+    fingerprint = Fingerprint(path=str(root), digest='')
+    hashed_lock = threading.Lock()
+    if not root.exists():
+        fingerprint.digest = hashlib.sha256(f'missing:{root.name}'.encode('utf8')).hexdigest()
+        return fingerprint
+
+    def file_digest(file_path, stat):
+        digest = cache.get(file_path, stat) if cache is not None else None
+        if digest is None:
+            digest = hash_file(file_path, stat.st_size)
+            if cache is not None:
+                cache.put(file_path, stat, digest)
+            with hashed_lock:
+                fingerprint.hashed_files += 1
+        return digest
+
+    if root.is_file():
+        stat = root.stat()
+        fingerprint.files[root.name] = file_digest(str(root), stat)
+        fingerprint.total_bytes = stat.st_size
+    else:
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        rules = IgnoreRules().extend(excludes)
+        digest_futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {pool.submit(scan_dir, root, '', rules, use_gitignore)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, sub_dirs = future.result()
+                    for file_path, rel_path, stat in files:
+                        fingerprint.total_bytes += stat.st_size
+                        digest_futures[rel_path] = pool.submit(file_digest, file_path, stat)
+                    for sub_dir in sub_dirs:
+                        pending.add(pool.submit(scan_dir, *sub_dir, use_gitignore))
+            fingerprint.files = {rel_path: digest_futures[rel_path].result() for rel_path in sorted(digest_futures)}
+
+    digest = hashlib.sha256()
+    for rel_path, file_digest_ in fingerprint.files.items():
+        digest.update(f'{rel_path}\0{file_digest_}\n'.encode('utf8'))
+    fingerprint.digest = digest.hexdigest()
+    logger.debug(f'fingerprint [{root}] = {fingerprint.digest}, '
+                 f'files = {len(fingerprint.files)}, hashed = {fingerprint.hashed_files}')
+    return fingerprint
+
+
+def fingerprint_paths(paths, excludes=None, use_gitignore=True, cache: DigestCache = None):
+    '''
+    Fingerprint several files or trees, returns {path: Fingerprint}.
+    '''
+    own_cache = cache is None
+    if own_cache:
+        cache = DigestCache().load()
+    try:
+        return {str(path): fingerprint_tree(path, excludes=excludes, use_gitignore=use_gitignore, cache=cache)
+                for path in paths}
+    finally:
+        if own_cache:
+            cache.save()
+
+
+def combine_digests(digests):
+    digest = hashlib.sha256()
+    for item in digests:
+        digest.update(f'{item}\n'.encode('utf8'))
+    return digest.hexdigest()
+
+
+def configs_fingerprint_paths(configs_py_file):
+    '''
+    project_root, ASSETS_PATH and FILE_CONFIGS of a configs.py, and its EXCLUDE_CONFIGS.
+    '''
+    from bibiinstaller.bibiinstaller_windows import BibiinstallConfigs, get_config_variables
+    configs = BibiinstallConfigs.from_configs(get_config_variables(configs_py_file, 'configs_py'))
+    project_root = Path(configs_py_file).parent.resolve()
+    paths = [project_root]
+    if configs.ASSETS_PATH and len(str(configs.ASSETS_PATH).strip()) > 0:
+        paths.append((project_root / configs.ASSETS_PATH).resolve())
+    for file_config in configs.FILE_CONFIGS:
+        source = file_config[0] if isinstance(file_config, (list, tuple)) else file_config
+        paths.append((project_root / source).resolve())
+    return paths, list(configs.EXCLUDE_CONFIGS)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='bibiinstaller fingerprint',
+        description='fingerprint source trees, honouring .gitignore and EXCLUDE_CONFIGS.')
+    parser.add_argument('paths', nargs='*', help='files or directories to fingerprint')
+    parser.add_argument('--configs', help='configs.py, fingerprint its project_root, ASSETS_PATH and FILE_CONFIGS')
+    parser.add_argument('--exclude', action='append', default=[], help='gitignore-style pattern to exclude')
+    parser.add_argument('--no_gitignore', action='store_true', help='do not read .gitignore files')
+    parser.add_argument('--files', action='store_true', help='also print the digest of every file')
+    parser.add_argument('--json', action='store_true', help='print the result as json')
+    args = parser.parse_args(argv)
+
+    paths = list(args.paths)
+    excludes = DEFAULT_EXCLUDES + args.exclude
+    if args.configs:
+        configs_paths, exclude_configs = configs_fingerprint_paths(args.configs)
+        paths += configs_paths
+        excludes += exclude_configs
+    if not paths:
+        parser.error('no paths or --configs given')
+
+    fingerprints = fingerprint_paths(paths, excludes=excludes, use_gitignore=not args.no_gitignore)
+    digest = combine_digests(f.digest for f in fingerprints.values())
+    if args.json:
+        result = dict(digest=digest, paths={
+            path: dict(digest=f.digest, files=len(f.files), total_bytes=f.total_bytes, hashed_files=f.hashed_files,
+                       **(dict(file_digests=f.files) if args.files else {}))
+            for path, f in fingerprints.items()})
+        print(json.dumps(result, indent=2))
+    else:
+        for path, f in fingerprints.items():
+            print(f'{f.digest}  {path}  ({len(f.files)} files, {f.total_bytes} bytes, {f.hashed_files} hashed)')
+            if args.files:
+                for rel_path, file_digest in f.files.items():
+                    print(f'    {file_digest}  {rel_path}')
+        print(f'{digest}  TOTAL')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
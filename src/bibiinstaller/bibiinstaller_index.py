@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Local caching package index proxy, a PEP 503 (HTML) and PEP 691 (JSON) simple index.
+
+    bibiinstaller index-proxy
+    bibiinstaller index-proxy --host 0.0.0.0 --port 3141 --upstream https://mirrors.example/simple/
+    bibiinstaller index-proxy --offline --seed D:\\wheels
+
+Project pages and files are cached under <cache>/index:
+
+    pages/<project>.json     upstream page, refreshed after --ttl seconds when online
+    files/<project>/<file>   downloaded (or seeded) distributions
+
+A missing file is fetched from upstream once, concurrent requests for it wait
+for the same download. Files are served with Range support. Offline, pages
+are built from the cached and seeded files alone.
+
+While it runs, <cache>/index-proxy.json points the installs and downloads of
+builds sharing the cache at it; BIBIINSTALLER_INDEX_URL points builds at a
+proxy of another machine.
+"""
+import hashlib
+import html
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urljoin, urlsplit
+
+from bibiinstaller.bibiinstaller_logger import logger
+
+INDEX_DIR_NAME = 'index'
+PROXY_JSON = 'index-proxy.json'
+INDEX_URL_ENV = 'BIBIINSTALLER_INDEX_URL'
+DEFAULT_UPSTREAM = 'https://pypi.org/simple/'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 3141
+DEFAULT_TTL = 600
+SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+SIMPLE_HTML = 'application/vnd.pypi.simple.v1+html'
+DISTRIBUTION_SUFFIXES = ('.whl', '.tar.gz', '.zip', '.tar.bz2')
+CHUNK_SIZE = 1024 * 1024
+ANCHOR_PATTERN = re.compile(r'<a\s+([^>]*)>([^<]*)</a>', re.I)
+ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+METADATA_KEYS = ('core-metadata', 'dist-info-metadata', 'data-dist-info-metadata')
+# ''' path separators, drive letters (":"), ".." and NUL are never part of a project or distribution name '''
+UNSAFE_NAME_PATTERN = re.compile(r'[/\\:\x00]|\.\.')
+
+
+def canonicalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def is_plain_name(name):
+    '''
+    Whether name is a single path segment, safe to join onto a cache directory.
+    '''
+    return bool(name) and not UNSAFE_NAME_PATTERN.search(name)
+
+
+def project_of(filename):
+    '''
+    Canonical project name of a wheel or sdist filename.
+    '''
+    if filename.endswith('.whl'):
+        return canonicalize(filename.split('-')[0])
+    stem = next((filename[:-len(s)] for s in DISTRIBUTION_SUFFIXES if filename.endswith(s)), filename)
+    return canonicalize(stem.rsplit('-', 1)[0])
+
+
+def parse_html_page(text, page_url):
+    '''
+    PEP 503 anchors of a project page as PEP 691 file dicts.
+    '''
+    files = []
+    for attributes, filename in ANCHOR_PATTERN.findall(text):
+        attributes = {k.lower(): html.unescape(v) for k, v in ATTRIBUTE_PATTERN.findall(attributes)}
+        url, _, fragment = attributes.get('href', '').partition('#')
+        file = dict(filename=html.unescape(filename).strip(), url=urljoin(page_url, url), hashes={})
+        if '=' in fragment:
+            algorithm, _, digest = fragment.partition('=')
+            file['hashes'][algorithm] = digest
+        if 'data-requires-python' in attributes:
+            file['requires-python'] = attributes['data-requires-python']
+        if 'data-yanked' in attributes:
+            file['yanked'] = attributes['data-yanked'] or True
+        files.append(file)
+    return files
+
+
+class IndexCache:
+    '''
+    On-disk cache of project pages and files, filled from upstream on a miss.
+    '''
+
+    def __init__(self, root=None, upstream=DEFAULT_UPSTREAM, offline=False, ttl=DEFAULT_TTL, timeout=30):
+        if root is None:
+            from bibiinstaller.bibiinstaller_cache import get_cache_home
+            root = get_cache_home() / INDEX_DIR_NAME
+        self.root = Path(root)
+        self.upstream = upstream.rstrip('/') + '/'
+        self.offline = offline
+        self.ttl = ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.fetches = {}
+        self.digests = {}
+        self.counts = Counter()
+
+    def page_file(self, project):
+        return self.root / 'pages' / f'{project}.json'
+
+    def files_dir(self, project):
+        return self.root / 'files' / project
+
+    def file_path(self, project, filename):
+        '''
+        files/<project>/<filename>, None unless both are plain names and the path stays in files/.
+        '''
+        if not (is_plain_name(project) and is_plain_name(filename)):
+            return None
+        file_path = self.files_dir(project) / filename
+        if not file_path.resolve().is_relative_to((self.root / 'files').resolve()):
+            return None
+        return file_path
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def projects(self):
+        names = {p.stem for p in (self.root / 'pages').glob('*.json')}
+        names |= {p.name for p in (self.root / 'files').iterdir() if p.is_dir()} \
+            if (self.root / 'files').exists() else set()
+        return sorted(names)
+
+    def seed(self, source_dir):
+        '''
+        Link (or copy) the distributions of source_dir into files/<project>/, returns their count.
+        '''
+        from bibiinstaller.bibiinstaller_copy import copy_file
+        seeded = 0
+        for source in sorted(Path(source_dir).iterdir()):
+            if not source.name.endswith(DISTRIBUTION_SUFFIXES):
+                continue
+            target = self.files_dir(project_of(source.name)) / source.name
+            if target.exists():
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                copy_file(source, target)
+            seeded += 1
+        logger.info(f'SEEDED {seeded} files from [{source_dir}] into [{self.root}]')
+        return seeded
+
+    def fetch_page(self, project):
+        page_url = f'{self.upstream}{project}/'
+        request = urllib.request.Request(page_url, headers={
+            'Accept': f'{SIMPLE_JSON}, {SIMPLE_HTML};q=0.2, text/html;q=0.1'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            content_type = response.headers.get('Content-Type', '')
+            body = response.read().decode('utf8')
+        if SIMPLE_JSON in content_type or content_type.startswith('application/json'):
+            files = json.loads(body).get('files', [])
+            for file in files:
+                file['url'] = urljoin(page_url, file['url'])
+        else:
+            files = parse_html_page(body, page_url)
+        self.count('page_fetches')
+        return files
+
+    def project_files(self, project):
+        '''
+        PEP 691 file dicts of project, upstream urls kept; None for an unknown project.
+        '''
+        page_file = self.page_file(project)
+        files = None
+        fresh = page_file.exists() and time.time() - page_file.stat().st_mtime < self.ttl
+        if not self.offline and not fresh:
+            try:
+                files = self.fetch_page(project)
+                page_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = page_file.with_name(f'{page_file.name}.tmp-{os.getpid()}-{threading.get_ident()}')
+                tmp_file.write_text(json.dumps(files), encoding='utf8')
+                os.replace(tmp_file, page_file)
+            except OSError as e:
+                logger.warning(f'upstream page of [{project}] unavailable, serving the cache: {e}')
+        if files is None and page_file.exists():
+            files = json.loads(page_file.read_text(encoding='utf8'))
+        files_dir = self.files_dir(project)
+        if files_dir.is_dir():
+            files = files or []
+            listed = {f['filename'] for f in files}
+            for file in sorted(files_dir.iterdir()):
+                if file.name not in listed and file.name.endswith(DISTRIBUTION_SUFFIXES):
+                    files.append(dict(filename=file.name, url=None, hashes=dict(sha256=self.sha256(file))))
+        return files
+
+    def sha256(self, file_path):
+        from bibiinstaller.bibiinstaller_fingerprint import hash_file
+        stat = file_path.stat()
+        key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self.digests:
+            self.digests[key] = hash_file(file_path, stat.st_size)
+        return self.digests[key]
+
+    def get_file(self, project, filename):
+        '''
+        Path of the cached file, downloaded once on a miss; None when unknown, offline or not a plain name.
+        '''
+        file_path = self.file_path(project, filename)
+        if file_path is None:
+            logger.warning(f'REJECTED file path [{project}/{filename}]')
+            return None
+        if file_path.exists():
+            self.count('file_hits')
+            return file_path
+        if self.offline:
+            return None
+        key = (project, filename)
+        with self.lock:
+            future = self.fetches.get(key)
+            owner = future is None
+            if owner:
+                future = self.fetches[key] = Future()
+        if not owner:
+            self.count('file_waits')
+            return future.result()
+        try:
+            future.set_result(self.download(project, filename, file_path))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.fetches[key]
+        return future.result()
+
+    def download(self, project, filename, file_path):
+        file = next((f for f in self.project_files(project) or [] if f['filename'] == filename), None)
+        if file is None or not file.get('url'):
+            return None
+        started = time.perf_counter()
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file_path.with_name(f'{filename}.tmp-{os.getpid()}-{threading.get_ident()}')
+        digest = hashlib.sha256()
+        with urllib.request.urlopen(file['url'], timeout=self.timeout) as response, open(tmp_file, 'wb') as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        expected = file.get('hashes', {}).get('sha256')
+        if expected and digest.hexdigest() != expected:
+            tmp_file.unlink()
+            raise OSError(f'sha256 mismatch of [{file["url"]}]: {digest.hexdigest()} != {expected}')
+        os.replace(tmp_file, file_path)
+        self.count('file_fetches')
+        logger.info(f'FETCHED [{file["url"]}] in {time.perf_counter() - started:.2f}s')
+        return file_path
+
+
+def render_project(project, files, as_json):
+    # ''' metadata files (PEP 658) are not proxied, pip reads the metadata from the distributions '''
+    files = [dict({k: v for k, v in f.items() if k not in METADATA_KEYS}, url=f'/files/{project}/{f["filename"]}')
+             for f in files]
+    if as_json:
+        return json.dumps({'meta': {'api-version': '1.0'}, 'name': project, 'files': files})
+    anchors = []
+    for file in files:
+        href = file['url'] + ''.join(f'#{a}={d}' for a, d in list(file.get('hashes', {}).items())[:1])
+        attributes = f'href="{html.escape(href)}"'
+        if file.get('requires-python'):
+            attributes += f' data-requires-python="{html.escape(file["requires-python"])}"'
+        if file.get('yanked'):
+            reason = file['yanked'] if isinstance(file['yanked'], str) else ''
+            attributes += f' data-yanked="{html.escape(reason)}"'
+        anchors.append(f'<a {attributes}>{html.escape(file["filename"])}</a><br/>')
+    return ('<!DOCTYPE html>\n<html><head><meta name="pypi:repository-version" content="1.0">'
+            f'<title>Links for {html.escape(project)}</title></head><body>\n'
+            f'<h1>Links for {html.escape(project)}</h1>\n' + '\n'.join(anchors) + '\n</body></html>\n')
+
+
+def render_root(projects, as_json):
+    if as_json:
+        return json.dumps({'meta': {'api-version': '1.0'}, 'projects': [{'name': p} for p in projects]})
+    anchors = '\n'.join(f'<a href="/simple/{html.escape(p)}/">{html.escape(p)}</a><br/>' for p in projects)
+    return ('<!DOCTYPE html>\n<html><head><meta name="pypi:repository-version" content="1.0">'
+            f'<title>Simple index</title></head><body>\n{anchors}\n</body></html>\n')
+
+
+class IndexHandler(BaseHTTPRequestHandler):
+    server_version = 'bibiinstaller-index-proxy'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def cache(self) -> IndexCache:
+        return self.server.cache
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        path = unquote(urlsplit(self.path).path)
+        parts = [p for p in path.split('/') if p]
+        if not all(is_plain_name(p) for p in parts):
+            self.send_error(400, 'invalid path')
+            return
+        try:
+            if parts == ['simple']:
+                self.send_page(render_root, self.cache.projects(), send_body=send_body)
+            elif len(parts) == 2 and parts[0] == 'simple':
+                project = canonicalize(parts[1])
+                files = self.cache.project_files(project)
+                if files is None:
+                    self.send_error(404, f'project {project} not found')
+                else:
+                    self.send_page(render_project, project, files, send_body=send_body)
+            elif len(parts) == 3 and parts[0] == 'files':
+                file_path = self.cache.get_file(canonicalize(parts[1]), parts[2])
+                if file_path is None:
+                    self.send_error(404, f'file {parts[2]} not found')
+                else:
+                    self.send_file(file_path, send_body)
+            else:
+                self.send_error(404)
+        except (OSError, ValueError) as e:
+            logger.warning(f'FAILED {self.path}: {e}')
+            self.send_error(502, str(e))
+
+    def send_page(self, render, *args, send_body=True):
+        as_json = SIMPLE_JSON in self.headers.get('Accept', '')
+        body = render(*args, as_json).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', SIMPLE_JSON if as_json else 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_file(self, file_path, send_body=True):
+        size = file_path.stat().st_size
+        start, end = 0, size - 1
+        match = RANGE_PATTERN.match(self.headers.get('Range', '').strip())
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start > end or start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not send_body:
+            return
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+class IndexProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cache: IndexCache, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__((host, port), IndexHandler)
+        self.cache = cache
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        if host in ('0.0.0.0', '::'):
+            host = socket.gethostname()
+        return f'http://{host}:{port}/simple/'
+
+    @property
+    def local_host(self):
+        host = self.server_address[0]
+        return '127.0.0.1' if host in ('0.0.0.0', '::') else host
+
+
+def get_proxy_json():
+    from bibiinstaller.bibiinstaller_cache import get_cache_home
+    return get_cache_home() / PROXY_JSON
+
+
+def get_index_url():
+    '''
+    BIBIINSTALLER_INDEX_URL, or the url of the index proxy running on this cache, or None.
+    '''
+    index_url = os.environ.get(INDEX_URL_ENV)
+    if index_url:
+        return index_url
+    proxy_json = get_proxy_json()
+    if not proxy_json.exists():
+        return None
+    try:
+        proxy = json.loads(proxy_json.read_text(encoding='utf8'))
+        with socket.create_connection((proxy['host'], proxy['port']), timeout=0.5):
+            return proxy['url']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='bibiinstaller index-proxy',
+        description='local caching PEP 503/691 package index, builds sharing the cache install through it.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'bind address (default: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'port (default: {DEFAULT_PORT})')
+    parser.add_argument('--upstream', default=DEFAULT_UPSTREAM, help=f'upstream simple index (default: '
+                                                                      f'{DEFAULT_UPSTREAM})')
+    parser.add_argument('--cache_dir', help='index cache dir (default: <cache>/index)')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL,
+                        help=f'seconds before a cached project page is fetched again (default: {DEFAULT_TTL})')
+    parser.add_argument('--offline', action='store_true', help='never contact upstream')
+    parser.add_argument('--seed', action='append', default=[], help='directory of wheels and sdists to serve')
+    args = parser.parse_args(argv)
+
+    cache = IndexCache(args.cache_dir, upstream=args.upstream, offline=args.offline, ttl=args.ttl)
+    for seed_dir in args.seed:
+        cache.seed(seed_dir)
+    proxy = IndexProxy(cache, args.host, args.port)
+    proxy_json = get_proxy_json()
+    proxy_json.parent.mkdir(parents=True, exist_ok=True)
+    port = proxy.server_address[1]
+    proxy_json.write_text(json.dumps(dict(url=f'http://{proxy.local_host}:{port}/simple/', host=proxy.local_host,
+                                          port=port, pid=os.getpid()), indent=2), encoding='utf8')
+    logger.info(f'index proxy [{proxy.url}] upstream [{"offline" if args.offline else cache.upstream}] '
+                f'cache [{cache.root}], press Ctrl+C to stop.')
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        logger.info(f'index proxy stopped, {dict(cache.counts)}')
+    finally:
+        proxy.server_close()
+        if proxy_json.exists() and json.loads(proxy_json.read_text(encoding='utf8')).get('pid') == os.getpid():
+            proxy_json.unlink()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+User-level cache of the micromamba interpreters behind the packaging venvs.
+
+Every build used to create its own micromamba root prefix in the dated work
+dir. Now all builds share one root prefix in the cache home, with one env per
+Python X.Y and bitness and a shared package cache (pkgs/):
+
+    <cache>/micromamba/envs/python_3.9_64bit/python.exe
+    <cache>/micromamba/pkgs/
+
+A cached env is reused as is, a missing one is created with --offline when
+its python package is already in pkgs/. Concurrent builds serialize on
+<cache>/micromamba.lock. `bibiinstaller cache prune` removes envs unused for
+some days and the downloaded package archives. An env is used whenever a venv
+created from it is reused (see bibiinstaller_venvs), and never removed while
+the pyvenv.cfg of a base venv or work dir venv still names it as its home.
+"""
+import shutil
+import time
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_cache import FileLock, get_cache_home
+from bibiinstaller.bibiinstaller_logger import logger
+
+MICROMAMBA_DIR_NAME = 'micromamba'
+LAST_USED_FILE = '.bibiinstaller-last-used'
+PACKAGE_ARCHIVES = ['*.conda', '*.tar.bz2']
+
+
+def get_micromamba_root():
+    return get_cache_home() / MICROMAMBA_DIR_NAME
+
+
+def get_micromamba_lock():
+    return FileLock(get_cache_home() / f'{MICROMAMBA_DIR_NAME}.lock')
+
+
+def interpreter_name(python_version: str, bitness=64):
+    python = '.'.join(str(python_version).split('.')[:2])
+    return f'python_{python}_{bitness}bit'
+
+
+def provision_python(python_version: str, bitness=64):
+    '''
+    Python X.Y of bitness from the interpreter cache, created with micromamba on a miss.
+
+    Returns the python.exe path.
+    '''
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    from bibiinstaller.bibiinstaller_windows import subprocess_run
+    python = '.'.join(str(python_version).split('.')[:2])
+    root_prefix = get_micromamba_root()
+    environment_name = interpreter_name(python_version, bitness)
+    environment_dir = root_prefix / 'envs' / environment_name
+    python_exe = environment_dir / 'python.exe'
+    with get_micromamba_lock():
+        if python_exe.exists():
+            logger.info(f'interpreter cache HIT: [{environment_dir}]')
+        else:
+            micromamba_exe = get_toolchain().micromamba_exe()
+            logger.info(f'interpreter cache MISS: [{environment_dir}], micromamba [{micromamba_exe}]')
+            command = [micromamba_exe, 'create', '--yes', '-n', environment_name, f'python={python}',
+                       '-c', 'conda-forge', '--root-prefix', root_prefix]
+            if int(bitness) == 32:
+                command += ['--platform', 'win-32']
+            if any((root_prefix / 'pkgs').glob(f'python-{python}.*')):
+                logger.info(f'python {python} in the package cache, creating offline.')
+                if subprocess_run(command + ['--offline'], exit=False) != 0:
+                    subprocess_run(command)
+            else:
+                subprocess_run(command)
+        if environment_dir.exists():
+            (environment_dir / LAST_USED_FILE).touch()
+    return python_exe.resolve()
+
+
+def touch_interpreter(home):
+    '''
+    Mark the cached env of a venv's home as used, homes outside the interpreter cache are left alone.
+    '''
+    envs_dir = (get_micromamba_root() / 'envs').resolve()
+    environment_dir = Path(home).resolve()
+    if environment_dir.parent != envs_dir:
+        return
+    with get_micromamba_lock():
+        if environment_dir.is_dir():
+            (environment_dir / LAST_USED_FILE).touch()
+
+
+def referenced_interpreters():
+    '''
+    The homes of the venvs in the cache: the base venvs and the venvs of the work dirs.
+    '''
+    from bibiinstaller.bibiinstaller_venvs import read_venv_home
+    cache_home = get_cache_home()
+    pyvenv_cfgs = list(cache_home.glob('venvs/*/pyvenv.cfg')) + list(cache_home.glob('work/*/*/pyvenv.cfg'))
+    return {home.resolve() for home in map(read_venv_home, (p.parent for p in pyvenv_cfgs)) if home}
+
+
+def prune_interpreters(days=30, archives=True):
+    '''
+    Remove cached envs unused for days, and the package archives of pkgs/ (extracted packages stay).
+
+    Envs some venv of the cache still runs on are kept, whatever their age.
+
+    Returns the removed paths.
+    '''
+    root_prefix = get_micromamba_root()
+    removed = []
+    with get_micromamba_lock():
+        deadline = time.time() - days * 24 * 3600
+        envs_dir = root_prefix / 'envs'
+        referenced = referenced_interpreters()
+        for environment_dir in sorted(envs_dir.iterdir() if envs_dir.exists() else []):
+            if environment_dir.resolve() in referenced:
+                continue
+            last_used = environment_dir / LAST_USED_FILE
+            last_used_time = (last_used if last_used.exists() else environment_dir).stat().st_mtime
+            if last_used_time < deadline:
+                shutil.rmtree(environment_dir, ignore_errors=True)
+                removed.append(environment_dir)
+        if archives:
+            for pattern in PACKAGE_ARCHIVES:
+                for archive in sorted((root_prefix / 'pkgs').glob(pattern)):
+                    archive.unlink()
+                    removed.append(archive)
+    for path in removed:
+        logger.info(f'REMOVED [{path}]')
+    return removed
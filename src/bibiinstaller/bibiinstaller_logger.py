@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+loguru's logger, imported on first use.
+
+Importing loguru costs tens of milliseconds, which `bibiinstaller --help`
+and other short-lived invocations should not pay before anything is logged.
+"""
+
+
+class LazyLogger:
+    def __getattr__(self, name):
+        from loguru import logger
+        return getattr(logger, name)
+
+
+logger = LazyLogger()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Incremental upgrades: a manifest of the installer's pkgs payload.
+
+Every installer used to remove $INSTDIR\\pkgs and write the whole tree again,
+so a one file patch rewrote hundreds of MB. Now the build runs nsist with
+--no-makensis, hashes build/nsis/pkgs into pkgs.manifest.json and runs
+makensis itself. The installer carries the manifest and this module (as
+_bibiinstaller_upgrade.py); on an upgrade the installed Python runs
+
+    python -Es _bibiinstaller_upgrade.py <INSTDIR> <new pkgs.manifest.json>
+
+which compares the new manifest with the installed one and deletes the files
+that changed or were removed. pkgs is then extracted with SetOverwrite off,
+so only missing (new or changed) files are written. A missing or unreadable
+installed manifest, or another Python version, exits non-zero and the
+installer falls back to a clean pkgs.
+
+With --base <sha256> (patch installers, see bibiinstaller_delta) nothing is
+deleted unless the installed manifest is exactly that base and every file it
+lists is still in place; otherwise the patch is refused.
+
+The upgrade side runs inside the installed app: stdlib only.
+"""
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+
+MANIFEST_NAME = 'pkgs.manifest.json'
+UPGRADE_SCRIPT_NAME = '_bibiinstaller_upgrade.py'
+MANIFEST_FORMAT = 1
+PKGS_DIR_NAME = 'pkgs'
+
+EXIT_NO_MANIFEST = 2
+EXIT_PYTHON_CHANGED = 3
+EXIT_BASE_MISMATCH = 4
+
+# ''' !define lines of pynsist's installer.nsi recorded in the manifest '''
+NSI_DEFINES = {'PRODUCT_NAME': 'name', 'PRODUCT_VERSION': 'version', 'BITNESS': 'bitness'}
+NSI_DEFINE = re.compile(r'^!define\s+(\w+)\s+"?([^"\r\n]*)"?', re.MULTILINE)
+
+
+def read_nsi_defines(nsi_file):
+    '''
+    {'name', 'version', 'bitness'} of an installer.nsi, the keys it defines only.
+    '''
+    if not Path(nsi_file).is_file():
+        return {}
+    return {NSI_DEFINES[key]: value.strip() for key, value in NSI_DEFINE.findall(
+        Path(nsi_file).read_text(encoding='utf8', errors='replace')) if key in NSI_DEFINES}
+
+
+def build_manifest(pkgs_dir, python_version=None, application=None):
+    '''
+    {'format', 'python', 'files': {rel_path: [sha256, size]}} of every file under pkgs_dir, hashed in parallel,
+    with the application keys (name, version, bitness).
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import fingerprint_tree
+    pkgs_dir = Path(pkgs_dir)
+    fingerprint = fingerprint_tree(pkgs_dir, excludes=[], use_gitignore=False)
+    files = {rel_path: [digest, (pkgs_dir / rel_path).stat().st_size]
+             for rel_path, digest in fingerprint.files.items()}
+    return dict(format=MANIFEST_FORMAT, python=python_version, **(application or {}), files=files)
+
+
+def write_upgrade_files(nsis_build_dir, python_version=None):
+    '''
+    pkgs.manifest.json of build/nsis/pkgs and the upgrade script, next to installer.nsi for makensis.
+    '''
+    from bibiinstaller.bibiinstaller_copy import copy_file
+    from bibiinstaller.bibiinstaller_logger import logger
+    nsis_build_dir = Path(nsis_build_dir)
+    manifest = build_manifest(nsis_build_dir / PKGS_DIR_NAME, python_version,
+                              read_nsi_defines(nsis_build_dir / 'installer.nsi'))
+    (nsis_build_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=0, sort_keys=True), encoding='utf8')
+    copy_file(__file__, nsis_build_dir / UPGRADE_SCRIPT_NAME, preserve=False)
+    logger.info(f"Wrote pkgs manifest of {len(manifest['files'])} files [{nsis_build_dir / MANIFEST_NAME}]")
+    return nsis_build_dir / MANIFEST_NAME
+
+
+def release_manifest_name(installer_exe):
+    '''
+    The manifest kept next to an installer in dist/, the --from of the next patch.
+    '''
+    return f'{Path(installer_exe).stem}.{MANIFEST_NAME}'
+
+
+def manifest_sha256(manifest_file):
+    return hashlib.sha256(Path(manifest_file).read_bytes()).hexdigest()
+
+
+def read_manifest(manifest_file):
+    try:
+        manifest = json.loads(Path(manifest_file).read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('format') != MANIFEST_FORMAT:
+        return None
+    return manifest
+
+
+def plan_upgrade(installed, new, pkgs_dir=None):
+    '''
+    (changed, removed) rel paths: in both manifests with another hash, or only in the installed one.
+
+    With pkgs_dir, unchanged files whose size on disk differs from the
+    installed manifest are changed too, so they are written again.
+    '''
+    installed_files, new_files = installed['files'], new['files']
+    changed, removed = [], []
+    for rel_path, (digest, size) in installed_files.items():
+        if rel_path not in new_files:
+            removed.append(rel_path)
+        elif new_files[rel_path][0] != digest:
+            changed.append(rel_path)
+        elif pkgs_dir is not None:
+            file_path = Path(pkgs_dir) / rel_path
+            if file_path.is_file() and file_path.stat().st_size != size:
+                changed.append(rel_path)
+    return sorted(changed), sorted(removed)
+
+
+def check_base(installed, pkgs_dir):
+    '''
+    Rel paths of the installed manifest missing from pkgs_dir or with another size.
+    '''
+    mismatched = []
+    for rel_path, (_, size) in installed['files'].items():
+        file_path = Path(pkgs_dir) / rel_path
+        if not file_path.is_file() or file_path.stat().st_size != size:
+            mismatched.append(rel_path)
+    return sorted(mismatched)
+
+
+def remove_file(pkgs_dir: Path, rel_path):
+    file_path = pkgs_dir / rel_path
+    if file_path.is_file() or file_path.is_symlink():
+        file_path.unlink()
+    if file_path.suffix == '.py':
+        # ''' the byte code of the old source '''
+        for pyc in file_path.parent.glob(f'__pycache__/{file_path.stem}.*.pyc'):
+            pyc.unlink()
+
+
+def remove_empty_dirs(pkgs_dir: Path, rel_paths):
+    for parent in sorted({p for rel_path in rel_paths for p in (pkgs_dir / rel_path).parents
+                          if pkgs_dir in p.parents}, key=lambda p: len(p.parts), reverse=True):
+        for cache_dir in [parent / '__pycache__', parent]:
+            try:
+                cache_dir.rmdir()
+            except OSError:
+                pass
+
+
+def upgrade(install_dir, new_manifest_file, base=None):
+    '''
+    Delete the changed and removed files of install_dir/pkgs, returns an exit code.
+
+    base: sha256 of the only installed manifest a patch applies to.
+    '''
+    install_dir = Path(install_dir)
+    pkgs_dir = install_dir / PKGS_DIR_NAME
+    installed = read_manifest(install_dir / MANIFEST_NAME)
+    new = read_manifest(new_manifest_file)
+    if installed is None or new is None or not pkgs_dir.is_dir():
+        print(f'No usable {MANIFEST_NAME} in [{install_dir}], installing all packages.')
+        return EXIT_NO_MANIFEST
+    if installed.get('python') != new.get('python'):
+        print(f"Python {installed.get('python')} -> {new.get('python')}, installing all packages.")
+        return EXIT_PYTHON_CHANGED
+    if base is not None:
+        if manifest_sha256(install_dir / MANIFEST_NAME) != base:
+            print(f"The installed {installed.get('name', '')} {installed.get('version', '')} "
+                  f"is not the base of this patch.")
+            return EXIT_BASE_MISMATCH
+        mismatched = check_base(installed, pkgs_dir)
+        if mismatched:
+            print(f'{len(mismatched)} installed files are missing or modified, e.g. [{mismatched[0]}].')
+            return EXIT_BASE_MISMATCH
+    changed, removed = plan_upgrade(installed, new, pkgs_dir)
+    for rel_path in changed + removed:
+        remove_file(pkgs_dir, rel_path)
+    remove_empty_dirs(pkgs_dir, removed)
+    added = len(set(new['files']) - set(installed['files']))
+    print(f"Upgrading packages: {len(changed)} changed, {added} added, {len(removed)} removed, "
+          f"{len(new['files']) - len(changed) - added} unchanged.")
+    return 0
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog=UPGRADE_SCRIPT_NAME,
+                                     description='delete the changed and removed files of an installed pkgs.')
+    parser.add_argument('install_dir')
+    parser.add_argument('manifest', help=f'the new {MANIFEST_NAME}')
+    parser.add_argument('--base', help=f'sha256 of the installed {MANIFEST_NAME} a patch applies to')
+    args = parser.parse_args(argv)
+    return upgrade(args.install_dir, args.manifest, base=args.base)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
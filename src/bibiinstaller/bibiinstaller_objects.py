@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Content-addressed object store for staged files.
+
+Every staged file (site-packages into pynsist_pkgs, ASSETS_PATH) is stored
+once under its sha256 in <cache>/objects/ab/cdef... and linked to its target:
+reflinked (copy-on-write) where the filesystem supports it, hardlinked
+otherwise, copied across devices. File digests come from the fingerprint
+DigestCache, so staging an unchanged tree only costs metadata operations.
+
+Hardlinked targets share their bytes with the store: replace them (unlink
+first), never write into them in place.
+
+Every target dir records the digests staged into it in objects/refs/: reflinked
+and copied files leave no link count on their object, so prune_objects keeps
+the objects of the target dirs that still exist instead of trusting st_nlink.
+"""
+import errno
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_copy import copy_file, scan_tree
+from bibiinstaller.bibiinstaller_fingerprint import DigestCache, hash_file
+from bibiinstaller.bibiinstaller_logger import logger
+
+OBJECTS_DIR_NAME = 'objects'
+REFS_DIR_NAME = 'refs'
+# ''' linux/fs.h: _IOW(0x94, 9, int) '''
+FICLONE = 0x40049409
+# ''' errors that turn linking off for the whole store, not only for one file '''
+DEVICE_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EINVAL,
+                 errno.ENOTTY}
+
+
+def get_objects_dir():
+    from bibiinstaller.bibiinstaller_cache import get_cache_home
+    return get_cache_home() / OBJECTS_DIR_NAME
+
+
+def reflink(source, target):
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+class ObjectStore:
+    '''
+        with DigestCache() as cache, ObjectStore(cache=cache) as store:
+            store.stage_tree(site_packages_dir, pynsist_pkgs_dir)
+
+    The digests staged into every target dir are saved on exit, see save_refs.
+    '''
+
+    def __init__(self, root=None, cache: DigestCache = None, max_workers=None):
+        self.root = Path(root) if root else get_objects_dir()
+        self.cache = cache
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.reflink = sys.platform.startswith('linux')
+        self.hardlink = True
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.digest_locks = {}
+        self.refs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save_refs()
+
+    def object_path(self, digest):
+        return self.root / digest[:2] / digest[2:]
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def put(self, file_path, stat: os.stat_result = None):
+        '''
+        Store file_path once by content, returns its digest.
+        '''
+        file_path = str(file_path)
+        stat = os.stat(file_path) if stat is None else stat
+        digest = self.cache.get(file_path, stat) if self.cache is not None else None
+        if digest is None:
+            digest = hash_file(file_path, stat.st_size)
+            if self.cache is not None:
+                self.cache.put(file_path, stat, digest)
+        object_path = self.object_path(digest)
+        with self.lock:
+            digest_lock = self.digest_locks.setdefault(digest, threading.Lock())
+        # ''' threads staging equal files store the object once, a replaced object would break their hardlinks '''
+        with digest_lock:
+            if not object_path.exists():
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = object_path.with_name(f'{object_path.name}.tmp-{os.getpid()}-{threading.get_ident()}')
+                copy_file(file_path, tmp_path, preserve=False)
+                os.chmod(tmp_path, stat.st_mode & 0o777)
+                os.replace(tmp_path, object_path)
+                self.count('stored')
+                self.count('stored_bytes', stat.st_size)
+        return digest
+
+    def link(self, digest, target):
+        '''
+        Reflink, hardlink or copy the object of digest to target.
+        '''
+        object_path = self.object_path(digest)
+        target = Path(target)
+        if os.path.lexists(target):
+            target.unlink()
+        if self.reflink:
+            try:
+                reflink(object_path, target)
+                self.count('reflink')
+                return target
+            except OSError as e:
+                if os.path.lexists(target):
+                    target.unlink()
+                self.reflink = False
+                logger.debug(f'reflink unsupported [{e}], hardlinking into [{target.parent}]')
+        if self.hardlink:
+            try:
+                os.link(object_path, target)
+                self.count('hardlink')
+                return target
+            except OSError as e:
+                if e.errno in DEVICE_ERRNOS:
+                    self.hardlink = False
+                    logger.info(f'hardlink unsupported [{e}], copying into [{target.parent}]')
+        copy_file(object_path, target)
+        self.count('copy')
+        return target
+
+    def stage(self, source, target, stat: os.stat_result = None, root=None):
+        '''
+        Store source and link it to target, a reference of root (the dir of target by default).
+        '''
+        digest = self.put(source, stat)
+        with self.lock:
+            self.refs.setdefault(Path(root or Path(target).parent), set()).add(digest)
+        return self.link(digest, target)
+
+    def save_refs(self):
+        '''
+        Merge the digests staged into every target dir into its refs file.
+
+        A refs file belongs to one inode of its target dir: a dir removed and staged again
+        starts a new one (a reused inode only keeps the old objects longer).
+        '''
+        for target_dir, digests in self.refs.items():
+            target_dir = Path(target_dir).resolve()
+            if not target_dir.is_dir():
+                continue
+            inode = target_dir.stat().st_ino
+            refs_file = refs_path(target_dir, self.root)
+            refs = read_refs(refs_file)
+            if refs is not None and refs['inode'] == inode:
+                digests = digests | set(refs['digests'])
+            refs_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = refs_file.with_name(f'{refs_file.name}.tmp-{os.getpid()}')
+            tmp_file.write_text(json.dumps(dict(target_dir=str(target_dir), inode=inode, digests=sorted(digests))),
+                                encoding='utf8')
+            os.replace(tmp_file, refs_file)
+        self.refs = {}
+
+    def stage_tree(self, source_dir, target_dir, skip=None):
+        '''
+        Stage every file of source_dir into target_dir, like copytree(dirs_exist_ok=True).
+
+        skip: called with the posix path of a file relative to source_dir, true leaves it out.
+        '''
+        source_dir = Path(source_dir)
+        target_dir = Path(target_dir)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = []
+            for rel_dir, files in scan_tree(source_dir):
+                if skip is not None:
+                    files = [(name, size) for name, size in files
+                             if not skip(Path(rel_dir, name).as_posix())]
+                    if not files:
+                        continue
+                (target_dir / rel_dir).mkdir(parents=True, exist_ok=True)
+                for name, size in files:
+                    futures.append(pool.submit(self.stage, source_dir / rel_dir / name,
+                                               target_dir / rel_dir / name, root=target_dir))
+            for future in futures:
+                future.result()
+        logger.info(f'STAGED {len(futures)} files [{source_dir}] -> [{target_dir}] in '
+                    f'{time.perf_counter() - started:.2f}s, {dict(self.counts)}')
+        return target_dir
+
+
+def stage_paths(sources, target_dir):
+    '''
+    Stage files and directory trees into target_dir through the object store.
+    '''
+    with DigestCache() as cache, ObjectStore(cache=cache) as store:
+        for source in sources:
+            source = Path(source)
+            if source.is_dir():
+                store.stage_tree(source, target_dir)
+            elif source.is_file():
+                Path(target_dir).mkdir(parents=True, exist_ok=True)
+                store.stage(source, Path(target_dir) / source.name)
+    return store
+
+
+def refs_path(target_dir, objects_dir=None):
+    objects_dir = Path(objects_dir) if objects_dir else get_objects_dir()
+    return objects_dir / REFS_DIR_NAME / f'{hashlib.sha256(str(target_dir).encode("utf8")).hexdigest()[:32]}.json'
+
+
+def read_refs(refs_file):
+    try:
+        return json.loads(Path(refs_file).read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return None
+
+
+def referenced_digests(objects_dir=None, drop_stale=False):
+    '''
+    Digests recorded by the target dirs that still exist, drop_stale removes the refs files of the others.
+    '''
+    refs_dir = (Path(objects_dir) if objects_dir else get_objects_dir()) / REFS_DIR_NAME
+    digests = set()
+    for refs_file in refs_dir.glob('*.json') if refs_dir.is_dir() else []:
+        refs = read_refs(refs_file)
+        target_dir = Path(refs['target_dir']) if refs else None
+        if target_dir is not None and target_dir.is_dir() and target_dir.stat().st_ino == refs['inode']:
+            digests.update(refs['digests'])
+        elif drop_stale:
+            refs_file.unlink()
+    return digests
+
+
+def iter_objects(objects_dir=None):
+    '''
+    (digest, path) of every object of the store.
+    '''
+    objects_dir = Path(objects_dir) if objects_dir else get_objects_dir()
+    for prefix_dir in objects_dir.iterdir() if objects_dir.is_dir() else []:
+        if prefix_dir.name == REFS_DIR_NAME or not prefix_dir.is_dir():
+            continue
+        for object_path in prefix_dir.iterdir():
+            yield prefix_dir.name + object_path.name, object_path
+
+
+def prune_objects(max_age_days=0):
+    '''
+    Remove objects no existing target dir references nor hardlinks to, unchanged for max_age_days.
+
+    Returns (removed objects, removed bytes).
+    '''
+    objects_dir = get_objects_dir()
+    deadline = time.time() - max_age_days * 24 * 3600
+    referenced = referenced_digests(objects_dir, drop_stale=True)
+    removed = removed_bytes = 0
+    for digest, object_path in iter_objects(objects_dir):
+        if digest in referenced:
+            continue
+        try:
+            stat = os.stat(object_path)
+            if stat.st_nlink <= 1 and stat.st_ctime < deadline:
+                os.unlink(object_path)
+                removed += 1
+                removed_bytes += stat.st_size
+        except OSError:
+            pass
+    if removed:
+        logger.info(f'REMOVED {removed} objects, {removed_bytes} bytes from [{objects_dir}]')
+    return removed, removed_bytes
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Portable output: the installed app as a directory or a zip, without NSIS.
+
+    bibiinstaller configs.py --output dir|zip
+
+run_installer renders pynsist.cfg and stages pynsist_pkgs as for an installer,
+then lays out what the installer would write under $INSTDIR, straight from
+pynsist.cfg and the cached embeddable Python:
+
+    dist/<name>_64bit/Python/              embeddable Python, its ._pth extended with ..\\pkgs
+    dist/<name>_64bit/pkgs/                pynsist_pkgs (the unpacked wheels) and copied packages
+    dist/<name>_64bit/<name>.exe           the icon-patched launcher
+    dist/<name>_64bit/<name>.launch.pyw    the script the launcher runs
+    dist/<name>_64bit/...                  icon and FILE_CONFIGS
+
+nsist and makensis never run. dir copies the entries on a thread pool, zip
+streams files and the members of the embeddable archive into the output
+zip without an intermediate directory. --compression none stores the zip
+entries, the other profiles deflate them.
+"""
+import configparser
+import os
+import re
+import shutil
+import sys
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+from bibiinstaller.bibiinstaller_unpack import is_excluded
+
+OUTPUTS = ['installer', 'dir', 'zip']
+INSTDIR = '$INSTDIR'
+ZIP_COMPRESSION = {
+    'none': (zipfile.ZIP_STORED, None),
+    'zlib': (zipfile.ZIP_DEFLATED, 1),
+    'lzma': (zipfile.ZIP_DEFLATED, 6),
+    'lzma-solid': (zipfile.ZIP_DEFLATED, 9),
+}
+
+# ''' pynsist's launcher script, run by the launcher exe with Python\\pythonw.exe '''
+LAUNCH_SCRIPT = """#!python
+import sys, os
+import site
+scriptdir, script = os.path.split(os.path.abspath(__file__))
+installdir = scriptdir  # for compatibility with commands
+pkgdir = os.path.join(scriptdir, 'pkgs')
+# Ensure .pth files in pkgdir are handled properly
+site.addsitedir(pkgdir)
+sys.path.insert(0, pkgdir)
+os.environ['PYTHONPATH'] = pkgdir + os.pathsep + os.environ.get('PYTHONPATH', '')
+
+appdata = os.environ.get('APPDATA', None) or os.path.expanduser('~')
+
+if 'pythonw' in sys.executable:
+    # Running with no console - send all stdstream output to a file.
+    sys.stdout = sys.stderr = open(os.path.join(appdata, script + '.log'), 'w', errors='replace')
+    # If running with no console, stdin will be None, and that causes problems
+    sys.stdin = None
+
+if __name__ == '__main__':
+    from {module} import {function}
+    {function}()
+"""
+
+
+@dataclass
+class PortableEntry:
+    '''
+    A file of the portable app at arcname ("/" separated): a file, a member of a zip archive, or data.
+    '''
+    arcname: str
+    source: Path = None
+    member: str = None
+    data: bytes = None
+
+
+def cfg_values(cfg, section, key):
+    if not cfg.has_option(section, key):
+        return []
+    return [v.strip() for v in cfg.get(section, key).splitlines() if v.strip()]
+
+
+def tree_entries(source_dir, arc_dir):
+    entries = []
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        rel_dir = Path(dir_path).relative_to(source_dir).as_posix()
+        for file_name in file_names:
+            arcname = '/'.join(p for p in [arc_dir, rel_dir, file_name] if p and p != '.')
+            entries.append(PortableEntry(arcname, source=Path(dir_path) / file_name))
+    return entries
+
+
+def embed_entries(embed_archive):
+    '''
+    The embeddable Python under Python/, its ._pth files extended with ..\\pkgs like pynsist does.
+    '''
+    entries = []
+    with zipfile.ZipFile(embed_archive) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            arcname = f'Python/{info.filename}'
+            if info.filename.endswith('._pth'):
+                pth = z.read(info).decode('utf8').rstrip('\r\n')
+                entries.append(PortableEntry(arcname, data=f'{pth}\n..\\pkgs\n'.encode('utf8')))
+            else:
+                entries.append(PortableEntry(arcname, source=Path(embed_archive), member=info.filename))
+    return entries
+
+
+def package_entries(package, site_packages_dir):
+    '''
+    An importable package or module copied from the packaging venv, like pynsist's packages=.
+    '''
+    for name in dict.fromkeys([package, re.sub(r'[-.]+', '_', package), re.sub(r'[-.]+', '_', package).lower()]):
+        if (Path(site_packages_dir) / name).is_dir():
+            return tree_entries(Path(site_packages_dir) / name, f'pkgs/{name}')
+        if (Path(site_packages_dir) / f'{name}.py').is_file():
+            return [PortableEntry(f'pkgs/{name}.py', source=Path(site_packages_dir) / f'{name}.py')]
+    logger.warning(f'NOT FOUND package [{package}] in [{site_packages_dir}]')
+    return []
+
+
+def file_entries(line, cfg_dir):
+    '''
+    A files= line of pynsist.cfg: "path" installs into $INSTDIR, "path > $INSTDIR\\sub" into sub.
+    '''
+    source, _, destination = line.partition('>')
+    source = Path(cfg_dir) / source.strip()
+    arc_dir = destination.strip().replace('\\', '/')
+    arc_dir = arc_dir[len(INSTDIR):].strip('/') if arc_dir.startswith(INSTDIR) else arc_dir.strip('/')
+    if source.is_dir():
+        return tree_entries(source, '/'.join(p for p in [arc_dir, source.name] if p))
+    if source.is_file():
+        return [PortableEntry('/'.join(p for p in [arc_dir, source.name] if p), source=source)]
+    logger.warning(f'NOT EXIST file [{source}]')
+    return []
+
+
+def plan_portable(pynsist_cfg, embed_archive, site_packages_dir):
+    '''
+    Entries of the portable app, from pynsist.cfg and its pynsist_pkgs. Later entries win.
+
+    create_pynsist_cfg unpacks every wheel into pynsist_pkgs (see bibiinstaller_unpack), the cfg lists none.
+    '''
+    cfg_file = Path(pynsist_cfg).resolve()
+    cfg = configparser.ConfigParser()
+    cfg.read(cfg_file, encoding='latin1')
+    name = cfg.get('Application', 'name')
+    entries = embed_entries(embed_archive)
+    pynsist_pkgs = cfg_file.parent / 'pynsist_pkgs'
+    if pynsist_pkgs.is_dir():
+        entries += tree_entries(pynsist_pkgs, 'pkgs')
+    for package in cfg_values(cfg, 'Include', 'packages'):
+        entries += package_entries(package, site_packages_dir)
+    for line in cfg_values(cfg, 'Include', 'files'):
+        entries += file_entries(line, cfg_file.parent)
+    icon = cfg.get('Application', 'icon', fallback='').strip()
+    if icon and Path(icon).is_file():
+        entries.append(PortableEntry(Path(icon).name, source=Path(icon)))
+    module, _, function = cfg.get('Application', 'entry_point').partition(':')
+    entries.append(PortableEntry(f'{name}.launch.pyw', data=LAUNCH_SCRIPT.format(
+        module=module.strip(), function=function.strip()).encode('utf8')))
+
+    excludes = [e.replace('\\', '/').strip('/') for e in cfg_values(cfg, 'Include', 'exclude')]
+    planned = {}
+    for entry in entries:
+        if not is_excluded(entry.arcname, excludes):
+            planned[entry.arcname] = entry
+    return list(planned.values())
+
+
+def write_dir(entries, target_dir, max_workers=None):
+    '''
+    Write entries under target_dir: files on a thread pool, one task per archive for its members.
+    '''
+    from bibiinstaller.bibiinstaller_copy import copy_file
+    target_dir = Path(target_dir)
+    for parent in sorted({(target_dir / e.arcname).parent for e in entries}):
+        parent.mkdir(parents=True, exist_ok=True)
+    members = defaultdict(list)
+    for entry in entries:
+        if entry.member is not None:
+            members[entry.source].append(entry)
+
+    def write_file(entry):
+        if entry.data is not None:
+            (target_dir / entry.arcname).write_bytes(entry.data)
+        else:
+            copy_file(entry.source, target_dir / entry.arcname)
+
+    def extract_members(archive):
+        with zipfile.ZipFile(archive) as z:
+            for entry in members[archive]:
+                with z.open(entry.member) as src, open(target_dir / entry.arcname, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        futures = [pool.submit(write_file, e) for e in entries if e.member is None]
+        futures += [pool.submit(extract_members, archive) for archive in members]
+        for future in futures:
+            future.result()
+    return target_dir
+
+
+def write_zip(entries, zip_file, compression='lzma'):
+    '''
+    Stream entries into zip_file, archives stay open while their members are copied.
+    '''
+    zip_compression, compresslevel = ZIP_COMPRESSION.get(compression or 'lzma', ZIP_COMPRESSION['lzma'])
+    archives = {}
+    try:
+        with zipfile.ZipFile(zip_file, 'w', compression=zip_compression, compresslevel=compresslevel) as zf:
+            for entry in entries:
+                if entry.data is not None:
+                    zf.writestr(entry.arcname, entry.data)
+                elif entry.member is None:
+                    zf.write(entry.source, entry.arcname)
+                else:
+                    if entry.source not in archives:
+                        archives[entry.source] = zipfile.ZipFile(entry.source)
+                    info = archives[entry.source].getinfo(entry.member)
+                    zinfo = zipfile.ZipInfo(entry.arcname, info.date_time)
+                    zinfo.file_size = info.file_size
+                    zinfo.compress_type = zip_compression
+                    # ''' as ZipFile.write does, open() has no compresslevel argument '''
+                    zinfo._compresslevel = compresslevel
+                    with archives[entry.source].open(info) as src, zf.open(zinfo, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return Path(zip_file)
+
+
+def assemble_portable(pynsist_cfg, embed_archive, site_packages_dir, destination_dir, output_name,
+                      output='dir', compression='lzma'):
+    '''
+    Write the portable app of pynsist_cfg into destination_dir as output_name/ (dir) or output_name.zip (zip).
+
+    Returns the written dir or zip.
+    '''
+    if output not in OUTPUTS[1:]:
+        sys.exit(f"UNKNOWN portable output [{output}], choose from: {', '.join(OUTPUTS[1:])}")
+    if embed_archive is None or not Path(embed_archive).is_file():
+        sys.exit(f"NO embeddable Python archive for the portable {output}, see the embed cache warnings.")
+    started = time.perf_counter()
+    entries = plan_portable(pynsist_cfg, embed_archive, site_packages_dir)
+    destination_dir = Path(destination_dir)
+    destination_dir.mkdir(parents=True, exist_ok=True)
+    target = destination_dir / (output_name if output == 'dir' else f'{output_name}.zip')
+    staging = target.with_name(f'.{target.name}.tmp-{os.getpid()}')
+    if output == 'dir':
+        shutil.rmtree(staging, ignore_errors=True)
+        write_dir(entries, staging)
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        write_zip(entries, staging, compression)
+    os.replace(staging, target)
+    logger.info(f'portable {output} [{target}]: {len(entries)} files in {time.perf_counter() - started:.2f}s')
+    return target
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Resolution for the target platform, without a Windows packaging venv.
+
+    bibiinstaller configs.py --resolution platform --output zip
+
+The venv resolution (default) installs the project into a packaging venv of
+the target Python and reads back pip freeze, so it needs a Windows interpreter
+of the right version and bitness. --resolution platform resolves with the pip
+of the Python running bibiinstaller instead, for the target of the build:
+
+    pip download --platform win_amd64 --python-version 3.9 --implementation cp
+                 --only-binary :all: --no-deps --dest pip_download_platform
+                 <project wheel> EXTRA_REQUIREMENTS_TXT_PATH lines EXTRA_PACKAGES
+
+The project wheel is built by the same pip, a pure Python one only. The
+downloaded wheels, UNWANTED_PACKAGES left out, are the whole payload: unpacked
+and staged like --staging wheel (see bibiinstaller_unpack). Their versions and
+sha256 are written into the lock <work dir>/platform.lock, copied next to the
+output in dist/, which `pip install --require-hashes -r` installs again.
+A requirement without a binary wheel for the target fails the resolution.
+
+pip evaluates environment markers against the machine it runs on, --platform
+or not: on Linux it drops `pywin32; sys_platform == "win32"` and asks for
+`uvloop; sys_platform != "win32"`. So pip downloads with --no-deps only, and
+the requirements and the Requires-Dist of the downloaded wheels are walked here
+with the markers of the target (see windows_environment): what holds there but
+was not downloaded is fetched by further `pip download --no-deps` runs, until
+nothing is missing. There is no backtracking, the first version downloaded of a
+package has to satisfy every later requirement on it.
+pynsist is installed with pip --target into <work dir>/nsist-tools.
+"""
+import os
+import shlex
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+from bibiinstaller.bibiinstaller_unpack import platform_tag
+
+PLATFORM_MACHINES = {64: 'AMD64', 32: 'x86'}
+PLATFORM_DOWNLOAD_DIR_NAME = 'pip_download_platform'
+LOCK_NAME = 'platform.lock'
+NSIST_DIR_NAME = 'nsist-tools'
+
+
+def platform_options(python_version, bitness):
+    '''
+    pip options selecting the wheels of CPython python_version (X.Y[.Z]) on Windows.
+    '''
+    return ['--platform', platform_tag(bitness), '--python-version', '.'.join(str(python_version).split('.')[:2]),
+            '--implementation', 'cp', '--only-binary', ':all:']
+
+
+def windows_environment(python_version, bitness):
+    '''
+    The environment markers of CPython python_version (X.Y[.Z]) on Windows, for packaging.markers.
+    '''
+    from packaging.markers import default_environment
+    parts = str(python_version).split('.')
+    full_version = '.'.join((parts + ['0', '0'])[:3])
+    return dict(default_environment(), os_name='nt', sys_platform='win32', platform_system='Windows',
+                platform_machine=PLATFORM_MACHINES[int(bitness)], platform_release='', platform_version='',
+                implementation_name='cpython', platform_python_implementation='CPython',
+                implementation_version=full_version, python_version='.'.join(parts[:2]),
+                python_full_version=full_version, extra='')
+
+
+def wheel_requirements(wheel_file):
+    '''
+    The Requires-Dist of a wheel.
+    '''
+    import zipfile
+    from email.parser import HeaderParser
+    with zipfile.ZipFile(wheel_file) as z:
+        metadata = next(n for n in z.namelist() if n.count('/') == 1 and n.endswith('.dist-info/METADATA'))
+        return HeaderParser().parsestr(z.read(metadata).decode('utf8')).get_all('Requires-Dist') or []
+
+
+def read_requirements_txt(requirements_txt):
+    '''
+    The requirement lines and the pip options of a requirements file, -r files included.
+    '''
+    requirements_txt = Path(requirements_txt)
+    requirements, pip_options = [], []
+    text = requirements_txt.read_text(encoding='utf8').replace('\\\n', '')
+    for line in text.splitlines():
+        line = line.partition(' #')[0].strip()
+        if not line or line.startswith('#'):
+            continue
+        if not line.startswith('-'):
+            requirements.append(line)
+            continue
+        args = shlex.split(line)
+        if args[0] in ('-r', '--requirement'):
+            nested = read_requirements_txt(requirements_txt.parent / args[1])
+            requirements += nested[0]
+            pip_options += nested[1]
+        else:
+            pip_options += args
+    return requirements, pip_options
+
+
+def holds(requirement, environment, extras=()):
+    '''
+    The marker of requirement holds in environment for one of extras, or without extra.
+    '''
+    if not requirement.marker:
+        return True
+    return any(requirement.marker.evaluate(dict(environment, extra=extra)) for extra in ['', *extras])
+
+
+def missing_requirements(download_dir, environment, requirements=()):
+    '''
+    {name: [requirement]} of requirements and of the Requires-Dist of the downloaded wheels that hold in environment
+    but have no wheel in download_dir. Exits when a downloaded version does not satisfy a requirement.
+    '''
+    from packaging.requirements import Requirement
+    from bibiinstaller.bibiinstaller_windows import canonicalize_package_name, canonicalize_wheel_filename
+    downloaded, requires = {}, {}
+    for wheel_file in sorted(Path(download_dir).glob('*.whl')):
+        name, version = canonicalize_wheel_filename(wheel_file)
+        downloaded[name] = version
+        requires[name] = [Requirement(line) for line in wheel_requirements(wheel_file)]
+    extras = {}
+    while True:
+        # ''' an extra asked for by a later requirement brings in more Requires-Dist of its package '''
+        holding = [r for r in map(Requirement, requirements) if holds(r, environment)]
+        holding += [r for name, rs in requires.items() for r in rs if holds(r, environment, extras.get(name, ()))]
+        wanted = {}
+        for requirement in holding:
+            wanted.setdefault(canonicalize_package_name(requirement.name), set()).update(requirement.extras)
+        if wanted == extras:
+            break
+        extras = wanted
+    missing = {}
+    for requirement in holding:
+        name = canonicalize_package_name(requirement.name)
+        if name in downloaded:
+            if not requirement.specifier.contains(downloaded[name], prereleases=True):
+                sys.exit(f"CONFLICT [{requirement}] with the downloaded {name}=={downloaded[name]}")
+            continue
+        # ''' the marker holds on the target, pip would evaluate it again on this host '''
+        requirement.marker = None
+        if str(requirement) not in missing.get(name, []):
+            missing.setdefault(name, []).append(str(requirement))
+    return missing
+
+
+def check_project_wheel(project_wheel, bitness):
+    '''
+    Refuse a project wheel built for this machine instead of the target platform.
+    '''
+    platform = Path(project_wheel).stem.split('-')[-1]
+    if platform not in ['any', platform_tag(bitness)]:
+        sys.exit(f"PLATFORM wheel [{Path(project_wheel).name}], --resolution platform builds pure Python "
+                 f"projects only, use --resolution venv")
+    return project_wheel
+
+
+def resolve_platform(python, work_dir, project_wheel, python_version, bitness,
+                     extra_requirements_txt_path=None, extra_packages=None, unwanted_packages=None):
+    '''
+    Download the wheels of project_wheel and the extra requirements for the target platform, returns the lock file.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_windows import (
+        canonicalize_package_name, canonicalize_wheel_filename, subprocess_run
+    )
+    download_dir = (Path(work_dir) / PLATFORM_DOWNLOAD_DIR_NAME).resolve()
+    # ''' a fresh wheelhouse holds exactly this resolution, pip's http cache keeps downloads local '''
+    shutil.rmtree(download_dir, ignore_errors=True)
+    download_dir.mkdir(parents=True)
+    requirements = [str(project_wheel)]
+    roots, pip_options = [], []
+    if extra_requirements_txt_path and Path(extra_requirements_txt_path).is_file():
+        requirements += ['-r', str(extra_requirements_txt_path)]
+        roots, pip_options = read_requirements_txt(extra_requirements_txt_path)
+    requirements += list(extra_packages or [])
+    roots += list(extra_packages or [])
+    options = platform_options(python_version, bitness) + ['--no-deps'] + pip_options
+    logger.info(f"Resolving {requirements} for {' '.join(options[:4])}")
+    started = time.perf_counter()
+    subprocess_run(get_backend().pip_command(python, 'download', *options, '--dest', str(download_dir),
+                                             str(project_wheel)))
+    environment = windows_environment(python_version, bitness)
+    missing = missing_requirements(download_dir, environment, roots)
+    while missing:
+        logger.info(f'Resolving {sorted(missing)} for {platform_tag(bitness)}')
+        subprocess_run(get_backend().pip_command(python, 'download', *options, '--dest', str(download_dir),
+                                                 *[r for rs in missing.values() for r in rs]))
+        still_missing = missing_requirements(download_dir, environment, roots)
+        if set(still_missing) & set(missing):
+            sys.exit(f"NOT FOUND wheels of {sorted(set(still_missing) & set(missing))} for {platform_tag(bitness)}")
+        missing = still_missing
+
+    project_name, project_version = canonicalize_wheel_filename(project_wheel)
+    unwanted_names = [canonicalize_package_name(p) for p in unwanted_packages or []]
+    wheels = {}
+    for wheel_file in sorted(download_dir.glob('*.whl')):
+        name, version = canonicalize_wheel_filename(wheel_file)
+        if name == project_name:
+            continue
+        if name in unwanted_names:
+            logger.info(f'UNWANTED [{wheel_file.name}] left out')
+            continue
+        wheels[f'{name}=={version}'] = wheel_file
+    logger.info(f'RESOLVED {len(wheels)} wheels for {platform_tag(bitness)} in {time.perf_counter() - started:.2f}s')
+    header = (f'{project_name}=={project_version} for {platform_tag(bitness)}, '
+              f'CPython {options[3]}: {" ".join(requirements[1:])}')
+    return write_lock(Path(work_dir) / LOCK_NAME, wheels, header)
+
+
+def write_lock(lock_file, wheels, header=''):
+    '''
+    {requirement: wheel file} as a hash-pinned requirements file.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import hash_file
+    lines = [f'# bibiinstaller platform lock of {header}'.rstrip()]
+    for requirement, wheel_file in sorted(wheels.items(), key=lambda item: item[0].partition('==')[0]):
+        lines += [f'{requirement} \\', f'    --hash=sha256:{hash_file(wheel_file)}']
+    Path(lock_file).write_text('\n'.join(lines) + '\n', encoding='utf8')
+    logger.info(f'Wrote platform lock [{lock_file}]')
+    return Path(lock_file)
+
+
+def read_lock(lock_file):
+    '''
+    The "name==version" requirements of a lock.
+    '''
+    return [line.split()[0] for line in Path(lock_file).read_text(encoding='utf8').splitlines()
+            if line.strip() and not line[0].isspace() and not line.startswith('#')]
+
+
+def check_staged_entrypoint(pynsist_pkgs_dir, entrypoint):
+    '''
+    The module of entrypoint among the staged files, it cannot be imported on another platform.
+    '''
+    module = Path(pynsist_pkgs_dir, *entrypoint.split(':')[0].strip().split('.'))
+    if not (module.with_suffix('.py').is_file() or (module / '__init__.py').is_file()):
+        sys.exit(f"NOT FOUND entrypoint module [{entrypoint}] in [{pynsist_pkgs_dir}]")
+    return module
+
+
+def install_pynsist(python, work_dir, pynsist_version):
+    '''
+    pynsist installed with pip --target into the work dir, not into python itself.
+
+    Returns the env of `python -m nsist`.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_embed import pynsist_env
+    from bibiinstaller.bibiinstaller_windows import subprocess_run
+    nsist_dir = (Path(work_dir) / NSIST_DIR_NAME).resolve()
+    if not list(nsist_dir.glob(f'pynsist-{pynsist_version}*.dist-info')):
+        shutil.rmtree(nsist_dir, ignore_errors=True)
+        subprocess_run(get_backend().pip_command(python, 'install', '--target', str(nsist_dir),
+                                                 f'pynsist=={pynsist_version}', '--no-warn-script-location'))
+    env = pynsist_env()
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [str(nsist_dir), env.get('PYTHONPATH')] if p)
+    return env
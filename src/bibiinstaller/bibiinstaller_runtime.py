@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Shared runtime layer: one Python and its packages for several apps.
+
+    RUNTIME_PACKAGES = ['PyQt6==6.6.1', 'numpy']    # bibiinstaller_configs.py
+
+Apps on the same heavy stack each bundle their own copy of it. With
+RUNTIME_PACKAGES the stack is built once per runtime id into
+
+    <cache>/runtimes/<id>/bibiinstaller_runtime_<id>.exe
+
+the id hashing the embeddable Python version, bitness, the runtime packages,
+the installer backend and the bibiinstaller version. The runtime installer
+writes the embeddable Python with the packages in its Lib\\site-packages to
+<Program Files or LocalAppData>\\bibiinstaller\\runtimes\\<id> and records
+InstallLocation under Software\\bibiinstaller\\runtimes\\<id>.
+
+The app venv installs the packages pinned to the versions of the runtime.
+After nsist, the distributions of pkgs the runtime holds with the same files
+are dropped with build/nsis/Python: the thin installer links $INSTDIR\\Python
+to the runtime Python (a directory junction), so the launcher, shortcuts and
+upgrades work unchanged, and asks for the runtime installer when it is
+missing. Uninstalling an app removes the junction only.
+
+The runtime installer is copied into dist/ next to the app installer, built
+with the compression of the first app using it. Installers only: the portable
+output bundles the runtime packages.
+"""
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import zipfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+
+from bibiinstaller.bibiinstaller_cache import build_fingerprint, get_cache_home, publish_entry
+from bibiinstaller.bibiinstaller_logger import logger
+
+RUNTIMES_DIR_NAME = 'runtimes'
+RUNTIME_JSON = 'runtime.json'
+RUNTIME_VENV_NAME = 'runtime-venv'
+RUNTIME_NSI_TEMPLATE = Path(__file__).parent / 'nsi_templates' / 'bibiinstaller_runtime.nsi'
+# ''' the app nsi template links $INSTDIR\Python when makensis defines it '''
+RUNTIME_DEFINE = 'RUNTIME_ID'
+# ''' written by pip at install time, they differ between the runtime and an app '''
+INSTALL_RECORDS = ['INSTALLER', 'REQUESTED', 'RECORD', 'direct_url.json']
+
+
+@dataclass
+class Runtime:
+    runtime_id: str
+    python_version: str
+    bitness: int
+    installer_exe: str
+    requirements: list = field(default_factory=list)
+    # ''' dist-info name -> distribution_digest '''
+    distributions: dict = field(default_factory=dict)
+    runtime_dir: Path = None
+
+    @property
+    def installer_file(self):
+        return self.runtime_dir / self.installer_exe
+
+    @property
+    def defines(self):
+        return {RUNTIME_DEFINE: self.runtime_id, 'RUNTIME_INSTALLER': self.installer_exe}
+
+
+def get_runtimes_dir():
+    return get_cache_home() / RUNTIMES_DIR_NAME
+
+
+def compute_runtime_id(python_version, bitness, packages):
+    '''
+    py<major><minor>-<bitness>bit-<digest> of the embeddable Python version and the runtime packages.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    digest = build_fingerprint(
+        parameters=dict(
+            toolchain=get_toolchain().name, installer=get_backend().name,
+            python_version=python_version, bitness=int(bitness), packages=sorted(p.strip() for p in packages)),
+        paths=dict(find_links=get_backend().find_links),
+        name='runtime'
+    )
+    major, minor = python_version.split('.')[:2]
+    return f'py{major}{minor}-{bitness}bit-{digest[:12]}'
+
+
+def runtime_installer_name(runtime_id):
+    return f'bibiinstaller_runtime_{runtime_id}.exe'
+
+
+def read_runtime(runtime_dir):
+    runtime_json = Path(runtime_dir) / RUNTIME_JSON
+    if not runtime_json.exists():
+        return None
+    runtime = json.loads(runtime_json.read_text(encoding='utf8'))
+    runtime.pop('created', None)
+    return Runtime(**runtime, runtime_dir=Path(runtime_dir))
+
+
+def write_runtime(runtime: Runtime, runtime_dir):
+    runtime_json = dict(asdict(runtime), created=time.time())
+    runtime_json.pop('runtime_dir')
+    (Path(runtime_dir) / RUNTIME_JSON).write_text(json.dumps(runtime_json, indent=2), encoding='utf8')
+
+
+def record_paths(dist_info: Path):
+    '''
+    The RECORD entries of dist_info under its site dir, scripts (../../Scripts) skipped.
+    '''
+    rel_paths = []
+    with open(dist_info / 'RECORD', newline='', encoding='utf8') as f:
+        for row in csv.reader(f):
+            rel_path = PurePosixPath(row[0]) if row and row[0] else None
+            if rel_path is not None and not rel_path.is_absolute() and '..' not in rel_path.parts:
+                rel_paths.append(rel_path.as_posix())
+    return rel_paths
+
+
+def distribution_digest(site_dir, dist_info):
+    '''
+    sha256 over the paths and contents of the files of a distribution, None when one is missing.
+
+    Byte code and the files pip writes at install time are left out.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import hash_file
+    digest = hashlib.sha256()
+    for rel_path in sorted(record_paths(dist_info)):
+        parts = PurePosixPath(rel_path).parts
+        if '__pycache__' in parts or (parts[0] == dist_info.name and parts[-1] in INSTALL_RECORDS):
+            continue
+        file_path = Path(site_dir) / rel_path
+        if not file_path.is_file():
+            return None
+        digest.update(f'{rel_path}\0{hash_file(file_path)}\n'.encode('utf8'))
+    return digest.hexdigest()
+
+
+def distribution_digests(site_dir):
+    digests = {}
+    for dist_info in sorted(Path(site_dir).glob('*.dist-info')):
+        if (dist_info / 'RECORD').is_file():
+            digest = distribution_digest(site_dir, dist_info)
+            if digest is not None:
+                digests[dist_info.name] = digest
+    return digests
+
+
+def stage_runtime(nsis_dir, embed_archive, site_packages_dir):
+    '''
+    nsis_dir/Python: the embeddable Python, its ._pth extended with Lib\\site-packages, the packages in there.
+    '''
+    from bibiinstaller.bibiinstaller_objects import stage_paths
+    python_dir = Path(nsis_dir) / 'Python'
+    with zipfile.ZipFile(embed_archive) as z:
+        z.extractall(python_dir)
+    # ''' the apps run this Python through their $INSTDIR\Python junction, their launch script adds pkgs '''
+    for pth_file in python_dir.glob('*._pth'):
+        pth = pth_file.read_text(encoding='utf8').rstrip('\r\n')
+        pth_file.write_text(f'{pth}\nLib\\site-packages\nimport site\n', encoding='utf8')
+    stage_paths([site_packages_dir], python_dir / 'Lib' / 'site-packages')
+    return python_dir
+
+
+def render_runtime_nsi(nsis_dir, runtime: Runtime, compression=None, compression_dict_size=None):
+    from string import Template
+    from bibiinstaller.bibiinstaller_nsis import compression_directives
+
+    class CustomTemplate(Template):
+        delimiter = '@'
+
+    template = CustomTemplate(RUNTIME_NSI_TEMPLATE.read_text(encoding='utf8'))
+    nsi_text = template.substitute(dict(
+        RUNTIME_ID=runtime.runtime_id, PY_VERSION=runtime.python_version, BITNESS=runtime.bitness,
+        INSTALLER_NAME=runtime.installer_exe,
+        COMPRESSION=compression_directives(compression, compression_dict_size)))
+    nsi_file = Path(nsis_dir) / 'runtime.nsi'
+    nsi_file.write_text(nsi_text, encoding='utf8', newline='\n')
+    return nsi_file
+
+
+def get_runtime(python_version, python_version_embed, embed_archive, packages, bitness=64, conda_path=None,
+                compression=None, compression_dict_size=None):
+    '''
+    The cached runtime of packages on python_version_embed, built on a miss.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_venvs import site_packages_of
+    from bibiinstaller.bibiinstaller_windows import (
+        create_packaging_venv, pip_freeze, prepare_nsis_plugins, subprocess_run
+    )
+    runtime_id = compute_runtime_id(python_version_embed, bitness, packages)
+    runtime_dir = get_runtimes_dir() / runtime_id
+    runtime = read_runtime(runtime_dir)
+    if runtime is not None and runtime.installer_file.exists():
+        os.utime(runtime_dir / RUNTIME_JSON)
+        logger.info(f'runtime cache HIT: [{runtime.installer_file}]')
+        return runtime
+    logger.info(f'runtime cache MISS: [{runtime_id}]')
+    build_dir = runtime_dir.with_name(f'{runtime_id}.tmp-{os.getpid()}')
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+    started = time.perf_counter()
+    env_python = create_packaging_venv(build_dir, python_version, venv_name=RUNTIME_VENV_NAME,
+                                       conda_path=conda_path, bitness=bitness)
+    subprocess_run(get_backend().pip_command(env_python, 'install', *packages, '--no-warn-script-location'))
+    site_packages_dir = site_packages_of(env_python)
+    runtime = Runtime(runtime_id=runtime_id, python_version=python_version_embed, bitness=int(bitness),
+                      installer_exe=runtime_installer_name(runtime_id), requirements=pip_freeze(env_python),
+                      distributions=distribution_digests(site_packages_dir))
+
+    nsis_dir = build_dir / 'nsis'
+    stage_runtime(nsis_dir, embed_archive, site_packages_dir)
+    nsi_file = render_runtime_nsi(nsis_dir, runtime, compression, compression_dict_size)
+    prepare_nsis_plugins(build_dir)
+    makensis = shutil.which('makensis')
+    if makensis is None or subprocess_run([makensis, '/V2', nsi_file], exit=False) != 0:
+        sys.exit(f"FAILED makensis, the runtime is staged in [{nsis_dir}]")
+    os.replace(nsis_dir / runtime.installer_exe, build_dir / runtime.installer_exe)
+    for staged_dir in [nsis_dir, build_dir / RUNTIME_VENV_NAME, build_dir / 'windows_assets']:
+        shutil.rmtree(staged_dir, ignore_errors=True)
+    write_runtime(runtime, build_dir)
+    if not publish_entry(build_dir, runtime_dir, RUNTIME_JSON, runtime.installer_exe):
+        logger.debug(f'a concurrent build stored the runtime [{runtime_id}] first')
+    runtime.runtime_dir = runtime_dir
+    logger.info(f'BUILT runtime [{runtime.installer_file}] in {time.perf_counter() - started:.2f}s, '
+                f'{len(runtime.distributions)} distributions')
+    return runtime
+
+
+def find_runtime(runtime_id):
+    '''
+    The cached runtime of runtime_id, or None.
+    '''
+    runtime = read_runtime(get_runtimes_dir() / runtime_id)
+    return runtime if runtime is not None and runtime.installer_file.exists() else None
+
+
+def check_template(nsi_template_path):
+    '''
+    Exit unless the app nsi template links the runtime Python when RUNTIME_ID is defined.
+    '''
+    if not nsi_template_path or RUNTIME_DEFINE not in Path(nsi_template_path).read_text(encoding='utf8'):
+        sys.exit(f"NO {RUNTIME_DEFINE} in the nsi template [{nsi_template_path}]: RUNTIME_PACKAGES needs a "
+                 f"template linking $INSTDIR\\Python to the runtime, like nsi_templates/bibiinstaller.nsi")
+
+
+def drop_runtime_distributions(nsis_build_dir, runtime: Runtime):
+    '''
+    Remove build/nsis/Python and the distributions of pkgs the runtime holds with the same files.
+
+    Returns the dropped dist-info names.
+    '''
+    from bibiinstaller.bibiinstaller_manifest import PKGS_DIR_NAME, remove_empty_dirs
+    nsis_build_dir = Path(nsis_build_dir)
+    pkgs_dir = nsis_build_dir / PKGS_DIR_NAME
+    dropped, removed = [], []
+    for dist_info in sorted(pkgs_dir.glob('*.dist-info')):
+        digest = runtime.distributions.get(dist_info.name)
+        if digest is None or not (dist_info / 'RECORD').is_file() or \
+                distribution_digest(pkgs_dir, dist_info) != digest:
+            continue
+        rel_paths = record_paths(dist_info)
+        for rel_path in rel_paths:
+            (pkgs_dir / rel_path).unlink(missing_ok=True)
+        shutil.rmtree(dist_info, ignore_errors=True)
+        removed += rel_paths
+        dropped.append(dist_info.name)
+    remove_empty_dirs(pkgs_dir, removed)
+    shutil.rmtree(nsis_build_dir / 'Python', ignore_errors=True)
+    logger.info(f'DROPPED {len(dropped)} distributions of runtime [{runtime.runtime_id}]: {dropped}')
+    return dropped
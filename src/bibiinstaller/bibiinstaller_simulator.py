@@ -0,0 +1,570 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Fake executables of the simulated toolchain.
+
+write_simulator() writes small shell wrappers (micromamba.exe, ResourceHacker.exe,
+makensis, bibiinstaller_app.exe) that run this module, and every simulated
+python.exe does the same with its own prefix. The fakes leave the same files
+behind as the real tools, so run_installer needs no special cases:
+
+- micromamba create: an env with a fake python.exe
+- host/python.exe: the Python running bibiinstaller
+- python -m venv: a Windows layout venv (Scripts/python.exe, Lib/site-packages)
+- python -m pip install/uninstall/freeze/list/download/wheel: dist-info based
+  installs from the local package index stand-in in simulator.json, pip
+  download evaluates the markers of "requires" against this host like pip does
+- python -m nsist: pynsist's build/nsis dir with the embeddable Python from
+  PYNSIST_CACHE_DIR (copied from the python.org stand-in on a miss), then
+  makensis from PATH unless --no-makensis
+- ResourceHacker: copies the launcher
+- makensis: writes OutFile
+
+Only POSIX hosts are supported.
+"""
+import configparser
+import json
+import os
+import re
+import shutil
+import stat
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+SIMULATOR_JSON = 'simulator.json'
+TOOLS = ['micromamba', 'venv', 'pip', 'resource_hacker', 'nsist', 'makensis']
+DEFAULT_PACKAGE_SIZE = 64 * 1024
+DEFAULT_VERSION = '1.0.0'
+# ''' options with a value, ignored: the local package index stand-in serves every package '''
+VALUE_OPTIONS = ('--find-links', '-f', '--index-url', '-i', '--extra-index-url', '--no-binary', '--only-binary',
+                 '--platform', '--python-version', '--implementation', '--abi', '--target', '-t')
+PYTHON_ORG_DIR = 'python.org'
+HOST_DIR_NAME = 'host'
+
+WRAPPER_TEMPLATE = """#!/bin/sh
+PYTHONPATH="{src_dir}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{python}" -m bibiinstaller.bibiinstaller_simulator \\
+    "{config}" {tool} {prefix} "$@"
+"""
+
+
+def write_executable(path, content):
+    path = Path(path)
+    path.write_text(content, encoding='utf8', newline='\n')
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def write_wrapper(path, config_json, tool, prefix='-'):
+    return write_executable(path, WRAPPER_TEMPLATE.format(
+        src_dir=Path(__file__).resolve().parents[1], python=sys.executable,
+        config=config_json, tool=tool, prefix=f'"{prefix}"'))
+
+
+def write_simulator(root, config: dict):
+    '''
+    Write simulator.json and the fake tools under root, returns their bin dir.
+    '''
+    root = Path(root)
+    bin_dir = root / 'bin'
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    config_json = root / SIMULATOR_JSON
+    config_json.write_text(json.dumps(config, indent=2), encoding='utf8')
+    write_wrapper(bin_dir / 'micromamba.exe', config_json, 'micromamba')
+    write_wrapper(bin_dir / 'ResourceHacker.exe', config_json, 'resource_hacker')
+    write_wrapper(bin_dir / 'makensis', config_json, 'makensis')
+    # ''' the Python running bibiinstaller, for --resolution platform '''
+    (root / HOST_DIR_NAME / 'Lib' / 'site-packages').mkdir(parents=True, exist_ok=True)
+    write_wrapper(root / HOST_DIR_NAME / 'python.exe', config_json, 'python', root / HOST_DIR_NAME)
+    (bin_dir / 'bibiinstaller_app.exe').write_bytes(b'MZ' + b'\0' * 1022)
+    return bin_dir
+
+
+class Simulator:
+    def __init__(self, config_json):
+        self.config_json = Path(config_json)
+        self.root = self.config_json.parent
+        config = json.loads(self.config_json.read_text(encoding='utf8'))
+        self.latency = config.get('latency', {})
+        self.output_size = config.get('output_size', {})
+        self.index = {canonicalize(name): info for name, info in config.get('index', {}).items()}
+
+    def wait(self, tool):
+        latency = float(self.latency.get(tool, 0))
+        if latency > 0:
+            time.sleep(latency)
+
+    def package_info(self, name):
+        info = dict(version=DEFAULT_VERSION, size=self.output_size.get('package', DEFAULT_PACKAGE_SIZE),
+                    requires=[], wheel=True)
+        info.update(self.index.get(canonicalize(name), {}))
+        return info
+
+    def write_python(self, prefix, exe_dir=None):
+        '''
+        python.exe in exe_dir, its prefix relative to itself: copied venvs keep working like real ones.
+        '''
+        prefix = Path(prefix)
+        exe_dir = prefix if exe_dir is None else Path(exe_dir)
+        exe_dir.mkdir(parents=True, exist_ok=True)
+        relative_prefix = os.path.relpath(prefix, exe_dir)
+        return write_wrapper(exe_dir / 'python.exe', self.config_json, 'python',
+                             f'$(cd "$(dirname "$0")/{relative_prefix}" && pwd)')
+
+    # ''' micromamba create --yes -n NAME python=X.Y -c conda-forge --root-prefix PREFIX '''
+    def micromamba(self, args):
+        self.wait('micromamba')
+        root_prefix = Path(option_value(args, '--root-prefix'))
+        environment_name = option_value(args, '-n')
+        self.write_python(root_prefix / 'envs' / environment_name)
+        return 0
+
+    # ''' ResourceHacker.exe -open A -save B -action addskip -res ICON -mask ICONGROUP,MAINICON '''
+    def resource_hacker(self, args):
+        self.wait('resource_hacker')
+        save = Path(option_value(args, '-save'))
+        save.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(option_value(args, '-open'), save)
+        return 0
+
+    # ''' makensis [/V2] installer.nsi '''
+    def makensis(self, args):
+        self.wait('makensis')
+        nsi_file = Path(args[-1])
+        match = re.search(r'!define INSTALLER_NAME "([^"]+)"', nsi_file.read_text(encoding='utf8'))
+        out_file = nsi_file.parent / match.group(1)
+        payload_size = sum(f.stat().st_size for f in nsi_file.parent.rglob('*') if f.is_file())
+        write_sized_file(out_file, int(self.output_size.get('installer', payload_size // 3)))
+        print(f'Output: "{out_file}"')
+        return 0
+
+    def python(self, prefix, args):
+        python = SimulatedPython(self, Path(prefix))
+        if args[:2] == ['-m', 'venv']:
+            return python.venv(args[2:])
+        if args[:2] == ['-m', 'pip']:
+            return python.pip(args[2:])
+        if args[:2] == ['-m', 'nsist']:
+            return python.nsist(args[2:])
+        # ''' -c "from package import main; main()" and anything else '''
+        return 0
+
+
+class SimulatedPython:
+    def __init__(self, simulator: Simulator, prefix: Path):
+        self.simulator = simulator
+        self.prefix = prefix
+        self.site_packages = prefix / 'Lib' / 'site-packages'
+
+    def venv(self, args):
+        self.simulator.wait('venv')
+        venv_dir = Path(args[-1])
+        (venv_dir / 'Lib' / 'site-packages').mkdir(parents=True, exist_ok=True)
+        (venv_dir / 'pyvenv.cfg').write_text(f'home = {self.prefix}\n', encoding='utf8')
+        self.simulator.write_python(venv_dir, venv_dir / 'Scripts')
+        return 0
+
+    def pip(self, args):
+        self.simulator.wait('pip')
+        command, args = args[0], args[1:]
+        if command == 'install':
+            return self.pip_install(args)
+        if command == 'uninstall':
+            for name in [a for a in args if not a.startswith('-')]:
+                self.uninstall(name)
+            return 0
+        if command in ('freeze', 'list'):
+            for dist_info in sorted(self.site_packages.glob('*.dist-info')):
+                name, version = read_dist_info(dist_info)
+                print(f'{name}=={version}')
+            return 0
+        if command == 'download':
+            return self.pip_download(args)
+        if command == 'wheel':
+            return self.pip_wheel(args)
+        print(f'UNSUPPORTED pip {command}', file=sys.stderr)
+        return 1
+
+    def pip_install(self, args):
+        no_deps = '--no-deps' in args
+        targets = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ('-r', '--requirement'):
+                targets += read_requirement_lines(args[i + 1])
+                i += 1
+            elif arg in ('-e', '--editable'):
+                targets.append(args[i + 1])
+                i += 1
+            elif arg in VALUE_OPTIONS:
+                i += 1
+            elif not arg.startswith('-'):
+                targets.append(arg)
+            i += 1
+        for target in targets:
+            if Path(target).is_dir():
+                self.install_project(Path(target), no_deps)
+            elif Path(target).is_file() and target.endswith('.whl'):
+                self.install_wheel(Path(target), no_deps)
+            else:
+                self.install_requirement(target, no_deps)
+        return 0
+
+    def install_requirement(self, requirement, no_deps=False, installed=None):
+        installed = set() if installed is None else installed
+        name, version = split_requirement(requirement)
+        if canonicalize(name) in installed:
+            return
+        installed.add(canonicalize(name))
+        info = self.simulator.package_info(name)
+        self.install_files(name, version or info['version'], info['size'])
+        if not no_deps:
+            for dependency in info['requires']:
+                self.install_requirement(dependency, installed=installed)
+
+    def install_project(self, project_root: Path, no_deps=False):
+        from bibiinstaller.bibiinstaller_windows import read_project_info
+        name, version, _ = read_project_info(project_root, project_root.name)
+        source_root = project_root / 'src' if (project_root / 'src').is_dir() else project_root
+        self.uninstall(name)
+        records = []
+        for package_dir in sorted(source_root.iterdir()):
+            if package_dir.is_dir() and (package_dir / '__init__.py').exists():
+                shutil.copytree(package_dir, self.site_packages / package_dir.name, dirs_exist_ok=True)
+                records += [f.relative_to(self.site_packages).as_posix()
+                            for f in (self.site_packages / package_dir.name).rglob('*') if f.is_file()]
+        write_dist_info(self.site_packages, name, version, records)
+        if not no_deps:
+            self.install_dependencies(name, read_project_dependencies(project_root))
+
+    def install_dependencies(self, name, dependencies):
+        installed = {canonicalize(name)}
+        for dependency in dependencies:
+            self.install_requirement(dependency, installed=installed)
+
+    def install_wheel(self, wheel_file: Path, no_deps=False):
+        name, requires = read_wheel_metadata(wheel_file)
+        self.uninstall(name)
+        with zipfile.ZipFile(wheel_file) as z:
+            z.extractall(self.site_packages)
+        if not no_deps:
+            self.install_dependencies(name, requires)
+
+    # ''' pip wheel --no-deps --wheel-dir DIR <project_root | sdist | name @ url> '''
+    def pip_wheel(self, args):
+        from bibiinstaller.bibiinstaller_windows import read_project_info
+        wheel_dir = Path(option_value(args, '--wheel-dir', '-w'))
+        wheel_dir.mkdir(parents=True, exist_ok=True)
+        project_root = Path(args[-1])
+        if not project_root.is_dir():
+            name, version = split_requirement(args[-1])
+            if project_root.is_file():
+                name, _, version = project_root.name[:-len('.tar.gz')].rpartition('-')
+            info = self.simulator.package_info(name)
+            write_wheel(wheel_dir, name, version or info['version'], info['size'], info['requires'])
+            return 0
+        name, version, _ = read_project_info(project_root, project_root.name)
+        source_root = project_root / 'src' if (project_root / 'src').is_dir() else project_root
+        module = module_name(name)
+        dist_info = f'{module}-{version}.dist-info'
+        metadata = f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'
+        metadata += ''.join(f'Requires-Dist: {r}\n' for r in read_project_dependencies(project_root))
+        records = []
+        with zipfile.ZipFile(wheel_dir / f'{module}-{version}-py3-none-any.whl', 'w', zipfile.ZIP_DEFLATED) as z:
+            for package_dir in sorted(source_root.iterdir()):
+                if package_dir.is_dir() and (package_dir / '__init__.py').exists():
+                    for file in sorted(f for f in package_dir.rglob('*') if f.is_file()):
+                        records.append(file.relative_to(source_root).as_posix())
+                        z.write(file, records[-1])
+            z.writestr(f'{dist_info}/METADATA', metadata)
+            z.writestr(f'{dist_info}/WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+            records += [f'{dist_info}/METADATA', f'{dist_info}/WHEEL', f'{dist_info}/RECORD']
+            z.writestr(f'{dist_info}/RECORD', ''.join(f'{r},,\n' for r in records))
+        return 0
+
+    def install_files(self, name, version, size):
+        self.uninstall(name)
+        module = module_name(name)
+        package_dir = self.site_packages / module
+        package_dir.mkdir(parents=True, exist_ok=True)
+        (package_dir / '__init__.py').write_text(f'__version__ = "{version}"\n', encoding='utf8')
+        write_sized_file(package_dir / 'payload.bin', size)
+        write_dist_info(self.site_packages, name, version, [f'{module}/__init__.py', f'{module}/payload.bin'])
+
+    def uninstall(self, name):
+        for dist_info in list(self.site_packages.glob('*.dist-info')):
+            if canonicalize(read_dist_info(dist_info)[0]) == canonicalize(name):
+                for line in (dist_info / 'RECORD').read_text(encoding='utf8').splitlines():
+                    top_level = line.split(',', 1)[0].split('/', 1)[0]
+                    if top_level and (self.site_packages / top_level).is_dir() and top_level != dist_info.name:
+                        shutil.rmtree(self.site_packages / top_level, ignore_errors=True)
+                shutil.rmtree(dist_info)
+
+    # ''' pip download [--no-deps] --dest DIR <requirement | wheel file | -r requirements.txt> '''
+    def pip_download(self, args):
+        dest = Path(option_value(args, '--dest', '-d'))
+        dest.mkdir(parents=True, exist_ok=True)
+        requirements = []
+        i = 0
+        while i < len(args):
+            if args[i] in ('-r', '--requirement'):
+                requirements += read_requirement_lines(args[i + 1])
+                i += 1
+            elif args[i] in ('--dest', '-d', *VALUE_OPTIONS):
+                i += 1
+            elif not args[i].startswith('-'):
+                requirements.append(args[i])
+            i += 1
+        downloaded = set()
+        while requirements:
+            requirement = requirements.pop(0)
+            if requirement.endswith('.whl') and Path(requirement).is_file():
+                shutil.copy2(requirement, dest)
+                name, requires = read_wheel_metadata(requirement)
+                downloaded.add(canonicalize(name))
+            else:
+                name, version = split_requirement(requirement)
+                if canonicalize(name) in downloaded:
+                    continue
+                downloaded.add(canonicalize(name))
+                info = self.simulator.package_info(name)
+                requires = info['requires']
+                if '--no-binary' in args:
+                    write_sdist(dest, name, version or info['version'])
+                elif not info['wheel']:
+                    print(f'ERROR: No matching distribution found for {requirement}', file=sys.stderr)
+                    return 1
+                else:
+                    write_wheel(dest, name, version or info['version'], info['size'], info['requires'])
+            if '--no-deps' not in args:
+                requirements += host_requirements(requires)
+        return 0
+
+    def nsist(self, args):
+        '''
+        Lay out build/nsis like pynsist: pkgs from pynsist_pkgs, wheels and packages, then makensis
+        unless --no-makensis.
+        '''
+        self.simulator.wait('nsist')
+        cfg_file = Path(args[-1]).resolve()
+        cfg = configparser.ConfigParser()
+        cfg.read(cfg_file, encoding='latin1')
+        # ''' pynsist loads nsi_template from the cfg dir or its own package dir '''
+        template = cfg.get('Build', 'nsi_template', fallback='').strip()
+        if template and not any((d / template).is_file() for d in [cfg_file.parent, self.site_packages / 'nsist']):
+            print(f'jinja2.exceptions.TemplateNotFound: {template}', file=sys.stderr)
+            return 1
+        build_dir = cfg_file.parent / 'build' / 'nsis'
+        pkgs_dir = build_dir / 'pkgs'
+        pkgs_dir.mkdir(parents=True, exist_ok=True)
+        self.fetch_python_embeddable(cfg, build_dir)
+        pynsist_pkgs = cfg_file.parent / 'pynsist_pkgs'
+        if pynsist_pkgs.is_dir():
+            shutil.copytree(pynsist_pkgs, pkgs_dir, dirs_exist_ok=True)
+        wheel_sources = cfg_values(cfg, 'Include', 'extra_wheel_sources')
+        for requirement in cfg_values(cfg, 'Include', 'pypi_wheels'):
+            name, version = split_requirement(requirement)
+            for source in wheel_sources:
+                for wheel_file in Path(source).glob(f'{module_name(name)}-{version}-*.whl'):
+                    with zipfile.ZipFile(wheel_file) as z:
+                        z.extractall(pkgs_dir)
+        for local_wheel in cfg_values(cfg, 'Include', 'local_wheels'):
+            for wheel_file in Path(local_wheel).parent.glob(Path(local_wheel).name):
+                with zipfile.ZipFile(wheel_file) as z:
+                    z.extractall(pkgs_dir)
+        for package in cfg_values(cfg, 'Include', 'packages'):
+            package_dir = self.site_packages / module_name(package)
+            if package_dir.is_dir():
+                shutil.copytree(package_dir, pkgs_dir / package_dir.name, dirs_exist_ok=True)
+        for file in cfg_values(cfg, 'Include', 'files'):
+            source = Path(file.split('>')[0].strip())
+            if source.is_file():
+                shutil.copy2(source, build_dir)
+            elif source.is_dir():
+                shutil.copytree(source, build_dir / source.name, dirs_exist_ok=True)
+        installer_name = cfg.get('Build', 'installer_name')
+        nsi_file = build_dir / 'installer.nsi'
+        nsi_file.write_text(f'!define PRODUCT_NAME "{cfg.get("Application", "name")}"\n'
+                            f'!define PRODUCT_VERSION "{cfg.get("Application", "version")}"\n'
+                            f'!define BITNESS "{cfg.get("Python", "bitness", fallback="64").strip()}"\n'
+                            f'!define INSTALLER_NAME "{installer_name}"\n'
+                            f'OutFile "${{INSTALLER_NAME}}"\n', encoding='utf8')
+        if '--no-makensis' in args:
+            return 0
+        makensis = shutil.which('makensis')
+        if makensis is None:
+            print('makensis was not found.', file=sys.stderr)
+            return 1
+        import subprocess
+        return subprocess.run([makensis, '/V2', str(nsi_file)]).returncode
+
+    def fetch_python_embeddable(self, cfg, build_dir):
+        '''
+        Like pynsist: the archive from PYNSIST_CACHE_DIR, downloaded on a miss, unpacked into build/nsis/Python.
+        '''
+        version = cfg.get('Python', 'version')
+        arch = 'amd64' if cfg.get('Python', 'bitness', fallback='64').strip() == '64' else 'win32'
+        filename = f'python-{version}-embed-{arch}.zip'
+        cache_dir = Path(os.environ.get('PYNSIST_CACHE_DIR') or Path.home() / '.cache' / 'pynsist')
+        cache_file = cache_dir / filename
+        if not cache_file.is_file():
+            print(f'Downloading embeddable Python build... {filename}')
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(python_org_archive(self.simulator.root, filename), cache_file)
+        with zipfile.ZipFile(cache_file) as z:
+            z.extractall(build_dir / 'Python')
+
+
+def python_org_archive(root, filename):
+    '''
+    python.org stand-in: every embeddable archive exists, written on first request.
+    '''
+    version = filename.split('-')[1]
+    archive = Path(root) / PYTHON_ORG_DIR / version / filename
+    if not archive.exists():
+        xy = ''.join(version.split('.')[:2])
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = archive.with_name(f'{filename}.tmp-{os.getpid()}')
+        with zipfile.ZipFile(tmp_file, 'w') as z:
+            z.writestr('python.exe', b'MZ' + b'\0' * 1022)
+            z.writestr(f'python{xy}.dll', b'MZ' + b'\0' * 4094)
+            z.writestr(f'python{xy}.zip', b'PK\x05\x06' + b'\0' * 18)
+            z.writestr(f'python{xy}._pth', f'python{xy}.zip\n.\n')
+        os.replace(tmp_file, archive)
+    return archive
+
+
+def canonicalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def module_name(name):
+    return re.sub(r'[-_.]+', '_', name)
+
+
+def split_requirement(requirement):
+    '''
+    "name==1.0" -> (name, "1.0"), "name>=1.0", "name @ url" and "name" -> (name, None)
+    '''
+    requirement = requirement.split(';', 1)[0].strip()
+    name = re.split(r'[\s<>=!~@\[(]', requirement, 1)[0]
+    _, _, version = requirement.partition('==')
+    version = version.split(',', 1)[0].strip() or None
+    return name, version
+
+
+def host_requirements(requirements):
+    '''
+    The requirements whose environment marker holds on this host, what pip download follows even with --platform.
+    '''
+    from packaging.requirements import Requirement
+    return [r for r in requirements if Requirement(r).marker is None or Requirement(r).marker.evaluate({'extra': ''})]
+
+
+def option_value(args, *options, default=None):
+    for i, arg in enumerate(args[:-1]):
+        if arg in options:
+            return args[i + 1]
+    return default
+
+
+def cfg_values(cfg, section, key):
+    if not cfg.has_option(section, key):
+        return []
+    return [line.strip() for line in cfg.get(section, key).splitlines() if line.strip()]
+
+
+def read_requirement_lines(requirements_txt):
+    lines = [line.split('#', 1)[0].strip() for line in
+             Path(requirements_txt).read_text(encoding='utf8').splitlines()]
+    return [line for line in lines if line and not line.startswith('-')]
+
+
+def read_project_dependencies(project_root: Path):
+    if (project_root / 'pyproject.toml').exists():
+        from bibiinstaller.bibiinstaller_windows import read_pyproject_toml_info
+        return read_pyproject_toml_info(project_root / 'pyproject.toml').get('project', {}).get('dependencies', [])
+    if (project_root / 'setup.py').exists():
+        match = re.search(r'install_requires\s*=\s*\[(.*?)\]',
+                          (project_root / 'setup.py').read_text(encoding='utf8'), re.S)
+        if match:
+            return re.findall(r'[\'"]([^\'"]+)[\'"]', match.group(1))
+    return []
+
+
+def read_dist_info(dist_info: Path):
+    metadata = (dist_info / 'METADATA').read_text(encoding='utf8')
+    name = re.search(r'^Name: (.+)$', metadata, re.M).group(1).strip()
+    version = re.search(r'^Version: (.+)$', metadata, re.M).group(1).strip()
+    return name, version
+
+
+def read_wheel_metadata(wheel_file):
+    '''
+    (name, Requires-Dist) of a wheel.
+    '''
+    with zipfile.ZipFile(wheel_file) as z:
+        dist_info = next(n.split('/')[0] for n in z.namelist() if n.endswith('.dist-info/METADATA'))
+        metadata = z.read(f'{dist_info}/METADATA').decode('utf8')
+    name = re.search(r'^Name: (.+)$', metadata, re.M).group(1).strip()
+    return name, re.findall(r'^Requires-Dist: (.+)$', metadata, re.M)
+
+
+def write_dist_info(site_packages: Path, name, version, records):
+    dist_info = site_packages / f'{module_name(name)}-{version}.dist-info'
+    dist_info.mkdir(parents=True, exist_ok=True)
+    (dist_info / 'METADATA').write_text(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n',
+                                        encoding='utf8')
+    (dist_info / 'INSTALLER').write_text('pip\n', encoding='utf8')
+    records = records + [f'{dist_info.name}/{f}' for f in ('METADATA', 'INSTALLER', 'RECORD')]
+    (dist_info / 'RECORD').write_text(''.join(f'{r},,\n' for r in records), encoding='utf8')
+    return dist_info
+
+
+def write_sized_file(path, size):
+    block = bytes(range(256)) * 256
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
+
+
+def write_wheel(dest: Path, name, version, size, requires=()):
+    module = module_name(name)
+    wheel_file = dest / f'{module}-{version}-py3-none-any.whl'
+    if wheel_file.exists():
+        return wheel_file
+    dist_info = f'{module}-{version}.dist-info'
+    with zipfile.ZipFile(wheel_file, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr(f'{module}/__init__.py', f'__version__ = "{version}"\n')
+        z.writestr(f'{module}/payload.bin', (bytes(range(256)) * (size // 256 + 1))[:size])
+        z.writestr(f'{dist_info}/METADATA', f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'
+                                            + ''.join(f'Requires-Dist: {r}\n' for r in requires))
+        z.writestr(f'{dist_info}/WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+        z.writestr(f'{dist_info}/RECORD', f'{module}/__init__.py,,\n{module}/payload.bin,,\n'
+                                          f'{dist_info}/METADATA,,\n{dist_info}/WHEEL,,\n{dist_info}/RECORD,,\n')
+    return wheel_file
+
+
+def write_sdist(dest: Path, name, version):
+    sdist_file = dest / f'{module_name(name)}-{version}.tar.gz'
+    sdist_file.write_bytes(f'{name}=={version}\n'.encode('utf8'))
+    return sdist_file
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    config_json, tool, prefix, args = argv[0], argv[1], argv[2], argv[3:]
+    simulator = Simulator(config_json)
+    if tool == 'python':
+        return simulator.python(prefix, args)
+    return getattr(simulator, tool)(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
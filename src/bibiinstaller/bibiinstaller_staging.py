@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Per-distribution staging plan of pynsist_pkgs.
+
+    bibiinstaller configs.py --staging hybrid
+
+Without is_wheel_first all of site-packages is staged, build venv leftovers
+included; with it every requirement is downloaded as a wheel, even the huge
+ones installed in the venv already. --staging hybrid picks the cheapest
+source for each distribution of pip freeze:
+
+    installed   the files of its RECORD, linked from the packaging venv
+    cached      a wheel already on disk (pip_download_only_binaries of the work
+                dir, --find_links), unpacked once (see bibiinstaller_unpack)
+    download    pip download of the wheel, then like cached
+    package     pynsist copies the import package (editable and RECORD-less installs)
+
+An install is only used while its files match the sizes in RECORD. The costs
+are estimated from the sizes on disk and the rates below, the plan is logged
+with its bytes and seconds per source before anything is staged.
+"""
+import csv
+import json
+import os
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from bibiinstaller.bibiinstaller_cache import format_size
+from bibiinstaller.bibiinstaller_logger import logger
+
+STAGING_SOURCES = ['installed', 'cached', 'download', 'package']
+# ''' rough rates of this machine, only the order of the estimates matters '''
+PER_FILE_SECONDS = 0.0002
+LINK_BYTES_PER_SECOND = 400 * 1024 * 1024
+UNPACK_BYTES_PER_SECOND = 80 * 1024 * 1024
+DOWNLOAD_RATE_ENV = 'BIBIINSTALLER_DOWNLOAD_RATE'
+DEFAULT_DOWNLOAD_BYTES_PER_SECOND = 5 * 1024 * 1024
+# ''' wheel size over installed size, to estimate a download '''
+WHEEL_SIZE_RATIO = 0.4
+
+
+@dataclass
+class StagingChoice:
+    requirement: str
+    name: str
+    source: str
+    size: int = 0
+    files: int = 0
+    seconds: float = 0.0
+    # ''' RECORD paths under site-packages of a usable install, the fallback of a failed download '''
+    paths: list = field(default_factory=list)
+    wheel_file: Path = None
+
+
+def get_download_rate():
+    rate = os.environ.get(DOWNLOAD_RATE_ENV)
+    return int(rate) if rate else DEFAULT_DOWNLOAD_BYTES_PER_SECOND
+
+
+def link_seconds(files, size):
+    return files * PER_FILE_SECONDS + size / LINK_BYTES_PER_SECOND
+
+
+def installed_distributions(site_packages_dir):
+    '''
+    {canonical name: .dist-info dir} of site_packages_dir.
+    '''
+    from bibiinstaller.bibiinstaller_windows import canonicalize_package_name
+    site_packages_dir = Path(site_packages_dir)
+    if not site_packages_dir.is_dir():
+        return {}
+    return {canonicalize_package_name(d.name[:-len('.dist-info')].rsplit('-', 1)[0]): d
+            for d in site_packages_dir.glob('*.dist-info') if d.is_dir()}
+
+
+def installed_files(site_packages_dir, dist_info: Path):
+    '''
+    (RECORD paths, bytes) of an install, None when its files cannot be staged as they are:
+    no RECORD, editable, or a file missing or changed since pip wrote RECORD.
+    '''
+    record = dist_info / 'RECORD'
+    if not record.is_file():
+        return None
+    direct_url = dist_info / 'direct_url.json'
+    if direct_url.is_file():
+        try:
+            if json.loads(direct_url.read_text(encoding='utf8')).get('dir_info', {}).get('editable'):
+                return None
+        except ValueError:
+            return None
+    paths, size = [], 0
+    with open(record, newline='', encoding='utf8') as f:
+        for row in csv.reader(f):
+            rel_path = PurePosixPath(row[0]) if row and row[0] else None
+            # ''' scripts (../../Scripts) and byte code are not part of pkgs '''
+            if rel_path is None or rel_path.is_absolute() or '..' in rel_path.parts or '__pycache__' in rel_path.parts:
+                continue
+            try:
+                stat = os.stat(Path(site_packages_dir) / rel_path)
+            except OSError:
+                return None
+            if len(row) > 2 and row[2] and int(row[2]) != stat.st_size:
+                return None
+            paths.append(rel_path.as_posix())
+            size += stat.st_size
+    return paths, size
+
+
+def wheel_cost(wheel_file, cache=None):
+    '''
+    (files, bytes, seconds) of staging wheel_file, unpacking skipped when it is cached unpacked.
+    '''
+    from bibiinstaller.bibiinstaller_unpack import UNPACKED_JSON, get_unpacked_dir, wheel_digest
+    with zipfile.ZipFile(wheel_file) as z:
+        infos = [i for i in z.infolist() if not i.is_dir()]
+    size = sum(i.file_size for i in infos)
+    seconds = link_seconds(len(infos), size)
+    if not (get_unpacked_dir() / wheel_digest(wheel_file, cache) / UNPACKED_JSON).exists():
+        seconds += Path(wheel_file).stat().st_size / UNPACK_BYTES_PER_SECOND + size / UNPACK_BYTES_PER_SECOND
+    return len(infos), size, seconds
+
+
+def plan_staging(requirements, site_packages_dir, wheel_sources, skip_pypi_packages=(), download_rate=None,
+                 python_version=None, bitness=None):
+    '''
+    The cheapest StagingChoice of each "pip freeze" requirement.
+
+    skip_pypi_packages are never downloaded, a cached wheel of them is still used. With python_version
+    and bitness only the cached wheels installable on that target are candidates.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+    from bibiinstaller.bibiinstaller_unpack import index_wheels
+    from bibiinstaller.bibiinstaller_windows import canonicalize_package_name, canonicalize_requirement
+    download_rate = download_rate or get_download_rate()
+    distributions = installed_distributions(site_packages_dir)
+    wheels = index_wheels([Path(s).resolve() for s in wheel_sources if s and Path(s).is_dir()], python_version, bitness)
+    skip_pypi_names = [canonicalize_package_name(p) for p in skip_pypi_packages]
+    plan = []
+    with DigestCache() as cache:
+        for requirement in requirements:
+            name = canonicalize_package_name(requirement)
+            candidates = []
+            installed = installed_files(site_packages_dir, distributions[name]) if name in distributions else None
+            paths = installed[0] if installed else []
+            if installed:
+                candidates.append(StagingChoice(requirement, name, 'installed', installed[1], len(paths),
+                                                link_seconds(len(paths), installed[1]), paths=paths))
+            wheel_file = wheels.get(canonicalize_requirement(requirement)) if '@' not in requirement else None
+            if wheel_file is not None:
+                files, size, seconds = wheel_cost(wheel_file, cache)
+                candidates.append(StagingChoice(requirement, name, 'cached', size, files, seconds,
+                                                paths=paths, wheel_file=wheel_file))
+            elif '@' not in requirement and name not in skip_pypi_names:
+                # ''' without an install the download size is unknown, it is the last choice then '''
+                size = installed[1] if installed else 0
+                download = size * WHEEL_SIZE_RATIO
+                seconds = (download / download_rate + (download + size) / UNPACK_BYTES_PER_SECOND
+                           + link_seconds(len(paths), size)) if installed else float('inf')
+                candidates.append(StagingChoice(requirement, name, 'download', size, len(paths), seconds,
+                                                paths=paths))
+            if candidates:
+                plan.append(min(candidates, key=lambda c: (c.seconds, STAGING_SOURCES.index(c.source))))
+            else:
+                plan.append(StagingChoice(requirement, name, 'package'))
+    return plan
+
+
+def log_plan(plan):
+    for choice in plan:
+        seconds = f'~{choice.seconds:.2f}s' if choice.seconds != float('inf') else 'unknown'
+        logger.debug(f'{choice.source:>9} {choice.requirement}: {choice.files} files, {format_size(choice.size)}, '
+                     f'{seconds}' + (f' [{choice.wheel_file}]' if choice.wheel_file else ''))
+    counts, sizes, seconds = Counter(), Counter(), Counter()
+    for choice in plan:
+        counts[choice.source] += 1
+        sizes[choice.source] += choice.size
+        seconds[choice.source] += choice.seconds if choice.seconds != float('inf') else 0
+    logger.info(f'STAGING plan of {len(plan)} distributions:')
+    for source in STAGING_SOURCES:
+        if counts[source]:
+            logger.info(f'  {source:>9}: {counts[source]:>5} distributions, {format_size(sizes[source]):>10}, '
+                        f'~{seconds[source]:.1f}s')
+    return plan
+
+
+def stage_plan(plan, site_packages_dir, pynsist_pkgs_dir, work_dir, python, excludes=None):
+    '''
+    Stage the installed choices of plan into pynsist_pkgs and download the wheels of the download choices.
+
+    Returns (wheel requirements, wheel sources, packages) for pynsist.cfg, a failed download falls back
+    to the install, then to the package.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+    from bibiinstaller.bibiinstaller_objects import ObjectStore
+    from bibiinstaller.bibiinstaller_unpack import is_excluded
+    from bibiinstaller.bibiinstaller_windows import pip_wheels_in, separate_package_name
+    downloads = [c for c in plan if c.source == 'download']
+    if downloads:
+        downloaded, pip_download_dir = pip_wheels_in(work_dir, python, [c.requirement for c in downloads])
+        for choice in downloads:
+            if choice.requirement not in downloaded:
+                choice.source = 'installed' if choice.paths else 'package'
+                logger.warning(f'NOT DOWNLOADED [{choice.requirement}], staged as {choice.source}')
+    wheel_choices = [c for c in plan if c.source in ['cached', 'download']]
+    wheel_sources = [str(c.wheel_file.parent) for c in wheel_choices if c.wheel_file]
+    if downloads:
+        wheel_sources.append(str(pip_download_dir))
+    wheel_sources = list(dict.fromkeys(wheel_sources))
+
+    installed_paths = {p for c in plan if c.source == 'installed' for p in c.paths}
+    excludes = [e.replace('\\', '/').strip('/') for e in excludes or []]
+    if installed_paths:
+        with DigestCache() as cache, ObjectStore(cache=cache) as store:
+            store.stage_tree(
+                site_packages_dir, pynsist_pkgs_dir,
+                skip=lambda rel_path: rel_path not in installed_paths or is_excluded(f'pkgs/{rel_path}', excludes))
+    packages = [separate_package_name(c.requirement) for c in plan if c.source == 'package']
+    return [c.requirement for c in wheel_choices], wheel_sources, packages
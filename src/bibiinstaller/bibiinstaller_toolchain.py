@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+External tools used by run_installer: micromamba, ResourceHacker, the
+bibiinstaller_app launcher, NSIS and the python.org embeddable archives.
+
+The "windows" toolchain uses the bundled Windows assets. The "simulated"
+toolchain writes fake micromamba, python/venv/pip, ResourceHacker and
+makensis executables backed by a local package index stand-in (see
+bibiinstaller_simulator), so the whole pipeline runs deterministically on Linux.
+
+    bibiinstaller configs.py --toolchain simulated
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_logger import logger
+
+TOOLCHAIN_ENV = 'BIBIINSTALLER_TOOLCHAIN'
+SIMULATOR_ROOT_ENV = 'BIBIINSTALLER_SIMULATOR_ROOT'
+
+_toolchain = None
+
+
+class WindowsToolchain:
+    name = 'windows'
+
+    def __init__(self):
+        from bibiinstaller.bibiinstaller_windows import ASSETS_HOME
+        self.windows_assets_home = ASSETS_HOME / 'Windows'
+        self._micromamba_exe = None
+
+    def micromamba_exe(self):
+        if self._micromamba_exe is not None:
+            return self._micromamba_exe
+        micromamba_path = self.windows_assets_home / 'micromamba'
+        logger.debug(f"micromamba_path = [{micromamba_path}]")
+        micromamba_exes = list(micromamba_path.glob('*.exe'))
+        if len(micromamba_exes) < 1:
+            logger.warning(f'NO micromamba.exe under [{micromamba_path}]')
+        self._micromamba_exe = sorted(micromamba_exes, key=lambda file: Path(file).lstat().st_mtime,
+                                      reverse=True)[0].resolve()
+        return self._micromamba_exe
+
+    def resource_hacker_exe(self):
+        return self.windows_assets_home / 'icon_configs' / 'ResourceHacker.exe'
+
+    def launcher_exe(self):
+        return self.windows_assets_home / 'exes' / 'bibiinstaller_app.exe'
+
+    def nsis_dir(self):
+        return self.windows_assets_home / 'nsis'
+
+    def makensis_dir(self, work_nsis_dir):
+        return work_nsis_dir
+
+    def python_embed_version(self, python_version, bitness=64):
+        from bibiinstaller.bibiinstaller_embed import resolve_embed_version
+        return resolve_embed_version(python_version, bitness)
+
+    def python_embed_url(self, version, bitness=64):
+        from bibiinstaller.bibiinstaller_embed import embed_url
+        return embed_url(version, bitness)
+
+    def resolver_python(self):
+        '''
+        The Python whose pip resolves --resolution platform builds: the one running bibiinstaller.
+        '''
+        return Path(sys.executable)
+
+
+class SimulatedToolchain(WindowsToolchain):
+    '''
+    latency: seconds per tool, keys of bibiinstaller_simulator.TOOLS.
+    output_size: bytes, "installer" for makensis outputs (default: payload / 3)
+                 and "package" for every simulated distribution.
+    index: {name: {"version": "1.0.0", "size": 1024, "requires": [...], "wheel": true}},
+           names missing from the index are synthesized as version 1.0.0 wheels.
+    '''
+    name = 'simulated'
+
+    def __init__(self, root, latency: dict = None, output_size: dict = None, index: dict = None):
+        super().__init__()
+        from bibiinstaller.bibiinstaller_simulator import write_simulator
+        self.root = Path(root).resolve()
+        self.config = dict(latency=latency or {}, output_size=output_size or {}, index=index or {})
+        self.bin_dir = write_simulator(self.root, self.config)
+
+    def micromamba_exe(self):
+        return self.bin_dir / 'micromamba.exe'
+
+    def resource_hacker_exe(self):
+        return self.bin_dir / 'ResourceHacker.exe'
+
+    def launcher_exe(self):
+        return self.bin_dir / 'bibiinstaller_app.exe'
+
+    def makensis_dir(self, work_nsis_dir):
+        return self.bin_dir
+
+    def python_embed_version(self, python_version, bitness=64):
+        return python_version
+
+    def python_embed_url(self, version, bitness=64):
+        from bibiinstaller.bibiinstaller_embed import embed_filename
+        from bibiinstaller.bibiinstaller_simulator import python_org_archive
+        return python_org_archive(self.root, embed_filename(version, bitness)).as_uri()
+
+    def resolver_python(self):
+        from bibiinstaller.bibiinstaller_simulator import HOST_DIR_NAME
+        return self.root / HOST_DIR_NAME / 'python.exe'
+
+
+def create_toolchain(name: str = None):
+    if name is None:
+        name = os.environ.get(TOOLCHAIN_ENV) or WindowsToolchain.name
+    if name == WindowsToolchain.name:
+        return WindowsToolchain()
+    if name == SimulatedToolchain.name:
+        from bibiinstaller.bibiinstaller_simulator import SIMULATOR_JSON
+        root = os.environ.get(SIMULATOR_ROOT_ENV)
+        if not root:
+            from bibiinstaller.bibiinstaller_cache import get_cache_home
+            root = get_cache_home() / 'simulator'
+        config_json = Path(root) / SIMULATOR_JSON
+        config = json.loads(config_json.read_text(encoding='utf8')) if config_json.exists() else {}
+        return SimulatedToolchain(root, **config)
+    sys.exit(f"UNKNOWN toolchain [{name}], choose from: windows, simulated")
+
+
+def get_toolchain():
+    global _toolchain
+    if _toolchain is None:
+        _toolchain = create_toolchain()
+        logger.info(f'toolchain: {_toolchain.name}')
+    return _toolchain
+
+
+def set_toolchain(toolchain):
+    global _toolchain
+    _toolchain = toolchain
+    logger.info(f'toolchain: {toolchain.name}')
+    return toolchain
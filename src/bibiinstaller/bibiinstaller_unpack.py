@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Parallel, cached unpacking of the wheels of a build.
+
+pynsist extracts pypi_wheels and local_wheels one after another during nsist,
+minutes for wheels the size of PyQt6. bibiinstaller unpacks the downloaded
+wheels (pip_download_only_binaries) and LOCAL_WHEEL_PATH itself, once per
+wheel content, into
+
+    <cache>/unpacked/<wheel sha256>/pkgs/
+
+on a process pool, laid out like pynsist does: .data/purelib and .data/platlib
+merged, the other .data dirs skipped. Every member is checked against the
+sha256 and size in the wheel RECORD while it is written, a wheel that does
+not match is refused. The trees are staged into pynsist_pkgs through the
+object store with EXCLUDE_CONFIGS applied, and pynsist.cfg no longer lists
+the wheels. The wheels of the requirements are looked up with find_wheels,
+for the tags of the target Python and bitness (see index_wheels).
+"""
+import base64
+import csv
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from bibiinstaller.bibiinstaller_cache import get_cache_home, publish_entry
+from bibiinstaller.bibiinstaller_logger import logger
+
+UNPACKED_DIR_NAME = 'unpacked'
+UNPACKED_JSON = 'unpacked.json'
+TREE_DIR_NAME = 'pkgs'
+# ''' RECORD itself and its signatures carry no hash '''
+UNHASHED_RECORDS = ['RECORD', 'RECORD.jws', 'RECORD.p7s']
+CHUNK_SIZE = 1024 * 1024
+WHEEL_DATA_TO_PKGS = ['purelib', 'platlib']
+PLATFORM_TAGS = {64: 'win_amd64', 32: 'win32'}
+
+
+def get_unpacked_dir():
+    return get_cache_home() / UNPACKED_DIR_NAME
+
+
+def read_record(z: zipfile.ZipFile):
+    '''
+    (dist-info dir, {member: (hash, size)}) of the RECORD of a wheel.
+    '''
+    record_names = [n for n in z.namelist() if PurePosixPath(n).parent.name.endswith('.dist-info')
+                    and n.count('/') == 1 and n.endswith('/RECORD')]
+    if len(record_names) != 1:
+        raise ValueError(f'NO single .dist-info/RECORD: {record_names}')
+    records = {}
+    with z.open(record_names[0]) as f:
+        for row in csv.reader(io.TextIOWrapper(f, encoding='utf8', newline='')):
+            if row and row[0]:
+                records[row[0]] = (row[1] if len(row) > 1 else '', row[2] if len(row) > 2 else '')
+    return record_names[0].split('/')[0], records
+
+
+def pkgs_path(member):
+    '''
+    Where pynsist puts a wheel member under pkgs/, None for the skipped .data dirs.
+    '''
+    parts = member.split('/')
+    if parts[0].endswith('.data'):
+        if len(parts) < 3 or parts[1] not in WHEEL_DATA_TO_PKGS:
+            return None
+        parts = parts[2:]
+    return '/'.join(parts)
+
+
+def unpack_wheel(wheel_file, target_dir):
+    '''
+    Extract wheel_file into target_dir, checking every member against RECORD. Returns the number of files.
+
+    Runs in the worker processes, raises ValueError for a wheel that does not match its RECORD.
+    '''
+    target_dir = Path(target_dir)
+    count = 0
+    with zipfile.ZipFile(wheel_file) as z:
+        dist_info, records = read_record(z)
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            member = PurePosixPath(info.filename)
+            if member.is_absolute() or '..' in member.parts:
+                raise ValueError(f'UNSAFE member: {info.filename}')
+            record = records.get(info.filename)
+            if record is None and not (member.parent.name == dist_info and member.name in UNHASHED_RECORDS):
+                raise ValueError(f'NOT IN RECORD: {info.filename}')
+            rel_path = pkgs_path(info.filename)
+            if rel_path is None:
+                continue
+            algorithm, _, expected = record[0].partition('=') if record else ('', '', '')
+            digest = hashlib.new(algorithm) if algorithm else None
+            size = 0
+            target = target_dir / rel_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with z.open(info) as src, open(target, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    if digest is not None:
+                        digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            if digest is not None and base64.urlsafe_b64encode(digest.digest()).rstrip(b'=').decode() != expected:
+                raise ValueError(f'RECORD {algorithm} MISMATCH: {info.filename}')
+            if record and record[1] and int(record[1]) != size:
+                raise ValueError(f'RECORD size MISMATCH: {info.filename} {size} != {record[1]}')
+            count += 1
+    return count
+
+
+def platform_tag(bitness):
+    return PLATFORM_TAGS[int(bitness)]
+
+
+def target_tags(python_version, bitness):
+    '''
+    {tag: priority} of the wheels CPython python_version (X.Y[.Z]) installs on Windows, the most specific first.
+    '''
+    from packaging import tags
+    version = tuple(int(v) for v in str(python_version).split('.')[:2])
+    interpreter = f'cp{version[0]}{version[1]}'
+    platforms = [platform_tag(bitness)]
+    supported = (list(tags.cpython_tags(version, abis=[interpreter], platforms=platforms))
+                 + list(tags.compatible_tags(version, interpreter, platforms)))
+    return {str(tag): priority for priority, tag in reversed(list(enumerate(supported)))}
+
+
+def wheel_priority(wheel_file, supported):
+    '''
+    The priority of the best tag of wheel_file in supported, None when it does not install there.
+    '''
+    from packaging.utils import InvalidWheelFilename, parse_wheel_filename
+    try:
+        wheel_tags = parse_wheel_filename(Path(wheel_file).name)[3]
+    except InvalidWheelFilename:
+        return None
+    return min((supported[str(tag)] for tag in wheel_tags if str(tag) in supported), default=None)
+
+
+def index_wheels(wheel_sources, python_version=None, bitness=None):
+    '''
+    {(name, version): wheel file} of the wheels in wheel_sources, the sources listed first win.
+
+    With python_version and bitness only the wheels installable on that target are indexed,
+    within a source the one with the most specific tags (see target_tags).
+    '''
+    from bibiinstaller.bibiinstaller_windows import canonicalize_wheel_filename
+    supported = target_tags(python_version, bitness) if python_version and bitness else None
+    wheels = {}
+    for source in wheel_sources:
+        candidates = {}
+        for wheel_file in sorted(Path(source).glob('*.whl')):
+            priority = wheel_priority(wheel_file, supported) if supported is not None else 0
+            key = canonicalize_wheel_filename(wheel_file)
+            if priority is not None and (key not in candidates or priority < candidates[key][0]):
+                candidates[key] = priority, wheel_file
+        for key, (priority, wheel_file) in candidates.items():
+            wheels.setdefault(key, wheel_file)
+    return wheels
+
+
+def find_wheels(requirements, wheel_sources, python_version=None, bitness=None):
+    '''
+    The wheels of "name==version" requirements in wheel_sources for the target (see index_wheels).
+    '''
+    from bibiinstaller.bibiinstaller_windows import canonicalize_requirement
+    # ''' one scan of the sources, not one per requirement '''
+    wheels = index_wheels(wheel_sources, python_version, bitness)
+    wheel_files = []
+    for requirement in requirements:
+        wheel_file = wheels.get(canonicalize_requirement(requirement))
+        if wheel_file is None:
+            target = f' for CPython {python_version} {bitness}bit' if python_version and bitness else ''
+            sys.exit(f"NOT FOUND wheel of [{requirement}]{target} in {wheel_sources}")
+        wheel_files.append(wheel_file)
+    return wheel_files
+
+
+def wheel_digest(wheel_file, cache=None):
+    from bibiinstaller.bibiinstaller_fingerprint import hash_file
+    stat = os.stat(wheel_file)
+    digest = cache.get(str(wheel_file), stat) if cache is not None else None
+    if digest is None:
+        digest = hash_file(wheel_file, stat.st_size)
+        if cache is not None:
+            cache.put(str(wheel_file), stat, digest)
+    return digest
+
+
+def unpack_wheels(wheel_files, max_workers=None):
+    '''
+    The unpacked trees of wheel_files in order, the ones not cached yet unpacked on a process pool.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+    unpacked_dir = get_unpacked_dir()
+    trees, misses = [], {}
+    with DigestCache() as cache:
+        for wheel_file in wheel_files:
+            entry_dir = unpacked_dir / wheel_digest(wheel_file, cache)
+            trees.append(entry_dir / TREE_DIR_NAME)
+            if (entry_dir / UNPACKED_JSON).exists():
+                os.utime(entry_dir / UNPACKED_JSON)
+            else:
+                misses[entry_dir] = Path(wheel_file)
+    logger.info(f'unpacked wheels cache: {len(trees) - len(misses)} HIT, {len(misses)} MISS')
+    if not misses:
+        return trees
+    started = time.perf_counter()
+    max_workers = min(len(misses), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for entry_dir, wheel_file in misses.items():
+            tmp_dir = entry_dir.with_name(f'{entry_dir.name}.tmp-{os.getpid()}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            futures[entry_dir] = tmp_dir, pool.submit(unpack_wheel, wheel_file, tmp_dir / TREE_DIR_NAME)
+        for entry_dir, (tmp_dir, future) in futures.items():
+            try:
+                count = future.result()
+            except (ValueError, KeyError, zipfile.BadZipFile) as e:
+                for tmp_dir, _ in futures.values():
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                sys.exit(f"BROKEN wheel [{misses[entry_dir]}]: {e}")
+            (tmp_dir / UNPACKED_JSON).write_text(json.dumps(dict(
+                wheel=misses[entry_dir].name, files=count, created=time.time()), indent=2), encoding='utf8')
+            if not publish_entry(tmp_dir, entry_dir, UNPACKED_JSON):
+                logger.debug(f'a concurrent build unpacked [{misses[entry_dir].name}] first')
+    logger.info(f'UNPACKED {len(misses)} wheels on {max_workers} processes in {time.perf_counter() - started:.2f}s')
+    return trees
+
+
+def is_excluded(arcname, excludes):
+    parts = arcname.split('/')
+    prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    return any(fnmatch.fnmatch(prefix, pattern) for pattern in excludes for prefix in prefixes)
+
+
+def stage_unpacked(trees, pynsist_pkgs_dir, excludes=None):
+    '''
+    Stage unpacked wheel trees into pynsist_pkgs, leaving out the pkgs/ paths of excludes.
+    '''
+    from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+    from bibiinstaller.bibiinstaller_objects import ObjectStore
+    excludes = [e.replace('\\', '/').strip('/') for e in excludes or []]
+    with DigestCache() as cache, ObjectStore(cache=cache) as store:
+        for tree in trees:
+            store.stage_tree(tree, pynsist_pkgs_dir,
+                             skip=(lambda rel_path: is_excluded(f'pkgs/{rel_path}', excludes)) if excludes else None)
+    return pynsist_pkgs_dir
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Pre-warmed base venvs, cloned into the packaging venv of every build.
+
+Builds used to upgrade pip, force-reinstall setuptools and upgrade wheel in
+the packaging venv, three installer subprocesses per build. Now a base venv
+with pinned tool versions is created once per interpreter, installer backend
+and pins:
+
+    <cache>/venvs/python_3.9_64bit-pip-windows-<hash>/
+
+and cloned into packaging-venv (a parallel copy, or `conda create --clone`
+with conda_path). An existing packaging venv whose tool versions match the
+pins is kept as is, versions are read from its dist-info directories, no
+subprocess. A venv whose pyvenv.cfg home lost its python.exe (an interpreter
+removed from the cache) is created again; a reused one marks its interpreter
+as used. BIBIINSTALLER_BASE_TOOLS overrides the pins:
+
+    BIBIINSTALLER_BASE_TOOLS="pip==24.2 setuptools==72.1.0 wheel==0.44.0"
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_cache import FileLock, get_cache_home
+from bibiinstaller.bibiinstaller_logger import logger
+
+VENVS_DIR_NAME = 'venvs'
+TEMPLATE_JSON = 'template.json'
+BASE_TOOLS_ENV = 'BIBIINSTALLER_BASE_TOOLS'
+BASE_TOOLS = {'pip': '24.2', 'setuptools': '72.1.0', 'wheel': '0.44.0'}
+
+
+def get_venvs_dir():
+    return get_cache_home() / VENVS_DIR_NAME
+
+
+def get_base_tools():
+    '''
+    {name: version} of the base venv, from BIBIINSTALLER_BASE_TOOLS or BASE_TOOLS.
+    '''
+    pins = os.environ.get(BASE_TOOLS_ENV)
+    if not pins:
+        return dict(BASE_TOOLS)
+    tools = {}
+    for pin in pins.replace(',', ' ').split():
+        name, _, version = pin.partition('==')
+        if not version:
+            sys.exit(f"INVALID {BASE_TOOLS_ENV} pin [{pin}], expected name==version")
+        tools[name.strip()] = version.strip()
+    return tools
+
+
+def env_python_of(venv_dir, conda=False):
+    return Path(venv_dir) / 'python.exe' if conda else Path(venv_dir) / 'Scripts' / 'python.exe'
+
+
+def site_packages_of(env_python):
+    '''
+    Lib/site-packages of a venv (Scripts/python.exe) or conda env (python.exe).
+    '''
+    env_dir = Path(env_python).parent
+    if env_dir.name.lower() == 'scripts':
+        env_dir = env_dir.parent
+    return env_dir / 'Lib' / 'site-packages'
+
+
+def read_venv_home(venv_dir):
+    '''
+    The home of a venv from its pyvenv.cfg, None for a conda env or a venv without one.
+    '''
+    pyvenv_cfg = Path(venv_dir) / 'pyvenv.cfg'
+    if not pyvenv_cfg.is_file():
+        return None
+    for line in pyvenv_cfg.read_text(encoding='utf8', errors='replace').splitlines():
+        key, _, value = line.partition('=')
+        if key.strip().lower() == 'home' and value.strip():
+            return Path(value.strip())
+    return None
+
+
+def installed_versions(site_packages_dir, requirements):
+    '''
+    {canonical name: installed version or None} of requirements in site_packages_dir.
+    '''
+    from packaging.utils import canonicalize_name
+    names = {canonicalize_name(re.split(r'[\s<>=!~@\[;(]', r, 1)[0]): None for r in requirements}
+    if Path(site_packages_dir).is_dir():
+        for dist_info in Path(site_packages_dir).glob('*.dist-info'):
+            name, _, version = dist_info.name[:-len('.dist-info')].partition('-')
+            if canonicalize_name(name) in names:
+                names[canonicalize_name(name)] = version
+    return names
+
+
+def tools_match(env_python, tools):
+    '''
+    Whether the venv of env_python has exactly the pinned tool versions and the python.exe of its home.
+    '''
+    if not Path(env_python).exists():
+        return False
+    home = read_venv_home(site_packages_of(env_python).parent.parent)
+    if home is not None and not (home / 'python.exe').exists():
+        logger.warning(f'MISSING home [{home}] of the venv of [{env_python}]')
+        return False
+    from packaging.utils import canonicalize_name
+    installed = installed_versions(site_packages_of(env_python), list(tools))
+    return all(installed[canonicalize_name(name)] == version for name, version in tools.items())
+
+
+def template_name(python_version, bitness, tools, conda_path=None):
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_interpreters import interpreter_name
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    backend = 'conda' if conda_path else get_backend().name
+    pins = ' '.join(f'{name}=={version}' for name, version in sorted(tools.items()))
+    digest = hashlib.sha256(f'{pins} {conda_path or ""}'.encode('utf8')).hexdigest()[:12]
+    return f'{interpreter_name(python_version, bitness)}-{backend}-{get_toolchain().name}-{digest}'
+
+
+def create_base_venv(venv_dir, python_version, bitness, tools, conda_path=None):
+    '''
+    Create the venv (conda env) of venv_dir and install the pinned tools in one installer run.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_windows import create_python_env, subprocess_run
+    if conda_path:
+        subprocess_run([conda_path, "create", "-p", os.path.normpath(venv_dir),
+                        f"python={python_version}", "-y"])
+    else:
+        python_exe = create_python_env(python_version, bitness)
+        logger.info(f'USE Python: {python_exe}')
+        subprocess_run(get_backend().venv_command(python_exe, str(venv_dir)))
+    env_python = env_python_of(venv_dir, conda=bool(conda_path))
+    pins = [f'{name}=={version}' for name, version in tools.items()]
+    subprocess_run(get_backend().pip_command(env_python, "install", *pins, "--no-warn-script-location"))
+    if not tools_match(env_python, tools):
+        sys.exit(f"FAILED to pin {pins} in the base venv [{venv_dir}]")
+    return env_python
+
+
+def touch_home(venv_dir):
+    '''
+    Mark the cached interpreter of a reused venv as used, see prune_interpreters.
+    '''
+    from bibiinstaller.bibiinstaller_interpreters import touch_interpreter
+    home = read_venv_home(venv_dir)
+    if home is not None:
+        touch_interpreter(home)
+
+
+def get_base_template(python_version, bitness=64, conda_path=None):
+    '''
+    The base venv of python_version, bitness and the pinned tools, created on a miss.
+    '''
+    tools = get_base_tools()
+    template_dir = get_venvs_dir() / template_name(python_version, bitness, tools, conda_path)
+    template_json = template_dir / TEMPLATE_JSON
+    with FileLock(template_dir.with_name(f'{template_dir.name}.lock')):
+        if template_json.exists() and tools_match(env_python_of(template_dir, bool(conda_path)), tools):
+            logger.info(f'base venv HIT: [{template_dir}]')
+            touch_home(template_dir)
+        else:
+            logger.info(f'base venv MISS: [{template_dir}] {tools}')
+            started = time.perf_counter()
+            shutil.rmtree(template_dir, ignore_errors=True)
+            create_base_venv(template_dir, python_version, bitness, tools, conda_path)
+            template_json.write_text(json.dumps(dict(
+                python_version=str(python_version), bitness=bitness, tools=tools,
+                conda_path=str(conda_path or ''), created=time.time()), indent=2), encoding='utf8')
+            logger.info(f'CREATED base venv [{template_dir}] in {time.perf_counter() - started:.1f}s')
+        os.utime(template_json)
+    return template_dir
+
+
+def clone_base_venv(venv_dir, python_version, bitness=64, conda_path=None):
+    '''
+    The packaging venv of venv_dir: kept when its tools match the pins, else cloned from the base venv.
+
+    Returns its python.exe.
+    '''
+    conda = bool(conda_path)
+    env_python = env_python_of(venv_dir, conda)
+    tools = get_base_tools()
+    if tools_match(env_python, tools):
+        logger.info(f'packaging venv REUSED: [{venv_dir}] {tools}')
+        touch_home(venv_dir)
+        return env_python
+    template_dir = get_base_template(python_version, bitness, conda_path)
+    started = time.perf_counter()
+    shutil.rmtree(venv_dir, ignore_errors=True)
+    with FileLock(template_dir.with_name(f'{template_dir.name}.lock')):
+        if conda:
+            from bibiinstaller.bibiinstaller_windows import subprocess_run
+            subprocess_run([conda_path, "create", "--clone", os.path.normpath(template_dir),
+                            "-p", os.path.normpath(venv_dir), "-y"])
+        else:
+            from bibiinstaller.bibiinstaller_copy import copy_tree
+            copy_tree(template_dir, venv_dir)
+        Path(venv_dir, TEMPLATE_JSON).unlink(missing_ok=True)
+    logger.info(f'CLONED base venv [{template_dir}] -> [{venv_dir}] in {time.perf_counter() - started:.2f}s')
+    return env_python
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Watch mode: rebuild only the application package on every change.
+
+    bibiinstaller --watch configs.py
+
+The first build runs the whole pipeline and keeps its work dir. Afterwards
+project_root is polled through the fingerprint cache; changed package files
+are synced into the packaging venv, pynsist_pkgs and pynsist's build dir,
+and only makensis runs again. pynsist.cfg is rendered again only when the
+project metadata (name, version, author) changed.
+
+With --output dir the changed files are synced into dist/<name>/pkgs and
+nothing is compiled; with --output zip they are synced into a portable dir
+in the work dir, which is zipped again.
+"""
+import os
+import shutil
+import time
+from pathlib import Path
+
+from bibiinstaller.bibiinstaller_backend import get_backend
+from bibiinstaller.bibiinstaller_copy import copy, copy_file
+from bibiinstaller.bibiinstaller_embed import pynsist_env
+from bibiinstaller.bibiinstaller_fingerprint import DEFAULT_EXCLUDES, DigestCache, fingerprint_tree
+from bibiinstaller.bibiinstaller_portable import assemble_portable, tree_entries, write_zip
+from bibiinstaller.bibiinstaller_runtime import drop_runtime_distributions
+from bibiinstaller.bibiinstaller_windows import (
+    METADATA_FILES, compile_nsis, create_pynsist_cfg, read_project_info, run_installer, subprocess_run
+)
+from bibiinstaller.bibiinstaller_logger import logger
+
+PORTABLE_DIR_NAME = 'portable'
+
+
+def read_top_levels(package_dist_info):
+    '''
+    Top level names (packages and modules) installed by the project, from its RECORD.
+    '''
+    record = Path(package_dist_info) / 'RECORD'
+    top_levels = set()
+    if record.exists():
+        for line in record.read_text(encoding='utf8').splitlines():
+            top_level = line.split(',', 1)[0].split('/', 1)[0]
+            if top_level and not top_level.endswith(('.dist-info', '.data')) and top_level != '..':
+                top_levels.add(top_level)
+    logger.debug(f'top_levels = {top_levels}')
+    return top_levels
+
+
+def installed_rel_path(rel_path, top_levels):
+    for source_root in ['src/', '']:
+        if not rel_path.startswith(source_root):
+            continue
+        installed = rel_path[len(source_root):]
+        if installed.split('/', 1)[0] in top_levels:
+            return installed
+    return None
+
+
+def sync_project_files(project_root, changed, removed, top_levels, target_dirs):
+    '''
+    Copy changed and delete removed package files in every target dir.
+
+    Returns the number of synced package files.
+    '''
+    synced = 0
+    for rel_path in sorted(changed):
+        installed = installed_rel_path(rel_path, top_levels)
+        if installed is None:
+            continue
+        for target_dir in target_dirs:
+            target_file = Path(target_dir) / installed
+            target_file.parent.mkdir(parents=True, exist_ok=True)
+            if target_file.exists():
+                # ''' may be a hardlink into the object store, never write through it '''
+                target_file.unlink()
+            copy_file(Path(project_root) / rel_path, target_file)
+        logger.info(f'SYNC [{installed}]')
+        synced += 1
+    for rel_path in sorted(removed):
+        installed = installed_rel_path(rel_path, top_levels)
+        if installed is None:
+            continue
+        for target_dir in target_dirs:
+            target_file = Path(target_dir) / installed
+            if target_file.exists():
+                target_file.unlink()
+        logger.info(f'REMOVE [{installed}]')
+        synced += 1
+    return synced
+
+
+def compile_installer(state):
+    '''
+    Run makensis only, on the installer.nsi pynsist left in build/nsis.
+    '''
+    nsis_build_dir = Path(state['work_dir']) / 'build' / 'nsis'
+    runtime = state.get('runtime')
+    if compile_nsis(nsis_build_dir, state['python_version_embed'], exit=False,
+                    defines=runtime.defines if runtime else None) != 0:
+        return None
+    return nsis_build_dir / state['installer_exe']
+
+
+def rebuild_with_pynsist(state):
+    '''
+    Reinstall the project, render pynsist.cfg again and run the whole nsist.
+    '''
+    env_python = state['env_python']
+    subprocess_run(get_backend().pip_command(env_python, "install", "--no-deps", "--force-reinstall",
+                                             state['project_root'], "--no-warn-script-location"), exit=False)
+    package_dist_info = (Path(state['package_dist_info']).parent /
+                         f"{state['package_name']}-{state['package_version']}.dist-info").resolve()
+    state['package_dist_info'] = package_dist_info
+    # ''' staged again from scratch, files of the previous metadata (e.g. the old dist-info) must not stay '''
+    shutil.rmtree(state['pynsist_pkgs_dir'], ignore_errors=True)
+    Path(state['pynsist_pkgs_dir']).mkdir(parents=True)
+    pynsist_cfg_kwargs = state['pynsist_cfg_kwargs']
+    state['installer_exe'] = create_pynsist_cfg(
+        state['work_dir'], state['pynsist_pkgs_dir'], env_python, state['python_version_embed'], state['bitness'],
+        state['package_name'], state['package_version'], state['package_author'], package_dist_info,
+        **dict(pynsist_cfg_kwargs, files=list(pynsist_cfg_kwargs['files'] or [])))
+    if state['output'] != 'installer':
+        shutil.rmtree(Path(state['work_dir']) / PORTABLE_DIR_NAME, ignore_errors=True)
+        portable = assemble_portable(
+            state['pynsist_cfg'], state['embed_archive'], Path(package_dist_info).parent, state['destination_dir'],
+            Path(state['installer_exe']).stem, output=state['output'], compression=state['compression'])
+        state['installer_exe'] = portable.name
+        return portable
+    if subprocess_run([env_python, "-m", "nsist", "--no-makensis", state['pynsist_cfg']],
+                      exit=False, env=pynsist_env()) != 0:
+        return None
+    if state.get('runtime') is not None:
+        drop_runtime_distributions(Path(state['work_dir']) / 'build' / 'nsis', state['runtime'])
+    return compile_installer(state)
+
+
+def portable_dir(state):
+    '''
+    The portable dir changed files are synced into: the dist/ dir of dir output, a work dir copy for zip output.
+    '''
+    if state['output'] == 'dir':
+        return Path(state['destination_dir']) / state['installer_exe']
+    work_portable_dir = Path(state['work_dir']) / PORTABLE_DIR_NAME
+    if not work_portable_dir.is_dir():
+        assemble_portable(state['pynsist_cfg'], state['embed_archive'], Path(state['package_dist_info']).parent,
+                          state['work_dir'], PORTABLE_DIR_NAME, output='dir')
+    return work_portable_dir
+
+
+def write_portable(state):
+    '''
+    The portable output after a sync: the dir itself, or its zip written again.
+    '''
+    if state['output'] == 'dir':
+        return portable_dir(state)
+    zip_file = Path(state['destination_dir']) / state['installer_exe']
+    staging = zip_file.with_name(f'.{zip_file.name}.tmp-{os.getpid()}')
+    write_zip(tree_entries(portable_dir(state), ''), staging, state['compression'])
+    os.replace(staging, zip_file)
+    return zip_file
+
+
+def rebuild(state, changed, removed):
+    started = time.perf_counter()
+    project_root = state['project_root']
+    package_info = read_project_info(project_root, state['package'])
+    metadata_changed = (package_info != (state['package_name'], state['package_version'], state['package_author'])
+                        or any(f in METADATA_FILES for f in set(changed) | set(removed)))
+    if metadata_changed:
+        logger.info(f"Metadata changed {package_info}, rendering pynsist.cfg again.")
+        state['package_name'], state['package_version'], state['package_author'] = package_info
+        installer_file = rebuild_with_pynsist(state)
+    else:
+        work_dir = Path(state['work_dir'])
+        site_packages_dir = Path(state['package_dist_info']).parent
+        if state['output'] == 'installer':
+            target_dirs = [site_packages_dir, work_dir / 'build' / 'nsis' / 'pkgs']
+        else:
+            target_dirs = [site_packages_dir, portable_dir(state) / 'pkgs']
+        if any(Path(state['pynsist_pkgs_dir']).iterdir()):
+            target_dirs.append(state['pynsist_pkgs_dir'])
+        top_levels = read_top_levels(state['package_dist_info'])
+        if sync_project_files(project_root, changed, removed, top_levels, target_dirs) == 0:
+            logger.info("No package files changed, nothing to rebuild.")
+            return None
+        installer_file = compile_installer(state) if state['output'] == 'installer' else write_portable(state)
+
+    if installer_file is None or not Path(installer_file).exists():
+        logger.warning("Rebuild FAILED, waiting for the next change.")
+        return None
+    if state['output'] == 'installer':
+        os.makedirs(state['destination_dir'], exist_ok=True)
+        copy(installer_file, state['destination_dir'])
+    logger.info(f"Installer rebuilt in {time.perf_counter() - started:.1f}s: "
+                f"[{Path(state['destination_dir']) / Path(installer_file).name}]")
+    return installer_file
+
+
+def watch_installer(interval=1.0, **installer_kwargs):
+    '''
+    Build once with run_installer(**installer_kwargs), then rebuild incrementally on changes.
+    '''
+    # ''' the work dir stays locked for the whole session, other builds of the same key wait '''
+    state = run_installer(**dict(installer_kwargs, force=True, keep_lock=True))
+    if state is None:
+        logger.warning("Initial build FAILED, watch mode stopped.")
+        return
+    project_root = state['project_root']
+    excludes = DEFAULT_EXCLUDES + list(installer_kwargs.get('excludes') or [])
+    try:
+        with DigestCache() as cache:
+            files = fingerprint_tree(project_root, excludes=excludes, cache=cache).files
+            cache.save()
+            logger.info(f"Watching [{project_root}], press Ctrl+C to stop.")
+            while True:
+                time.sleep(interval)
+                current_files = fingerprint_tree(project_root, excludes=excludes, cache=cache).files
+                changed = [f for f, digest in current_files.items() if files.get(f) != digest]
+                removed = [f for f in files if f not in current_files]
+                if not changed and not removed:
+                    continue
+                logger.info(f"Changed: {changed}, removed: {removed}")
+                files = current_files
+                rebuild(state, changed, removed)
+                cache.save()
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped.")
+    finally:
+        state['work_dir_lock'].release()
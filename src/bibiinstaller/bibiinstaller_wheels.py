@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2024 Chunqi SHI.
+# Licensed under the terms of the GPL-3.0 License
+#
+"""
+Cache of the project wheel.
+
+`pip install <project_root>` rebuilds the project through its build backend
+on every build, minutes for projects with compiled extensions. The project is
+now built once with `pip wheel --no-deps` into
+
+    <cache>/wheels/<key>/<name>-<version>-<tags>.whl
+
+keyed by the source fingerprint of the project, its [build-system] table, the
+pip of the packaging venv, the interpreter and the installer backend. pip builds
+in an isolated environment resolved from the [build-system] specifiers, what is
+installed in the packaging venv besides pip does not take part. The packaging
+venv installs the cached wheel, and with is_wheel_first it is the local wheel of
+pynsist unless LOCAL_WHEEL_PATH is set.
+
+Dependencies without a binary wheel get the same cache: sdist-only "name==version"
+requirements are built from their sdist (pip download --no-binary), keyed by its
+sha256, and "name @ url" requirements from the url, keyed by the tree of a local
+path or the url of a VCS commit. The key also holds the build environment (the
+venv's Python and its pip, setuptools and wheel). Misses are built by parallel
+`pip wheel --no-deps` processes (BIBIINSTALLER_WHEEL_JOBS at most) and every wheel
+is copied into the wheelhouse of pip_download_only_binaries, so they take the
+wheel path of pynsist like the downloaded ones. A VCS url not pinned to a commit
+is built every time.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from bibiinstaller.bibiinstaller_cache import build_fingerprint, get_cache_home
+from bibiinstaller.bibiinstaller_logger import logger
+from bibiinstaller.bibiinstaller_venvs import installed_versions, site_packages_of
+
+WHEELS_DIR_NAME = 'wheels'
+WHEEL_JSON = 'wheel.json'
+# ''' pip's default when pyproject.toml has no [build-system] '''
+DEFAULT_BUILD_SYSTEM = {'requires': ['setuptools>=40.8.0', 'wheel'],
+                        'build-backend': 'setuptools.build_meta:__legacy__'}
+# ''' written into the source tree by setuptools builds, not part of the sources '''
+BUILD_EXCLUDES = ['*.egg-info/', '.eggs/']
+# ''' the dependency builds, a wheel is rebuilt when one of them changes '''
+BUILD_TOOLS = ['pip', 'setuptools', 'wheel']
+SDISTS_DIR_NAME = 'pip_download_sdists'
+WHEEL_BUILDS_DIR_NAME = 'pip_wheel_builds'
+WHEEL_JOBS_ENV = 'BIBIINSTALLER_WHEEL_JOBS'
+VCS_SCHEMES = ['git+', 'hg+', 'svn+', 'bzr+']
+# ''' a full or abbreviated commit id at the end of a VCS url '''
+VCS_COMMIT = re.compile(r'@[0-9a-fA-F]{7,40}(#.*)?$')
+
+
+def get_wheels_dir():
+    return get_cache_home() / WHEELS_DIR_NAME
+
+
+def read_build_system(project_root):
+    '''
+    The [build-system] table of pyproject.toml under project_root, or pip's default.
+    '''
+    pyproject_toml = Path(project_root) / 'pyproject.toml'
+    if pyproject_toml.exists():
+        from bibiinstaller.bibiinstaller_windows import read_pyproject_toml_info
+        build_system = read_pyproject_toml_info(pyproject_toml).get('build-system')
+        if build_system:
+            return dict(requires=list(build_system.get('requires', [])),
+                        **{'build-backend': build_system.get('build-backend', '')})
+    return DEFAULT_BUILD_SYSTEM
+
+
+def compute_project_wheel_key(env_python, project_root, python_version, bitness):
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    # ''' pip wheel builds with build isolation: the [build-system] specifiers and pip decide the build '''
+    return build_fingerprint(
+        parameters=dict(
+            toolchain=get_toolchain().name, installer=get_backend().name,
+            python_version=python_version, bitness=bitness, build_system=read_build_system(project_root),
+            pip_version=installed_versions(site_packages_of(env_python), ['pip'])['pip']),
+        paths=dict(project_root=project_root),
+        excludes=BUILD_EXCLUDES,
+        name='project wheel'
+    )
+
+
+def cached_wheel(wheel_dir):
+    '''
+    The wheel stored in wheel_dir, None on a miss.
+    '''
+    wheel_json = Path(wheel_dir) / WHEEL_JSON
+    if wheel_json.exists():
+        wheel_file = Path(wheel_dir) / json.loads(wheel_json.read_text(encoding='utf8'))['wheel']
+        if wheel_file.exists():
+            os.utime(wheel_json)
+            return wheel_file
+    return None
+
+
+def build_wheel(env_python, wheel_dir, source, exit=True, **info):
+    '''
+    `pip wheel --no-deps source` with the packaging venv into wheel_dir, None when it fails without exit.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_windows import subprocess_run
+    wheel_dir = Path(wheel_dir)
+    shutil.rmtree(wheel_dir, ignore_errors=True)
+    build_dir = wheel_dir.with_name(f'{wheel_dir.name}.tmp-{os.getpid()}-{threading.get_ident()}')
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+    started = time.perf_counter()
+    returncode = subprocess_run(get_backend().pip_command(env_python, 'wheel', '--no-deps', '--wheel-dir',
+                                                          str(build_dir), str(source)), exit=exit)
+    wheel_files = list(build_dir.glob('*.whl'))
+    if returncode != 0 or len(wheel_files) != 1:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        if exit:
+            raise FileNotFoundError(f'NOT FOUND wheel of [{source}] in [{build_dir}]: {wheel_files}')
+        logger.warning(f'FAILED wheel build of [{source}]')
+        return None
+    (build_dir / WHEEL_JSON).write_text(json.dumps(dict(
+        info, key=wheel_dir.name, wheel=wheel_files[0].name, created=time.time()), indent=2), encoding='utf8')
+    try:
+        os.replace(build_dir, wheel_dir)
+    except OSError:
+        # ''' a concurrent build stored the same wheel first '''
+        shutil.rmtree(build_dir, ignore_errors=True)
+    wheel_file = wheel_dir / wheel_files[0].name
+    logger.info(f'BUILT wheel [{wheel_file}] in {time.perf_counter() - started:.2f}s')
+    return wheel_file
+
+
+def get_project_wheel(env_python, project_root, python_version, bitness=64):
+    '''
+    The cached wheel of project_root, built with the packaging venv on a miss.
+    '''
+    key = compute_project_wheel_key(env_python, project_root, python_version, bitness)
+    wheel_dir = get_wheels_dir() / key
+    wheel_file = cached_wheel(wheel_dir)
+    if wheel_file is not None:
+        logger.info(f'project wheel cache HIT: [{wheel_file}]')
+        return wheel_file
+    logger.info(f'project wheel cache MISS: [{key}]')
+    return build_wheel(env_python, wheel_dir, project_root, project_root=str(project_root))
+
+
+def get_build_environment(env_python):
+    '''
+    The interpreter and build tools of the packaging venv, part of the dependency wheel keys.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    pyvenv_cfg = Path(env_python).parent.parent / 'pyvenv.cfg'
+    pyvenv = {}
+    if pyvenv_cfg.exists():
+        for line in pyvenv_cfg.read_text(encoding='utf8').splitlines():
+            key, _, value = line.partition('=')
+            pyvenv[key.strip()] = value.strip()
+    return dict(toolchain=get_toolchain().name, installer=get_backend().name,
+                python=pyvenv.get('version') or pyvenv.get('version_info') or pyvenv.get('home'),
+                build_tools=installed_versions(site_packages_of(env_python), BUILD_TOOLS))
+
+
+def requirement_url(requirement):
+    '''
+    "name @ url" -> (name, url), a file: url as a local path.
+    '''
+    name, _, url = requirement.partition('@')
+    url = url.split(';', 1)[0].strip()
+    if url.startswith('file:'):
+        path = unquote(urlparse(url).path)
+        # ''' file:///D:/bld/... '''
+        if re.match(r'^/[A-Za-z]:', path):
+            path = path[1:]
+        return name.strip(), Path(path)
+    return name.strip(), url
+
+
+def find_sdist(sdist_dir, requirement):
+    from packaging.utils import parse_sdist_filename
+    from bibiinstaller.bibiinstaller_windows import canonicalize_package_name, canonicalize_requirement
+    name_version = canonicalize_requirement(requirement)
+    for sdist_file in Path(sdist_dir).iterdir() if Path(sdist_dir).is_dir() else []:
+        try:
+            name, version = parse_sdist_filename(sdist_file.name)
+        except ValueError:
+            continue
+        if (canonicalize_package_name(str(name)), str(version)) == name_version:
+            return sdist_file
+    return None
+
+
+def get_dependency_wheels(env_python, requirements, wheelhouse_dir, max_workers=None):
+    '''
+    {requirement: wheel in wheelhouse_dir} for "name==version" requirements without a binary wheel
+    and "name @ url" requirements, built in parallel on cache misses.
+
+    Requirements whose source cannot be fetched or built are left out.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_cache import build_fingerprint
+    from bibiinstaller.bibiinstaller_copy import copy
+    from bibiinstaller.bibiinstaller_windows import subprocess_run
+    if not requirements:
+        return {}
+    wheelhouse_dir = Path(wheelhouse_dir)
+    wheelhouse_dir.mkdir(parents=True, exist_ok=True)
+    sdist_dir = wheelhouse_dir.parent / SDISTS_DIR_NAME
+    max_workers = max_workers or int(os.environ.get(WHEEL_JOBS_ENV) or 0) or os.cpu_count() or 1
+    build_environment = get_build_environment(env_python)
+
+    pinned = [r for r in requirements if '@' not in r and not find_sdist(sdist_dir, r)]
+    if pinned:
+        logger.info(f'Downloading {len(pinned)} sdists into [{sdist_dir}]')
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(lambda r: subprocess_run(get_backend().pip_command(
+                env_python, 'download', '--no-deps', '--no-binary', ':all:', '--dest', str(sdist_dir), r),
+                exit=False), pinned))
+
+    # ''' (requirement, source, wheel dir) of every build, keyed in this thread: the digest cache is not shared '''
+    builds = []
+    for requirement in requirements:
+        if '@' not in requirement:
+            source = find_sdist(sdist_dir, requirement)
+            if source is None:
+                logger.warning(f'NOT FOUND sdist of [{requirement}]')
+                continue
+            paths, url = dict(source=source), None
+        else:
+            name, source = requirement_url(requirement)
+            if isinstance(source, Path):
+                if not source.exists():
+                    logger.warning(f'NOT EXIST source [{source}] of [{requirement}]')
+                    continue
+                paths, url = dict(source=source), None
+                source = source.resolve()
+            elif any(source.startswith(s) for s in VCS_SCHEMES) and not VCS_COMMIT.search(source):
+                logger.warning(f'NOT PINNED to a commit [{source}], built every time')
+                builds.append((requirement, requirement, wheelhouse_dir.parent / WHEEL_BUILDS_DIR_NAME / name))
+                continue
+            else:
+                paths, url, source = {}, source, requirement
+        key = build_fingerprint(parameters=dict(build_environment, url=url), paths=paths,
+                                excludes=BUILD_EXCLUDES, name=f'wheel of {requirement}')
+        builds.append((requirement, source, get_wheels_dir() / key))
+
+    wheel_files = {}
+    misses = []
+    for requirement, source, wheel_dir in builds:
+        wheel_file = cached_wheel(wheel_dir) if wheel_dir.parent == get_wheels_dir() else None
+        if wheel_file is not None:
+            wheel_files[requirement] = wheel_file
+        else:
+            misses.append((requirement, source, wheel_dir))
+    logger.info(f'dependency wheel cache: {len(wheel_files)} HIT, {len(misses)} MISS')
+    if misses:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(len(misses), max_workers)) as pool:
+            futures = {r: pool.submit(build_wheel, env_python, d, s, exit=False, requirement=r)
+                       for r, s, d in misses}
+        for requirement, future in futures.items():
+            if future.result() is not None:
+                wheel_files[requirement] = future.result()
+        logger.info(f'BUILT {len(misses)} dependency wheels on {min(len(misses), max_workers)} workers in '
+                    f'{time.perf_counter() - started:.2f}s')
+    return {r: copy(w, wheelhouse_dir) for r, w in wheel_files.items()}
@@ -34,13 +34,25 @@ from dataclasses import dataclass, fields, field
 from pathlib import Path
 from pprint import pformat
 
-import requests
-from bibiflags import BibiFlags
-from loguru import logger
-from packaging.utils import parse_wheel_filename, canonicalize_name, canonicalize_version
+from bibiinstaller.bibiinstaller_logger import logger
+
+# '''
+# requests, bibiflags, packaging, PIL and the cache modules are imported where they
+# are used, so that --help, --validate and --dry_run start fast.
+# '''
 
 PYPI_SERVER_LOCAL_CACHE = 'pypi_server.local_cache.shelve'
 
+# ''' bibiinstaller <command> ... '''
+METADATA_FILES = ['setup.py', 'setup.cfg', 'pyproject.toml']
+
+COMMANDS = {
+    'fingerprint': 'bibiinstaller.bibiinstaller_fingerprint:main',
+    'cache': 'bibiinstaller.bibiinstaller_cache:main',
+    'index-proxy': 'bibiinstaller.bibiinstaller_index:main',
+    'delta': 'bibiinstaller.bibiinstaller_delta:main',
+}
+
 PYNSIST_CFG_TEMPLATE = """
 #
 # see: https://pynsist.readthedocs.io/en/latest/cfgfile.html
@@ -100,6 +112,7 @@ class BibiinstallConfigs:
     EDITABLE_PACKAGES: list = field(default_factory=list)
     SKIP_PYPI_PACKAGES: list = field(default_factory=list)
     UNWANTED_PACKAGES: list = field(default_factory=list)
+    RUNTIME_PACKAGES: list = field(default_factory=list)
 
     # '''
     # FILES
@@ -139,7 +152,7 @@ def from_dict_to_dataclass(cls, data: dict):
     )
 
 
-def subprocess_run(args, exit=True):
+def subprocess_run(args, exit=True, env=None):
     """
     Wrapper-function around subprocess.run.
 
@@ -147,7 +160,7 @@ def subprocess_run(args, exit=True):
     prints out a message and exits with the same code.
     """
     logger.info(f'$ {" ".join([str(x) for x in args])}')
-    cp = subprocess.run(args, capture_output=True, text=True)
+    cp = subprocess.run(args, capture_output=True, text=True, env=env)
     logger.info(cp.stdout)
     try:
         cp.check_returncode()
@@ -159,53 +172,31 @@ def subprocess_run(args, exit=True):
     return cp.returncode
 
 
-def create_python_env(target_directory, python_version: str, environment_name: str = None):
-    micromamba_path = ASSETS_HOME / 'Windows' / 'micromamba'
-    logger.debug(f"micromamba_path = [{micromamba_path}]")
-    micromamba_exes = list(micromamba_path.glob('*.exe'))
-    if len(micromamba_exes) < 1:
-        logger.warning(f'NO micromamba.exe under [{micromamba_path}]')
-    micromamba_exe = sorted(micromamba_exes, key=lambda file: Path(file).lstat().st_mtime, reverse=True)[0].resolve()
-    logger.debug(micromamba_exe)
-    python = '.'.join(python_version.split('.')[:2])
-
-    logger.info(f'micromamba [{micromamba_exe}]')
-    conda_path = Path(target_directory) / f'conda_python_{python}'
-    if environment_name is None:
-        environment_name = f'python_{python}'
-
-    python_exe = conda_path / 'envs' / environment_name / 'python.exe'
-    if not python_exe.exists():
-        subprocess_run([
-            micromamba_exe, 'create', '--yes', '-n', environment_name, f'python={python}',
-            '-c', 'conda-forge', '--root-prefix', conda_path
-        ])
-    return python_exe.resolve()
+def create_python_env(python_version: str, bitness=64):
+    """
+    Python of the packaging venv, from the user-level interpreter cache.
+    """
+    from bibiinstaller.bibiinstaller_interpreters import provision_python
+    return provision_python(python_version, bitness)
 
 
 def create_packaging_venv(
         target_directory, python_version, venv_name,
-        conda_path=None):
+        conda_path=None, bitness=64):
     """
     Create a Python virtual environment in the target_directory.
 
+    The venv is cloned from the pre-warmed base venv of python_version, an existing one
+    with the pinned pip, setuptools and wheel is kept.
     Returns the path to the newly created environment's Python executable.
     """
+    from bibiinstaller.bibiinstaller_venvs import clone_base_venv
     fullpath = os.path.join(target_directory, venv_name)
     if conda_path and Path(conda_path).exists():
         logger.info(f'USE Conda: {conda_path}')
-        command = [conda_path, "create",
-                   "-p", os.path.normpath(fullpath),
-                   "python={}".format(python_version), "-y"]
-        env_path = os.path.join(fullpath, "python.exe")
     else:
-        python_exe = create_python_env(target_directory, python_version)
-        logger.debug(f'BibiInstaller Python: {sys.executable}')
-        logger.info(f'USE Python: {python_exe}')
-        command = [python_exe, "-m", "venv", fullpath]
-        env_path = os.path.join(fullpath, "Scripts", "python.exe")
-    logger.info(command)
-    subprocess_run(command)
+        conda_path = None
+    env_path = str(clone_base_venv(fullpath, python_version, bitness, conda_path=conda_path))
     logger.info(f'VENV Python: {env_path}')
     return env_path
 
@@ -214,8 +205,9 @@ def pip_freeze(python, encoding="latin1"):
     """
     Return the "pip freeze --all" output as a list of strings.
     """
+    from bibiinstaller.bibiinstaller_backend import get_backend
     logger.info("Getting frozen requirements.")
-    output = subprocess.check_output([python, "-m", "pip", "freeze", "--all"])
+    output = subprocess.check_output(get_backend().freeze_command(python))
     text = output.decode(encoding)
     return text.splitlines()
 
@@ -224,8 +216,9 @@ def pip_list(python, encoding="latin1"):
     """
     Return the "pip list --format=freeze" output as a list of strings.
     """
+    from bibiinstaller.bibiinstaller_backend import get_backend
     logger.info("Getting all requirements.")
-    output = subprocess.check_output([python, "-m", "pip", "list", "--format=freeze"])
+    output = subprocess.check_output(get_backend().list_command(python))
     text = output.decode(encoding)
     return text.splitlines()
 
@@ -272,6 +265,7 @@ def separate_package_name(requirement):
 
 
 def canonicalize_package_name(package_name):
+    from packaging.utils import canonicalize_name
     name, _, version = package_name.partition("==")
     # Needed to detect the package being installed from source
     # <package> @ <path to package>==<version>
@@ -281,6 +275,7 @@ def canonicalize_package_name(package_name):
 
 
 def canonicalize_requirement(requirement):
+    from packaging.utils import canonicalize_version
     name, _, version = requirement.partition("==")
     name = canonicalize_package_name(name)
     version = canonicalize_version(version, strip_trailing_zero=False)
@@ -288,6 +283,7 @@ def canonicalize_requirement(requirement):
 
 
 def canonicalize_wheel_filename(whl_file):
+    from packaging.utils import parse_wheel_filename, canonicalize_version
     name, version, build, tags = parse_wheel_filename(Path(whl_file).name)
     # logger.info(f"{name} {version} {build} {tags} [{whl_file}]")
     name = canonicalize_package_name(name)
@@ -335,6 +331,7 @@ def pip_wheels_in(work_dir, python, requirements_wheel_pypi):
     https://packaging.pypa.io/en/stable/utils.html
     https://pip.pypa.io/en/stable/cli/pip_download/
     '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
 
     pip_download_dir = (Path(work_dir) / f"pip_download_only_binaries").resolve()
     logger.info(f'make pip download dir: [{pip_download_dir}]')
@@ -342,8 +339,14 @@ def pip_wheels_in(work_dir, python, requirements_wheel_pypi):
 
     logger.debug(f'requirements_wheel_pypi = {requirements_wheel_pypi}')
     for requirement in requirements_wheel_pypi:
-        subprocess_run([python, "-m", "pip", "download", "--only-binary", ":all:", "--dest",
-                        pip_download_dir, requirement], exit=False)
+        subprocess_run(get_backend().pip_command(python, "download", "--only-binary", ":all:", "--dest",
+                                                 pip_download_dir, requirement), exit=False)
+
+    # ''' sdist-only requirements get a cached wheel built from their sdist '''
+    from bibiinstaller.bibiinstaller_wheels import get_dependency_wheels
+    downloaded = {canonicalize_wheel_filename(w) for w in pip_download_dir.glob("*.whl")}
+    get_dependency_wheels(python, [r for r in requirements_wheel_pypi
+                                   if canonicalize_requirement(r) not in downloaded], pip_download_dir)
 
     whl_files = pip_download_dir.glob("*.whl")
 
@@ -419,7 +422,12 @@ def pip_wheels_in(work_dir, python, requirements_wheel_pypi):
 
 
 def update_application_nsi(template_nsi_file, application_nsi_file,
-                           app_name: str, window_title: str = None, app_name_lower: str = None):
+                           app_name: str, window_title: str = None, app_name_lower: str = None,
+                           compression: str = None, compression_dict_size: int = None):
+    from bibiinstaller.bibiinstaller_nsis import (
+        COMPRESSION_PLACEHOLDER, compression_directives, render_compression
+    )
+
     def substitute(template_path: str, key_val_maps: dict):
         from string import Template
         class CustomTemplate(Template):
@@ -432,21 +440,27 @@ def update_application_nsi(template_nsi_file, application_nsi_file,
         window_title = app_name
     if app_name_lower is None:
         app_name_lower = app_name.lower()
-    key_val_maps = dict(APP_NAME=app_name, WINDOW_TITLE=window_title, APP_NAME_LOWER=app_name_lower)
+    directives = compression_directives(compression, compression_dict_size)
+    key_val_maps = dict(APP_NAME=app_name, WINDOW_TITLE=window_title, APP_NAME_LOWER=app_name_lower,
+                        COMPRESSION=directives)
     installer = substitute(template_nsi_file, key_val_maps)
+    if not COMPRESSION_PLACEHOLDER.search(Path(template_nsi_file).read_text(encoding='UTF8')):
+        installer = render_compression(installer, directives)
     Path(application_nsi_file).write_text(installer, encoding='utf8', newline='\n')
     return Path(application_nsi_file).resolve()
 
 
-def separate_wheels_and_packages(python, unwanted_packages):
+def separate_wheels_and_packages(python, unwanted_packages, requirements_freeze=None):
     '''
     numpy @ file:///D:/bld/numpy_1610324703282/work
     package-two @ git+https://github.com/owner/repo@41b95ec
 
     requirements_list = pip_list(python)
 
+    requirements_freeze: instead of pip freeze of python, e.g. the lock of a platform resolution.
     '''
-    requirements_freeze = pip_freeze(python)
+    if requirements_freeze is None:
+        requirements_freeze = pip_freeze(python)
     unwanted_packages_names = [canonicalize_package_name(p) for p in unwanted_packages]
     wanted_requirements_freeze = [r for r in requirements_freeze if
                                   canonicalize_package_name(r) not in unwanted_packages_names]
@@ -490,48 +504,84 @@ def create_pynsist_cfg(
         suffix=None,
         nsi_template_path=None,
         local_wheel_path=None,
-        is_wheel_first=False
+        is_wheel_first=False,
+        dedup_binaries='report',
+        staging=None,
+        embed_archive=None
 ):
     '''
 
     # fill extra_wheel_sources, local_wheels
     # SEE: https://pynsist.readthedocs.io/en/latest/
 
+    staging: "site-packages", "wheel" or "hybrid" (see bibiinstaller_staging), default from is_wheel_first,
+    or "platform", the wheels of the platform lock (see bibiinstaller_resolve).
+    embed_archive: the embeddable Python, whose DLLs dedup_binaries never replaces.
     '''
     if files is None:
         files = []
-    wanted_rqmts_freeze, rqmts_wheel, rqmts_editable = separate_wheels_and_packages(python, unwanted_packages)
+    requirements_lock = None
+    if staging == 'platform':
+        from bibiinstaller.bibiinstaller_resolve import LOCK_NAME, read_lock
+        requirements_lock = read_lock(Path(work_dir) / LOCK_NAME)
+    wanted_rqmts_freeze, rqmts_wheel, rqmts_editable = separate_wheels_and_packages(python, unwanted_packages,
+                                                                                    requirements_lock)
     skip_pypi_wheels = [package_name] + skip_pypi_packages
 
+    from bibiinstaller.bibiinstaller_objects import stage_paths
     if asset_path is not None:
-        logger.debug(f'COPY {asset_path} into {pynsist_pkgs_dir}')
+        logger.debug(f'STAGE {asset_path} into {pynsist_pkgs_dir}')
         if len(str(asset_path).strip()) > 1 and Path(str(asset_path)).exists():
-            if Path(str(asset_path)).is_file():
-                shutil.copy2(Path(str(asset_path)), pynsist_pkgs_dir)
-            if Path(str(asset_path)).is_dir():
-                shutil.copytree(Path(str(asset_path)), pynsist_pkgs_dir, dirs_exist_ok=True)
+            stage_paths([Path(str(asset_path))], pynsist_pkgs_dir)
 
-    logger.info(f'is_wheel_first={is_wheel_first}')
-    if not is_wheel_first:
+    if local_wheel_path and Path(local_wheel_path).exists():
+        local_wheels = [str(Path(local_wheel_path).resolve())]
+    else:
+        local_wheels = []
+    # ''' the local wheel replaces the installed copy of its package '''
+    local_wheel_names = [canonicalize_wheel_filename(w)[0] for w in local_wheels]
+
+    staging = staging or ('wheel' if is_wheel_first else 'site-packages')
+    logger.info(f'is_wheel_first={is_wheel_first}, staging={staging}')
+    '''"import sysconfig; print(sysconfig.get_path('purelib'))"'''
+    site_packages_dir = work_dir / 'packaging-venv' / 'Lib' / 'site-packages'
+    if staging == 'site-packages':
         wheels_pypi_download = []
         packages = []
         extra_wheel_sources = []
 
-        '''"import sysconfig; print(sysconfig.get_path('purelib'))"'''
-        site_packages_dir = work_dir / 'packaging-venv' / 'Lib' / 'site-packages'
-        shutil.copytree(package_dist_info, pynsist_pkgs_dir, dirs_exist_ok=True)
-        shutil.copytree(site_packages_dir, pynsist_pkgs_dir, dirs_exist_ok=True)
+        stage_paths([package_dist_info, site_packages_dir], pynsist_pkgs_dir)
+    elif staging == 'hybrid':
+        from bibiinstaller.bibiinstaller_backend import get_backend
+        from bibiinstaller.bibiinstaller_staging import log_plan, plan_staging, stage_plan
+        rqmts_plan = [r for r in wanted_rqmts_freeze if canonicalize_package_name(r) not in local_wheel_names]
+        wheel_sources = [Path(work_dir) / 'pip_download_only_binaries', get_backend().find_links]
+        plan = log_plan(plan_staging(rqmts_plan, site_packages_dir, wheel_sources, skip_pypi_wheels,
+                                     python_version=python_version, bitness=bitness))
+        wheels_pypi_download, extra_wheel_sources, packages = stage_plan(
+            plan, site_packages_dir, pynsist_pkgs_dir, work_dir, python, excludes)
+    elif staging == 'platform':
+        # ''' resolved for the target platform, every wheel is in its wheelhouse already '''
+        from bibiinstaller.bibiinstaller_resolve import PLATFORM_DOWNLOAD_DIR_NAME
+        wheels_pypi_download = [r for r in wanted_rqmts_freeze
+                                if canonicalize_package_name(r) not in local_wheel_names]
+        extra_wheel_sources = [str((Path(work_dir) / PLATFORM_DOWNLOAD_DIR_NAME).resolve())]
+        packages = []
     else:
         rqmts_wheel_pypi, rqmts_wheel_skip_pypi = separate_skip_pypi_wheels(rqmts_wheel, skip_pypi_wheels)
         wheels_pypi_download, pip_download_dir = pip_wheels_in(work_dir, python, rqmts_wheel_pypi)
-        rqmts_packages = list(set(wanted_rqmts_freeze) - set(wheels_pypi_download))
+        # ''' "name @ url" requirements are built into wheels too, pynsist takes them as local wheels '''
+        from bibiinstaller.bibiinstaller_wheels import get_dependency_wheels
+        rqmts_url, _ = separate_skip_pypi_wheels([r for r in wanted_rqmts_freeze if ' @ ' in r],
+                                                 skip_pypi_wheels + local_wheel_names)
+        url_wheels = get_dependency_wheels(python, rqmts_url, pip_download_dir)
+        local_wheels += [str(w) for w in url_wheels.values()]
+        local_wheel_names += [canonicalize_package_name(r) for r in url_wheels]
+        rqmts_packages = list(set(wanted_rqmts_freeze) - set(wheels_pypi_download) - set(url_wheels))
         packages = [separate_package_name(r) for r in rqmts_packages]
         extra_wheel_sources = [str(pip_download_dir)]
 
-    if local_wheel_path and Path(local_wheel_path).exists():
-        local_wheels = [str(Path(local_wheel_path).resolve())]
-    else:
-        local_wheels = []
+    packages = [p for p in packages if canonicalize_package_name(p) not in local_wheel_names]
 
     logger.debug(f'wanted_rqmts_freeze={wanted_rqmts_freeze}')
     logger.debug(f'skip_pypi_wheels={skip_pypi_wheels}')
@@ -539,6 +589,17 @@ def create_pynsist_cfg(
     logger.debug(f'packages={packages}')
     logger.debug(f'extra_wheel_sources={extra_wheel_sources}')
 
+    # ''' the wheels are unpacked here in parallel and cached by hash, not by nsist one after another '''
+    from bibiinstaller.bibiinstaller_unpack import find_wheels, stage_unpacked, unpack_wheels
+    wheel_files = (find_wheels(wheels_pypi_download, extra_wheel_sources, python_version, bitness)
+                   + [Path(w) for w in local_wheels])
+    if wheel_files:
+        stage_unpacked(unpack_wheels(wheel_files), pynsist_pkgs_dir, excludes)
+    wheels_pypi_download, extra_wheel_sources, local_wheels = [], [], []
+
+    from bibiinstaller.bibiinstaller_dedup import dedup_payload
+    files += dedup_payload(pynsist_pkgs_dir, work_dir, dedup_binaries, embed_archive=embed_archive)
+
     if suffix:
         installer_name = "{}_{}bit_{}.exe"
     else:
@@ -605,16 +666,6 @@ def unzip_file(filename, target_directory):
         z.extractall(target_directory)
 
 
-def make_work_dir(root: str = None):
-    if root is None:
-        root = '.'
-    import datetime
-    work_dir = Path(root) / f"bibiinstaller-pynsist-{datetime.datetime.now().strftime('%Y%m%d')}"
-    logger.info(f'make work dir under: [{root}]')
-    work_dir.mkdir(parents=True, exist_ok=True)
-    return work_dir.resolve()
-
-
 # TODO: assets prepares.
 # def copy_assets(assets_dir, work_dir):
 #     # NOTE: SHOULD BE TEMPORAL (until jedi has the fix available).
@@ -670,6 +721,30 @@ def read_pyproject_toml_info(file_path):
         return pyproject_info
 
 
+def read_project_info(project_root, package):
+    '''
+    Return (name, version, author) from setup.py or pyproject.toml under project_root.
+    '''
+    if (Path(project_root) / 'setup.py').exists():
+        setup_info = read_setup_py_info(Path(project_root) / 'setup.py')
+        logger.debug(setup_info)
+        package_name = setup_info['name']
+        package_version = setup_info['version']
+        package_author = setup_info['author']
+    elif (Path(project_root) / 'pyproject.toml').exists():
+        pyproject_info = read_pyproject_toml_info(Path(project_root) / 'pyproject.toml')
+        logger.debug(pyproject_info)
+        package_name = pyproject_info['project']['name']
+        package_version = pyproject_info['project']['version']
+        package_author = pyproject_info['project']['authors'][0]['name']
+    else:
+        logger.warning(f"ERROR: {Path(project_root) / 'setup.py'} or {Path(project_root) / 'pyproject.toml'}")
+        package_name = package
+        package_version = "0.1.0"
+        package_author = ""
+    return package_name, package_version, package_author
+
+
 def read_packages(package_txt_file) -> list:
     if package_txt_file and Path(package_txt_file).exists():
         packages = [line.strip().split('#', 1)[0].strip() for line in
@@ -701,6 +776,108 @@ def prepare_windows_assets(download_assets: bool, ASSETS_URL: str):
         unzip_file(r'E:\spyder_install\assets.zip', 'installers/Windows/assets')
 
 
+def compute_build_fingerprint(python_version, bitness, entrypoint, package, icon_path, license_path,
+                              files=None, excludes=None, asset_path=None, pynsist_version=2.8,
+                              project_root=None, extra_requirements_txt_path=None, extra_packages=None,
+                              editable_packages=None, unwanted_packages=None, skip_pypi_packages=None,
+                              conda_path=None, suffix=None, nsi_template_path=None, local_wheel_path=None,
+                              is_wheel_first=False, configs_py_file=None, dedup_binaries='report',
+                              compression='lzma', compression_dict_size=None, output='installer',
+                              runtime_packages=None, staging=None, resolution='venv'):
+    """
+    Fingerprint of every input of run_installer, the key of the artifact cache.
+    """
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_cache import build_fingerprint
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    from bibiinstaller.bibiinstaller_venvs import get_base_tools
+    return build_fingerprint(
+        parameters=dict(
+            toolchain=get_toolchain().name, installer=get_backend().name, base_tools=get_base_tools(),
+            python_version=python_version, bitness=bitness, entrypoint=entrypoint, package=package,
+            files=files, excludes=excludes, pynsist_version=pynsist_version,
+            extra_packages=extra_packages, editable_packages=editable_packages,
+            unwanted_packages=unwanted_packages, skip_pypi_packages=skip_pypi_packages,
+            conda_path=conda_path, suffix=suffix, is_wheel_first=is_wheel_first,
+            dedup_binaries=dedup_binaries, compression=compression, compression_dict_size=compression_dict_size,
+            output=output, runtime_packages=runtime_packages, staging=staging, resolution=resolution),
+        paths=dict(
+            project_root=project_root, configs_py_file=configs_py_file,
+            icon_path=icon_path, license_path=license_path, asset_path=asset_path,
+            extra_requirements_txt_path=extra_requirements_txt_path,
+            nsi_template_path=nsi_template_path, local_wheel_path=local_wheel_path,
+            find_links=get_backend().find_links,
+            editable_packages=[Path(project_root) / p for p in editable_packages or []],
+            files=[Path(project_root) / f for f in files or [] if isinstance(f, str)]),
+        excludes=excludes
+    )
+
+
+def compute_work_dir_key(python_version, bitness, package, project_root=None, extra_requirements_txt_path=None,
+                         extra_packages=None, editable_packages=None, unwanted_packages=None, conda_path=None,
+                         runtime_packages=None, resolution='venv', **kwargs):
+    """
+    Key of the reusable work dir: what decides the packaging venv contents.
+
+    Source changes of the project keep the key, pip reinstalls it into the same venv. The key holds the
+    metadata files by content, not where the project lives: checkouts of the same project share a work dir,
+    unless editable packages link the venv to one checkout.
+    """
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_cache import build_fingerprint
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+    return build_fingerprint(
+        parameters=dict(
+            toolchain=get_toolchain().name, installer=get_backend().name,
+            python_version=python_version, bitness=bitness, package=package,
+            project_root=str(project_root) if editable_packages else None,
+            extra_packages=extra_packages, editable_packages=editable_packages,
+            unwanted_packages=unwanted_packages, conda_path=str(conda_path), runtime_packages=runtime_packages,
+            resolution=resolution),
+        paths=dict(
+            metadata_files=[Path(project_root) / f for f in METADATA_FILES if (Path(project_root) / f).exists()],
+            extra_requirements_txt_path=extra_requirements_txt_path),
+        name='work dir'
+    )
+
+
+def install_extras(env_python, extra_requirements_txt_path, extra_packages, editable_packages, unwanted_packages):
+    '''
+    Install the extra requirements, editable and extra packages into the packaging venv, then uninstall the
+    unwanted packages.
+    '''
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    logger.info(f"Installing extra requirements: [{extra_requirements_txt_path}]")
+    if extra_requirements_txt_path and Path(extra_requirements_txt_path).exists() and Path(
+            extra_requirements_txt_path).is_file():
+        subprocess_run(get_backend().pip_command(env_python, "install", "-r",
+                                                 str(extra_requirements_txt_path), "--no-warn-script-location"))
+    else:
+        logger.warning(f'NOT EXIST extra requirements txt file: [{extra_requirements_txt_path}]')
+
+    # '''
+    #  --editable:
+    #  It should either be a path to a local project or a VCS URL
+    #  (beginning with bzr+http, bzr+https, bzr+ssh, bzr+sftp, bzr+ftp, bzr+lp,
+    #   bzr+file, git+http, git+https, git+ssh, git+git, git+file,
+    #   hg+file, hg+http, hg+https, hg+ssh, hg+static-http, svn+ssh, svn+http,
+    #   svn+https, svn+svn, svn+file).
+    # '''
+    logger.info(f"Installing packages with the --editable flag: {editable_packages}")
+    for editable_package in editable_packages:
+        subprocess_run(get_backend().pip_command(env_python, "install", "-e",
+                                                 editable_package, "--no-warn-script-location"))
+
+    logger.info(f"Installing extra packages: {extra_packages}")
+    for extra_package in extra_packages:
+        subprocess_run(get_backend().pip_command(env_python, "install",
+                                                 extra_package, "--no-warn-script-location"))
+
+    logger.info(f"Uninstalling unwanted packages: {unwanted_packages}")
+    for unwanted_package in unwanted_packages:
+        subprocess_run(get_backend().pip_command(env_python, "uninstall", "-y", unwanted_package))
+
+
 def run_installer(python_version,
                   bitness,
                   entrypoint,
@@ -721,92 +898,181 @@ def run_installer(python_version,
                   suffix=None,
                   nsi_template_path=None,
                   local_wheel_path=None,
-                  is_wheel_first=False):
+                  is_wheel_first=False,
+                  configs_py_file=None,
+                  dedup_binaries='report',
+                  compression='lzma',
+                  compression_dict_size=None,
+                  output='installer',
+                  runtime_packages=None,
+                  staging=None,
+                  resolution='venv',
+                  keep_lock=False,
+                  force=False):
     """
     Run the installer generation.
 
     Given a certain python version, bitness, package repository root directory,
     package name, icon path and license path a pynsist configuration file
     (locking the dependencies set in setup.py) is generated and pynsist runned.
+
+    When a previous build had the same fingerprint, the cached installer is
+    copied into dist/ instead, unless force is set.
+
+    output "dir" or "zip" writes the portable app into dist/ instead of an
+    installer, nsist and makensis are not run (see bibiinstaller_portable).
+
+    runtime_packages build a thin installer on the shared runtime of these
+    packages, compiled once into its own installer (see bibiinstaller_runtime).
+
+    staging "hybrid" stages every distribution from the cheapest of its install,
+    a cached wheel or a download (see bibiinstaller_staging).
+
+    resolution "platform" creates no packaging venv, the wheels for the target
+    platform are downloaded and locked by the pip running bibiinstaller
+    (see bibiinstaller_resolve).
+
+    keep_lock hands the work dir lock to the caller in state['work_dir_lock'],
+    who releases it, e.g. the watch mode that keeps writing into the work dir.
     """
+    from bibiinstaller.bibiinstaller_backend import get_backend
+    from bibiinstaller.bibiinstaller_copy import copy
+    from bibiinstaller.bibiinstaller_embed import prefetch_embed, pynsist_env
+    from bibiinstaller.bibiinstaller_manifest import MANIFEST_NAME, release_manifest_name
+    from bibiinstaller.bibiinstaller_cache import (
+        collect_garbage, open_work_dir, record_work_dir, restore_artifact, store_artifact
+    )
+    from bibiinstaller.bibiinstaller_wheels import get_project_wheel
+    work_dir_lock = None
     try:
-
-        work_dir = make_work_dir(project_root)
-        logger.info(f"Temporary working directory at [{work_dir}]")
+        if resolution == 'platform':
+            if editable_packages or runtime_packages:
+                sys.exit("editable_packages and runtime_packages need the packaging venv, use --resolution venv")
+            if staging not in [None, 'platform']:
+                logger.warning(f"staging {staging} ignored, --resolution platform stages its locked wheels")
+            staging = 'platform'
+        destination_dir = os.path.join(project_root, "dist")
+        fingerprint = compute_build_fingerprint(
+            python_version=python_version, bitness=bitness, entrypoint=entrypoint, package=package,
+            icon_path=icon_path, license_path=license_path, files=files, excludes=excludes,
+            asset_path=asset_path, pynsist_version=pynsist_version, project_root=project_root,
+            extra_requirements_txt_path=extra_requirements_txt_path, extra_packages=extra_packages,
+            editable_packages=editable_packages, unwanted_packages=unwanted_packages,
+            skip_pypi_packages=skip_pypi_packages, conda_path=conda_path, suffix=suffix,
+            nsi_template_path=nsi_template_path, local_wheel_path=local_wheel_path,
+            is_wheel_first=is_wheel_first, configs_py_file=configs_py_file, dedup_binaries=dedup_binaries,
+            compression=compression, compression_dict_size=compression_dict_size, output=output,
+            runtime_packages=runtime_packages, staging=staging, resolution=resolution)
+        if force:
+            logger.info("Force rebuild, artifact cache bypassed.")
+        elif output != 'dir' and restore_artifact(fingerprint, destination_dir):
+            logger.info("Installer restored from artifact cache!")
+            return
+
+        runtime = None
+        if runtime_packages and output == 'installer':
+            from bibiinstaller.bibiinstaller_runtime import check_template
+            check_template(nsi_template_path)
+            if dedup_binaries == 'collapse':
+                logger.warning("dedup_binaries collapse writes into the shared runtime Python, reported only.")
+                dedup_binaries = 'report'
+
+        work_dir_key = compute_work_dir_key(
+            python_version, bitness, package, project_root=project_root,
+            extra_requirements_txt_path=extra_requirements_txt_path, extra_packages=extra_packages,
+            editable_packages=editable_packages, unwanted_packages=unwanted_packages, conda_path=conda_path,
+            runtime_packages=runtime_packages, resolution=resolution)
+        work_dir, work_dir_lock = open_work_dir(work_dir_key, project_root)
+        logger.info(f"Working directory at [{work_dir}]")
+        for stale_dir in ['build', 'pynsist_pkgs']:
+            shutil.rmtree(work_dir / stale_dir, ignore_errors=True)
+        if not str(icon_path).lower().endswith('ico'):
+            # ''' into the work dir: written into project_root it changed the fingerprint of the next build '''
+            icon_path_convert = work_dir / f"{Path(icon_path).name}.ico"
+            png_to_icon(icon_path, icon_path_convert)
+            icon_path = Path(icon_path_convert).resolve()
+        # ''' the embeddable Python is fetched while the venv is built '''
+        embed_future = prefetch_embed(python_version, bitness)
 
         # TODO: ...
         # copy_assets(assets_dir, work_dir)
 
         packaging_venv_dir = 'packaging-venv'
 
-        logger.info("Copying template into discoverable path for Pynsist")
-        logger.info(f'Pynsist template: [{nsi_template_path}]')
-        if nsi_template_path:
-            template_basename = os.path.basename(nsi_template_path)
+        if resolution == 'platform':
+            from bibiinstaller.bibiinstaller_toolchain import get_toolchain
+            env_python = get_toolchain().resolver_python()
+            logger.info(f"No package virtual environment, resolving with [{env_python}]")
+            # ''' pynsist also looks for the template next to pynsist.cfg '''
+            template_new_path = str(work_dir)
+        else:
+            logger.info(f"Creating the package virtual environment. [{Path(work_dir) / packaging_venv_dir}]")
+            env_python = create_packaging_venv(
+                work_dir, python_version,
+                conda_path=conda_path,
+                venv_name=packaging_venv_dir,
+                bitness=bitness)
             template_new_path = os.path.normpath(
                 os.path.join(
                     work_dir,
                     f"{packaging_venv_dir}/Lib/site-packages/nsist"))
+
+        # ''' after the venv: a venv cloned from the base venv replaces the whole dir '''
+        logger.info("Copying template into discoverable path for Pynsist")
+        logger.info(f'Pynsist template: [{nsi_template_path}]')
+        if nsi_template_path:
+            template_basename = os.path.basename(nsi_template_path)
             os.makedirs(template_new_path, exist_ok=True)
 
             update_application_nsi(
                 nsi_template_path,
                 os.path.join(template_new_path, template_basename),
-                app_name=package
+                app_name=package,
+                compression=compression,
+                compression_dict_size=compression_dict_size
             )
             nsi_template_path = template_basename
 
-        logger.info(f"Creating the package virtual environment. [{Path(work_dir) / packaging_venv_dir}]")
-        env_python = create_packaging_venv(
-            work_dir, python_version,
-            conda_path=conda_path,
-            venv_name=packaging_venv_dir)
-
-        # ''' install pip, setuptools, wheel and package using pip  '''
-        logger.info(f"Updating pip in the virtual environment [{env_python}]")
-        subprocess_run(
-            [env_python, "-m", "pip", "install", "--upgrade", "pip",
-             "--no-warn-script-location"]
-        )
-
-        logger.info(f"Updating setuptools in the virtual environment [{env_python}]")
-        subprocess_run(
-            [env_python, "-m", "pip", "install", "--upgrade",
-             "--force-reinstall", "setuptools",
-             "--no-warn-script-location"]
-        )
-
-        logger.info(f"Updating/installing wheel in the virtual environment [{env_python}]")
-        subprocess_run(
-            [env_python, "-m", "pip", "install", "--upgrade", "wheel",
-             "--no-warn-script-location"]
-        )
-
-        logger.info(f"Installing package under [{project_root}]")
-        subprocess_run([env_python, "-m",
-                        "pip", "install", project_root,
-                        "--no-warn-script-location"])
-
-        logger.info(f"Check entrypoint： {entrypoint}")
-        check_entrypoint(env_python, entrypoint)
-
-        if (Path(project_root) / 'setup.py').exists():
-            setup_info = read_setup_py_info(Path(project_root) / 'setup.py')
-            logger.debug(setup_info)
-            package_name = setup_info['name']
-            package_version = setup_info['version']
-            package_author = setup_info['author']
-        elif (Path(project_root) / 'pyproject.toml').exists():
-            pyproject_info = read_pyproject_toml_info(Path(project_root) / 'pyproject.toml')
-            logger.debug(pyproject_info)
-            package_name = pyproject_info['project']['name']
-            package_version = pyproject_info['project']['version']
-            package_author = pyproject_info['project']['authors'][0]['name']
+        if runtime_packages and output == 'installer':
+            from bibiinstaller.bibiinstaller_runtime import get_runtime
+            python_version_embed, embed_archive = embed_future.result()
+            runtime = get_runtime(python_version, python_version_embed, embed_archive, runtime_packages,
+                                  bitness=bitness, conda_path=conda_path, compression=compression,
+                                  compression_dict_size=compression_dict_size)
+            logger.info(f"Installing the runtime packages pinned to [{runtime.runtime_id}]")
+            subprocess_run(get_backend().pip_command(env_python, "install", *runtime.requirements,
+                                                     "--no-warn-script-location"))
+        elif runtime_packages:
+            logger.warning(f"The portable {output} bundles the runtime packages: {runtime_packages}")
+            subprocess_run(get_backend().pip_command(env_python, "install", *runtime_packages,
+                                                     "--no-warn-script-location"))
+
+        logger.info(f"Building package wheel under [{project_root}]")
+        project_wheel = get_project_wheel(env_python, project_root, python_version, bitness)
+        if resolution == 'platform':
+            from bibiinstaller.bibiinstaller_resolve import check_project_wheel, resolve_platform
+            check_project_wheel(project_wheel, bitness)
+            lock_file = resolve_platform(env_python, work_dir, project_wheel, python_version, bitness,
+                                         extra_requirements_txt_path=extra_requirements_txt_path,
+                                         extra_packages=extra_packages, unwanted_packages=unwanted_packages)
+            local_wheel_path = local_wheel_path or project_wheel
         else:
-            logger.warning(f"ERROR: {Path(project_root) / 'setup.py'} or {Path(project_root) / 'pyproject.toml'}")
-            package_name = package
-            package_version = "0.1.0"
-            package_author = ""
+            logger.info(f"Installing package wheel [{project_wheel}]")
+            project_wheel_name, _ = canonicalize_wheel_filename(project_wheel)
+            if project_wheel_name in [canonicalize_package_name(r) for r in pip_list(env_python)]:
+                subprocess_run(get_backend().pip_command(env_python, "uninstall", "-y", project_wheel_name))
+            subprocess_run(get_backend().pip_command(env_python, "install", str(project_wheel),
+                                                     "--no-warn-script-location"))
+            if not local_wheel_path and (is_wheel_first or staging == 'wheel'):
+                local_wheel_path = project_wheel
+
+            logger.info(f"Check entrypoint： {entrypoint}")
+            check_entrypoint(env_python, entrypoint)
+
+            install_extras(env_python, extra_requirements_txt_path, extra_packages, editable_packages,
+                           unwanted_packages)
+
+        package_name, package_version, package_author = read_project_info(project_root, package)
 
         package_dist_info = (work_dir / f"{packaging_venv_dir}/Lib/site-packages" /
                              f"{package_name}-{package_version}.dist-info").resolve()
@@ -818,49 +1084,17 @@ def run_installer(python_version,
         #     dirs_exist_ok=True
         # )
 
-        logger.info(f"Installing extra requirements: [{extra_requirements_txt_path}]")
-        if extra_requirements_txt_path and Path(extra_requirements_txt_path).exists() and Path(
-                extra_requirements_txt_path).is_file():
-            subprocess_run([env_python, "-m", "pip", "install", "-r",
-                            str(extra_requirements_txt_path), "--no-warn-script-location"])
-        else:
-            logger.warning(f'NOT EXIST extra requirements txt file: [{extra_requirements_txt_path}]')
-
-        # '''
-        #  --editable:
-        #  It should either be a path to a local project or a VCS URL
-        #  (beginning with bzr+http, bzr+https, bzr+ssh, bzr+sftp, bzr+ftp, bzr+lp,
-        #   bzr+file, git+http, git+https, git+ssh, git+git, git+file,
-        #   hg+file, hg+http, hg+https, hg+ssh, hg+static-http, svn+ssh, svn+http,
-        #   svn+https, svn+svn, svn+file).
-        # '''
-        logger.info(f"Installing packages with the --editable flag: {editable_packages}")
-        for editable_package in editable_packages:
-            subprocess_run([env_python, "-m", "pip", "install", "-e",
-                            editable_package, "--no-warn-script-location"])
-
-        logger.info(f"Installing extra packages: {extra_packages}")
-        for extra_package in extra_packages:
-            subprocess_run([env_python, "-m", "pip", "install",
-                            extra_package, "--no-warn-script-location"])
-
-        logger.info(f"Uninstalling unwanted packages: {unwanted_packages}")
-        for unwanted_package in unwanted_packages:
-            subprocess_run([env_python, "-m", "pip", "uninstall",
-                            unwanted_package, "--no-warn-script-location"])
-
         pynsist_cfg = work_dir / "pynsist.cfg"
         logger.info(f"Creating pynsist configuration file [{pynsist_cfg}]")
         pynsist_pkgs_dir = work_dir / "pynsist_pkgs"
         pynsist_pkgs_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Creating pynsist_pkgs [{pynsist_pkgs_dir}]")
 
-        python_version_embed = find_python_embed_amd64_versions(python_version)
-        logger.info(f"python_version_embed = {python_version_embed}, python_version={python_version}")
+        python_version_embed, embed_archive = embed_future.result()
+        logger.info(f"python_version_embed = {python_version_embed}, python_version={python_version}, "
+                    f"embed archive [{embed_archive}]")
 
-        installer_exe = create_pynsist_cfg(
-            work_dir, pynsist_pkgs_dir, env_python, python_version_embed, bitness,
-            package_name, package_version, package_author, package_dist_info,
+        pynsist_cfg_kwargs = dict(
             entrypoint=entrypoint,
             package=package,
             unwanted_packages=unwanted_packages,
@@ -870,29 +1104,83 @@ def run_installer(python_version,
             files=files, excludes=excludes, asset_path=asset_path,
             suffix=suffix, nsi_template_path=nsi_template_path,
             local_wheel_path=local_wheel_path,
-            is_wheel_first=is_wheel_first)
-
-        logger.info("Extracting nsis.")
-        prepare_nsis_plugins(work_dir)
-
-        logger.info("Installing pynsist.")
-        subprocess_run([env_python, "-m", "pip", "install", f"pynsist=={pynsist_version}",
-                        "--no-warn-script-location"])
-
-        logger.info("Running pynsist.")
-        subprocess_run([env_python, "-m", "nsist", pynsist_cfg])
-
-        destination_dir = os.path.join(project_root, "dist")
-        logger.info(f"Copying installer file to [{destination_dir}]")
-        os.makedirs(destination_dir, exist_ok=True)
-        shutil.copy(
-            os.path.join(work_dir, "build", "nsis", installer_exe),
-            destination_dir,
-        )
-        logger.info("Installer created!")
+            is_wheel_first=is_wheel_first,
+            dedup_binaries=dedup_binaries,
+            staging=staging,
+            embed_archive=embed_archive)
+        installer_exe = create_pynsist_cfg(
+            work_dir, pynsist_pkgs_dir, env_python, python_version_embed, bitness,
+            package_name, package_version, package_author, package_dist_info,
+            **dict(pynsist_cfg_kwargs, files=list(files or [])))
+        if resolution == 'platform':
+            from bibiinstaller.bibiinstaller_resolve import check_staged_entrypoint
+            logger.info(f"Check entrypoint： {entrypoint}")
+            check_staged_entrypoint(pynsist_pkgs_dir, entrypoint)
+            os.makedirs(destination_dir, exist_ok=True)
+            copy(lock_file, Path(destination_dir) / f"{Path(installer_exe).stem}.lock")
+
+        if output == 'installer':
+            logger.info("Extracting nsis.")
+            prepare_nsis_plugins(work_dir)
+
+            logger.info("Installing pynsist.")
+            if resolution == 'platform':
+                from bibiinstaller.bibiinstaller_resolve import install_pynsist
+                nsist_env = install_pynsist(env_python, work_dir, pynsist_version)
+            else:
+                subprocess_run(get_backend().pip_command(env_python, "install", f"pynsist=={pynsist_version}",
+                                                         "--no-warn-script-location"))
+                nsist_env = pynsist_env()
+
+            logger.info("Running pynsist.")
+            subprocess_run([env_python, "-m", "nsist", "--no-makensis", pynsist_cfg], env=nsist_env)
+            nsis_build_dir = Path(work_dir) / "build" / "nsis"
+            if runtime is not None:
+                from bibiinstaller.bibiinstaller_runtime import drop_runtime_distributions
+                drop_runtime_distributions(nsis_build_dir, runtime)
+            logger.info("Running makensis.")
+            compile_nsis(nsis_build_dir, python_version_embed, defines=runtime.defines if runtime else None)
+
+            logger.info(f"Copying installer file to [{destination_dir}]")
+            os.makedirs(destination_dir, exist_ok=True)
+            copy(nsis_build_dir / installer_exe, destination_dir)
+            # ''' the --from of the next patch installer, see bibiinstaller_delta '''
+            release_manifest = copy(nsis_build_dir / MANIFEST_NAME,
+                                    Path(destination_dir) / release_manifest_name(installer_exe))
+            if runtime is not None:
+                copy(runtime.installer_file, destination_dir)
+            store_artifact(fingerprint, nsis_build_dir / installer_exe, pynsist_cfg, release_manifest,
+                           runtime=runtime)
+            logger.info("Installer created!")
+        else:
+            from bibiinstaller.bibiinstaller_portable import assemble_portable
+            logger.info(f"Assembling the portable {output} into [{destination_dir}], NSIS skipped.")
+            portable = assemble_portable(
+                pynsist_cfg, embed_archive, work_dir / f"{packaging_venv_dir}/Lib/site-packages", destination_dir,
+                Path(installer_exe).stem, output=output, compression=compression)
+            if output == 'zip':
+                store_artifact(fingerprint, portable, pynsist_cfg)
+            installer_exe = portable.name
+            logger.info(f"Portable {output} created!")
+        record_work_dir(work_dir)
+        collect_garbage(current_work_dir=work_dir)
+        state = dict(
+            work_dir=work_dir, env_python=env_python, project_root=project_root,
+            destination_dir=destination_dir, pynsist_cfg=pynsist_cfg, pynsist_pkgs_dir=pynsist_pkgs_dir,
+            python_version_embed=python_version_embed, bitness=bitness, package=package,
+            package_name=package_name, package_version=package_version, package_author=package_author,
+            package_dist_info=package_dist_info, installer_exe=installer_exe,
+            pynsist_cfg_kwargs=pynsist_cfg_kwargs, embed_archive=embed_archive, output=output,
+            compression=compression, runtime=runtime)
+        if keep_lock:
+            state['work_dir_lock'], work_dir_lock = work_dir_lock, None
+        return state
     except PermissionError as pe:
         logger.info(f"PermissionError {pe}")
         pass
+    finally:
+        if work_dir_lock is not None:
+            work_dir_lock.release()
 
 
 def get_absolute_path(root, file):
@@ -901,6 +1189,7 @@ def get_absolute_path(root, file):
 
 
 def url_exist(url):
+    import requests
     try:
         response = requests.head(url, timeout=5)
         return response.status_code == 200
@@ -909,19 +1198,11 @@ def url_exist(url):
 
 
 def find_python_embed_amd64_versions(python_version):
-    pattern = r'(\d+)\.(\d+)\.(\d+)'
-    match = re.match(pattern, python_version)
-    major_version = int(match.group(1))
-    minor_version = int(match.group(2))
-    micro_version = int(match.group(3))
-    # micro_versions = sorted(list(range(20)), key=lambda num: abs(num - micro_version))
-    micro_versions = [i for i in range(20, -1, -1)]
-    versions = [f"{major_version}.{minor_version}.{micro_version}" for micro_version in micro_versions]
-    for version in versions:
-        url = f'https://www.python.org/ftp/python/{version}/python-{version}-embed-amd64.zip'
-        if url_exist(url):
-            return version
-    return python_version
+    '''
+    Newest X.Y.Z embeddable amd64 build of python_version, the cached one when present (see bibiinstaller_embed).
+    '''
+    from bibiinstaller.bibiinstaller_embed import resolve_embed_version
+    return resolve_embed_version(python_version, 64)
 
 
 def lazy_import(file_path, module_name):
@@ -945,10 +1226,11 @@ def change_exe_icon(work_dir, package_name, icon_file):
     '''
     ResourceHacker.exe -open bibiinstaller_app.exe -save app.exe -action addskip -res bibiinstaller.ico -mask ICONGROUP,MAINICON
     '''
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
     windows_assets_dir = (Path(work_dir) / f"windows_assets").resolve()
     changed_icon_exe = windows_assets_dir / f'{package_name}.exe'
-    resource_hacker = ASSETS_HOME / 'Windows' / 'icon_configs' / 'ResourceHacker.exe'
-    bibiinstaller_app = ASSETS_HOME / 'Windows' / 'exes' / 'bibiinstaller_app.exe'
+    resource_hacker = get_toolchain().resource_hacker_exe()
+    bibiinstaller_app = get_toolchain().launcher_exe()
     subprocess_run([
         resource_hacker, '-open', bibiinstaller_app, '-save', changed_icon_exe,
         '-action', 'addskip', '-res', icon_file, '-mask', 'ICONGROUP,MAINICON'
@@ -958,20 +1240,40 @@ def change_exe_icon(work_dir, package_name, icon_file):
 
 
 def prepare_nsis_plugins(work_dir):
+    from bibiinstaller.bibiinstaller_copy import copy_tree
+    from bibiinstaller.bibiinstaller_toolchain import get_toolchain
     windows_assets_dir = (Path(work_dir) / f"windows_assets").resolve()
     work_nsis_dir = windows_assets_dir / 'nsis-3.10-win'
-    nsis_dir = ASSETS_HOME / 'Windows' / 'nsis'
+    nsis_dir = get_toolchain().nsis_dir()
     nsis_zip = nsis_dir / 'nsis-3.10-win.zip'
     nsis_plugins_dir = (nsis_dir / 'Plugins').resolve()
     unzip_file(nsis_zip, windows_assets_dir)
-    shutil.copytree(nsis_plugins_dir, work_nsis_dir / 'Plugins', dirs_exist_ok=True)
+    copy_tree(nsis_plugins_dir, work_nsis_dir / 'Plugins')
     # for pynsist to locate makensis [shutil.which("makensis")]
     # logger.debug(os.environ["PATH"])
-    os.environ["PATH"] += os.pathsep + str(work_nsis_dir)
+    os.environ["PATH"] += os.pathsep + str(get_toolchain().makensis_dir(work_nsis_dir))
     # logger.debug(os.environ["PATH"])
     return work_nsis_dir
 
 
+def compile_nsis(nsis_build_dir, python_version, exit=True, defines=None):
+    '''
+    Write the pkgs manifest next to the installer.nsi of nsist --no-makensis, then run makensis on it.
+
+    defines: {name: value} passed as makensis /Dname=value, e.g. the runtime of a layered build.
+    '''
+    from bibiinstaller.bibiinstaller_manifest import write_upgrade_files
+    write_upgrade_files(nsis_build_dir, python_version)
+    makensis = shutil.which('makensis')
+    if makensis is None:
+        logger.warning('NOT FOUND makensis in PATH')
+        if exit:
+            sys.exit(1)
+        return 1
+    defines = [f'/D{name}={value}' for name, value in (defines or {}).items()]
+    return subprocess_run([makensis, '/V2', *defines, Path(nsis_build_dir) / 'installer.nsi'], exit=exit)
+
+
 def strtobool(val):
     """Convert a string representation of truth to true (1) or false (0).
 
@@ -996,7 +1298,7 @@ def check_entrypoint(python_env, entrypoint: str, max_execution_time: int = 2):
     logger.info(f'$ {" ".join([str(x) for x in args])}')
     try:
         cp = subprocess.run(args, capture_output=True, text=True, timeout=max_execution_time,
-                            creationflags=subprocess.CREATE_NO_WINDOW)
+                            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
         logger.info(f'returncode = {cp.returncode}, stdout = {cp.stdout}, stderr = {cp.stderr}')
         if cp.returncode != 0:
             sys.exit(F"FAILED,  entrypoint [{entrypoint}] error: {cp.stderr}.")
@@ -1008,17 +1310,45 @@ def check_entrypoint(python_env, entrypoint: str, max_execution_time: int = 2):
         return True
 
 
+def run_command(argv):
+    module_name, _, function_name = COMMANDS[argv[0]].partition(':')
+    command_main = getattr(importlib.import_module(module_name), function_name)
+    return command_main(argv[1:])
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return run_command(sys.argv[1:])
+
     import argparse
     parser = argparse.ArgumentParser(
         prog='bibiinstaller',
         description='python installer package named bibi.')
     parser.add_argument('configs.py')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild even when the artifact cache has an installer for the same inputs.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep the work dir and rebuild only the application package on changes.')
+    parser.add_argument('--validate', action='store_true',
+                        help='Validate configs.py and the paths it refers to, then exit.')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Print the resolved build parameters and fingerprint, then exit.')
+    from bibiflags import BibiFlags
     flags = BibiFlags(app_name='bibiinstaller_windows',
                       argparser=parser,
                       root=str(CONFIG_HOME))
     logger.debug(pformat(flags.parameters, sort_dicts=False))
 
+    if flags.parameters.get('cache_dir'):
+        os.environ['BIBIINSTALLER_CACHE'] = str(get_absolute_path(Path.cwd(), flags.parameters['cache_dir']))
+    if flags.parameters.get('toolchain'):
+        from bibiinstaller.bibiinstaller_toolchain import create_toolchain, set_toolchain
+        set_toolchain(create_toolchain(flags.parameters['toolchain']))
+    if flags.parameters.get('installer') or flags.parameters.get('find_links'):
+        from bibiinstaller.bibiinstaller_backend import create_backend, set_backend
+        set_backend(create_backend(flags.parameters.get('installer'),
+                                   find_links=get_absolute_path(Path.cwd(), flags.parameters.get('find_links'))))
+
     configs_py_file = flags.parameters['configs.py']
     configs_py_vars = get_config_variables(configs_py_file, 'configs_py')
     logger.info(pformat(configs_py_vars, sort_dicts=False))
@@ -1038,17 +1368,18 @@ def main():
     suffix = flags.parameters.get('suffix')
     # pypi_server = flags.parameters.get('pypi_server')
     is_wheel_first = strtobool(flags.parameters.get('is_wheel_first', False))
+    dedup_binaries = flags.parameters.get('dedup_binaries') or 'report'
+    compression = flags.parameters.get('compression') or 'lzma'
+    compression_dict_size = flags.parameters.get('compression_dict_size')
+    output = flags.parameters.get('output') or 'installer'
+    staging = flags.parameters.get('staging')
+    resolution = flags.parameters.get('resolution') or 'venv'
 
     icon_path = get_absolute_path(project_root,
                                   flags.parameters.get('icon_path') or configs.ICON_PATH)
     if not Path(icon_path).exists():
         sys.exit(f"NOT Exist icon_path = [{icon_path}]")
 
-    if not str(icon_path).lower().endswith('ico'):
-        icon_path_convert = str(icon_path) + '.ico'
-        png_to_icon(icon_path, icon_path_convert)
-        icon_path = Path(icon_path_convert).resolve()
-
     license_path = get_absolute_path(project_root,
                                      flags.parameters.get('license_txt_path') or configs.LICENSE_TXT_PATH)
 
@@ -1068,6 +1399,8 @@ def main():
                                                    flags.parameters.get('unwanted_packages_txt_path'))
     skip_pypi_packages_txt_path = get_absolute_path(project_root,
                                                     flags.parameters.get('skip_pypi_packages_txt_path'))
+    runtime_packages_txt_path = get_absolute_path(project_root,
+                                                  flags.parameters.get('runtime_packages_txt_path'))
     local_wheel_path = get_absolute_path(project_root,
                                          flags.parameters.get('local_wheel_path'))
 
@@ -1083,6 +1416,9 @@ def main():
     skip_pypi_packages = merge_packages(skip_pypi_packages_txt_path, configs.SKIP_PYPI_PACKAGES)
     logger.info(f"skip_pypi_packages: {pformat(skip_pypi_packages)}")
 
+    runtime_packages = merge_packages(runtime_packages_txt_path, configs.RUNTIME_PACKAGES)
+    logger.info(f"runtime_packages: {pformat(runtime_packages)}")
+
     conda_path = get_absolute_path(project_root,
                                    flags.parameters.get('conda_path'))
 
@@ -1091,7 +1427,7 @@ def main():
     if (not (Path(project_root) / 'setup.py').exists()) and (not (Path(project_root) / 'pyproject.toml').exists()):
         sys.exit(f"Invalid project_root: [{project_root}], NO 'setup.py' or 'pyproject.toml' under it.")
 
-    run_installer(
+    installer_kwargs = dict(
         python_version=python_version,
         bitness=bitness,
         entrypoint=entrypoint,
@@ -1112,9 +1448,38 @@ def main():
         suffix=suffix,
         nsi_template_path=nsi_template_path,
         local_wheel_path=local_wheel_path,
-        is_wheel_first=is_wheel_first
+        is_wheel_first=is_wheel_first,
+        configs_py_file=configs_py_file,
+        dedup_binaries=dedup_binaries,
+        compression=compression,
+        compression_dict_size=compression_dict_size,
+        output=output,
+        runtime_packages=runtime_packages,
+        staging=staging,
+        resolution=resolution
     )
 
+    if flags.parameters.get('validate', False):
+        logger.info(f"VALID configs: [{configs_py_file}]")
+        return 0
+
+    if flags.parameters.get('dry_run', False):
+        from bibiinstaller.bibiinstaller_cache import ARTIFACT_JSON, get_artifact_dir
+        fingerprint = compute_build_fingerprint(**installer_kwargs)
+        cached = (get_artifact_dir(fingerprint) / ARTIFACT_JSON).exists()
+        print(pformat(installer_kwargs, sort_dicts=False))
+        print(f"fingerprint: {fingerprint} ({'cached' if cached else 'not cached'})")
+        return 0
+
+    if flags.parameters.get('watch', False):
+        if resolution == 'platform':
+            sys.exit("--watch syncs into the packaging venv, use --resolution venv")
+        from bibiinstaller.bibiinstaller_watch import watch_installer
+        build = watch_installer
+    else:
+        build = run_installer
+
+    build(**installer_kwargs, force=flags.parameters.get('force', False))
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -30,7 +30,8 @@ def substitute(template_path: str, key_val_maps: dict):
     return template.substitute(key_val_maps)
 
 
-key_val_maps = dict(APP_NAME='Spyder', WINDOW_TITLE='Spyder', APP_NAME_LOWER='spyder')
+key_val_maps = dict(APP_NAME='Spyder', WINDOW_TITLE='Spyder', APP_NAME_LOWER='spyder',
+                    COMPRESSION='SetCompressor lzma')
 
 installer = substitute('bibiinstaller.nsi', key_val_maps)
 Path('application.nsi').write_text(installer, newline='\n')
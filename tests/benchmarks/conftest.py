@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic fixtures for the packaging pipeline benchmarks.
+
+Compare a run against the committed baseline, from the repository root:
+
+    pytest tests/benchmarks --benchmark-only --benchmark-storage=tests/benchmarks/baselines \\
+        --benchmark-compare='*/0001_baseline' --benchmark-compare-fail=mean:25%
+
+Baselines are stored in tests/benchmarks/baselines/<machine id>/, the option is passed on
+the command line so that pytest runs without pytest-benchmark installed; save one for
+another machine or after an intended change with:
+
+    pytest tests/benchmarks --benchmark-only --benchmark-storage=tests/benchmarks/baselines \\
+        --benchmark-save=baseline
+"""
+import random
+
+import pytest
+
+from ..conftest import write_wheel
+
+REQUIREMENTS_COUNT = 2000
+DIRECT_URL_RATIO = 0.1
+
+
+def synthetic_name(i):
+    # ''' mixed case, "-", "_" and "." exercise canonicalize_name '''
+    separator = ['-', '_', '.'][i % 3]
+    prefix = ['Py', 'py', 'PY'][i % 3]
+    return f'{prefix}{separator}package{separator}{i}'
+
+
+def synthetic_version(i):
+    return f'{i % 7}.{i % 13}.{i % 5}' if i % 4 else f'{i % 7}.{i % 13}.0'
+
+
+@pytest.fixture(scope='session', autouse=True)
+def quiet_logger():
+    from loguru import logger
+    logger.remove()
+    yield
+
+
+@pytest.fixture(scope='session')
+def freeze_lines():
+    '''
+    "pip freeze --all" output with name==version lines and "@" direct URLs.
+    '''
+    rng = random.Random(20240501)
+    lines = []
+    for i in range(REQUIREMENTS_COUNT):
+        name = synthetic_name(i)
+        if rng.random() < DIRECT_URL_RATIO:
+            if i % 2:
+                lines.append(f'{name} @ file:///D:/bld/{name}_1610324703282/work')
+            else:
+                lines.append(f'{name} @ git+https://github.com/owner/{name}@41b95ec')
+        else:
+            lines.append(f'{name}=={synthetic_version(i)}')
+    return lines
+
+
+@pytest.fixture(scope='session')
+def wheel_filenames():
+    '''
+    Wheel filenames for about 90% of the requirements, as pip download would leave them.
+    '''
+    filenames = []
+    for i in range(REQUIREMENTS_COUNT):
+        if i % 10 == 9:
+            continue
+        name = synthetic_name(i).replace('-', '_').replace('.', '_')
+        tags = 'py3-none-any' if i % 2 else 'cp311-cp311-win_amd64'
+        filenames.append(f'{name}-{synthetic_version(i)}-{tags}.whl')
+    return filenames
+
+
+@pytest.fixture()
+def download_dir(tmp_path, wheel_filenames, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    pip_download_dir = tmp_path / 'pip_download_only_binaries'
+    pip_download_dir.mkdir()
+    for filename in wheel_filenames:
+        write_wheel(pip_download_dir / filename)
+    return pip_download_dir
+
+
+@pytest.fixture()
+def offline_pipeline(monkeypatch, freeze_lines):
+    '''
+    No subprocesses: pip freeze returns freeze_lines, pip download and ResourceHacker do nothing.
+    '''
+    from bibiinstaller import bibiinstaller_windows
+    monkeypatch.setattr(bibiinstaller_windows, 'pip_freeze', lambda python, encoding='latin1': list(freeze_lines))
+    monkeypatch.setattr(bibiinstaller_windows, 'subprocess_run', lambda args, exit=True: 0)
+    monkeypatch.setattr(bibiinstaller_windows, 'change_exe_icon',
+                        lambda work_dir, package_name, icon_file: f'{work_dir}/windows_assets/{package_name}.exe')
+    return bibiinstaller_windows
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+makensis time and installer size per compression profile, with the distro makensis.
+
+The payload mixes incompressible binaries, repetitive Python sources and
+duplicated DLLs, like a staged pynsist_pkgs. The installer size of every
+profile is recorded in the benchmark's extra_info:
+
+    pytest tests/benchmarks/test_bench_compression.py --benchmark-only --benchmark-columns=mean,rounds
+"""
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from bibiinstaller.bibiinstaller_nsis import COMPRESSION_PROFILES, compression_directives  # noqa: E402
+
+MAKENSIS = shutil.which('makensis')
+if MAKENSIS is None:
+    pytest.skip('makensis is not in PATH', allow_module_level=True)
+
+NSI_TEMPLATE = """{directives}
+Unicode true
+RequestExecutionLevel user
+OutFile "{out_file}"
+InstallDir "$TEMP\\bench_app"
+Section
+  SetOutPath "$INSTDIR"
+  File /r "{payload_dir}/*"
+SectionEnd
+"""
+
+
+@pytest.fixture(scope='module')
+def payload_dir(tmp_path_factory):
+    rng = random.Random(20240601)
+    payload_dir = tmp_path_factory.mktemp('pynsist_pkgs')
+    for i in range(8):
+        package_dir = payload_dir / f'package_{i}'
+        package_dir.mkdir()
+        (package_dir / f'_core_{i}.pyd').write_bytes(rng.randbytes(512 * 1024))
+        for j in range(100):
+            (package_dir / f'module_{j}.py').write_text(f'def f_{j}(x):\n    return x * {j}\n' * 200,
+                                                        encoding='utf8')
+        (package_dir / 'vcruntime140.dll').write_bytes(random.Random(140).randbytes(128 * 1024))
+    return payload_dir
+
+
+@pytest.mark.parametrize('compression, dict_size', [
+    ('none', None), ('zlib', None), ('lzma', None), ('lzma-solid', None), ('lzma-solid', 64)])
+def test_makensis_compression(benchmark, tmp_path, payload_dir, compression, dict_size):
+    assert compression in COMPRESSION_PROFILES
+    out_file = tmp_path / 'bench_app.exe'
+    nsi_file = tmp_path / 'installer.nsi'
+    nsi_file.write_text(NSI_TEMPLATE.format(directives=compression_directives(compression, dict_size),
+                                            out_file=out_file, payload_dir=payload_dir), encoding='utf8')
+
+    def run():
+        subprocess.run([MAKENSIS, '-V1', str(nsi_file)], check=True, env=dict(os.environ, LANG='C'))
+
+    benchmark.pedantic(run, rounds=3)
+    payload_size = sum(f.stat().st_size for f in payload_dir.rglob('*') if f.is_file())
+    benchmark.extra_info.update(output_size=out_file.stat().st_size, payload_size=payload_size)
+    assert out_file.stat().st_size > 0
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmarks of run_installer on the simulated toolchain.
+
+The fake micromamba, venv, pip, ResourceHacker and makensis keep the same
+files on disk as the real tools, so the orchestration and copy stages are
+timed deterministically on Linux. Tool latency is zero by default, raise it
+with BIBIINSTALLER_SIMULATOR_LATENCY (seconds per tool call).
+"""
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+if os.name != 'posix':
+    pytest.skip('the simulated toolchain runs on POSIX only', allow_module_level=True)
+
+from bibiinstaller import bibiinstaller_windows as bw  # noqa: E402
+from bibiinstaller.bibiinstaller_simulator import TOOLS  # noqa: E402
+from bibiinstaller import bibiinstaller_toolchain  # noqa: E402
+
+EXAMPLE_PROJECT = Path(__file__).parents[2] / 'examples' / 'pyqt6_setup_py_example'
+LATENCY = float(os.environ.get('BIBIINSTALLER_SIMULATOR_LATENCY', '0'))
+PACKAGE_SIZE = 256 * 1024
+
+
+@pytest.fixture()
+def simulated(tmp_path, monkeypatch):
+    '''
+    A simulated toolchain, an empty cache home and a copy of the example project.
+    '''
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ.get('PATH', ''))
+    toolchain = bibiinstaller_toolchain.SimulatedToolchain(
+        tmp_path / 'simulator',
+        latency={tool: LATENCY for tool in TOOLS},
+        output_size={'package': PACKAGE_SIZE},
+        index={'PyQt6': {'version': '6.7.0', 'size': 4 * PACKAGE_SIZE}},
+    )
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain', toolchain)
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    return toolchain, project_root
+
+
+def installer_kwargs(project_root, is_wheel_first):
+    return dict(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        is_wheel_first=is_wheel_first, configs_py_file=project_root / 'bibiinstaller_configs.py',
+        files=[], extra_packages=[], editable_packages=[], unwanted_packages=[], skip_pypi_packages=[],
+    )
+
+
+def test_create_packaging_venv(benchmark, simulated, tmp_path):
+    def create():
+        work_dir = tmp_path / 'work'
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir()
+        return bw.create_packaging_venv(work_dir, '3.9.19', 'packaging-venv')
+
+    env_python = benchmark(create)
+    assert Path(env_python).exists()
+
+
+def test_prepare_nsis_plugins(benchmark, simulated, tmp_path):
+    benchmark.pedantic(bw.prepare_nsis_plugins, args=(tmp_path,), rounds=3)
+    assert (tmp_path / 'windows_assets' / 'nsis-3.10-win' / 'Plugins').is_dir()
+
+
+@pytest.mark.parametrize('is_wheel_first', [True, False])
+def test_run_installer(benchmark, simulated, is_wheel_first):
+    toolchain, project_root = simulated
+    kwargs = installer_kwargs(project_root, is_wheel_first)
+
+    state = benchmark.pedantic(bw.run_installer, kwargs=dict(kwargs, force=True), rounds=3)
+    installer_file = Path(state['destination_dir']) / state['installer_exe']
+    assert installer_file.name == 'pyqt6_example_64bit.exe'
+    assert installer_file.stat().st_size > 0
+    assert (Path(state['work_dir']) / 'build' / 'nsis' / 'pkgs' / 'PyQt6').is_dir()
+
+
+def test_run_installer_cache_hit(benchmark, simulated):
+    toolchain, project_root = simulated
+    kwargs = installer_kwargs(project_root, True)
+    bw.run_installer(**kwargs)
+    # ''' the very next build of the same inputs is restored, not rebuilt '''
+    assert bw.run_installer(**kwargs) is None
+
+    restored = benchmark(bw.run_installer, **kwargs)
+    assert restored is None
+    assert (project_root / 'dist' / 'pyqt6_example_64bit.exe').exists()
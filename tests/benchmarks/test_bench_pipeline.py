@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the pure-Python hot paths of bibiinstaller_windows.
+"""
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from bibiinstaller import bibiinstaller_windows as bw  # noqa: E402
+
+from .conftest import REQUIREMENTS_COUNT  # noqa: E402
+
+NSI_TEMPLATE = Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi'
+SETUP_PY_EXAMPLE = Path(__file__).parents[2] / 'examples' / 'pyqt6_setup_py_example' / 'setup.py'
+
+
+def test_canonicalize_requirement(benchmark, freeze_lines):
+    result = benchmark(lambda: [bw.canonicalize_requirement(r) for r in freeze_lines])
+    assert len(result) == REQUIREMENTS_COUNT
+
+
+def test_canonicalize_wheel_filename(benchmark, wheel_filenames):
+    result = benchmark(lambda: [bw.canonicalize_wheel_filename(f) for f in wheel_filenames])
+    assert len(result) == len(wheel_filenames)
+
+
+def test_separate_wheels_and_packages(benchmark, offline_pipeline, freeze_lines):
+    unwanted_packages = [bw.separate_package_name(r) for r in freeze_lines[::50]]
+    wanted, wheel, editable = benchmark(bw.separate_wheels_and_packages, 'python', unwanted_packages)
+    assert len(wheel) + len(editable) == REQUIREMENTS_COUNT
+    assert len(wanted) == REQUIREMENTS_COUNT - len(unwanted_packages)
+
+
+def test_separate_skip_pypi_wheels(benchmark, freeze_lines):
+    requirements_wheel = [r for r in freeze_lines if '@' not in r]
+    skip_pypi_wheels = [bw.separate_package_name(r) for r in requirements_wheel[::20]]
+    pypi, skip_pypi = benchmark(bw.separate_skip_pypi_wheels, requirements_wheel, skip_pypi_wheels)
+    assert len(pypi) + len(skip_pypi) == len(requirements_wheel)
+
+
+def test_pip_wheels_in(benchmark, offline_pipeline, download_dir, freeze_lines):
+    requirements_wheel = [r for r in freeze_lines if '@' not in r]
+    wheels, pip_download_dir = benchmark(bw.pip_wheels_in, download_dir.parent, 'python', requirements_wheel)
+    assert pip_download_dir == download_dir.resolve()
+    assert 0 < len(wheels) < len(requirements_wheel)
+
+
+def test_create_pynsist_cfg(benchmark, offline_pipeline, download_dir, freeze_lines, tmp_path):
+    pynsist_cfg = tmp_path / 'pynsist.cfg'
+    wheels, _ = bw.pip_wheels_in(tmp_path, 'python', [r for r in freeze_lines if '@' not in r])
+
+    def render():
+        return bw.create_pynsist_cfg(
+            tmp_path, tmp_path / 'pynsist_pkgs', 'python', '3.11.9', 64,
+            'bench_app', '1.0.0', 'Bench Author', tmp_path / 'bench_app-1.0.0.dist-info',
+            entrypoint='bench_app.main:main', package='bench_app',
+            unwanted_packages=[], skip_pypi_packages=[],
+            icon_file='bench_app.ico', license_file='license.txt', asset_path=None,
+            pynsist_config_file=pynsist_cfg, files=['data_dir'], excludes=['pkgs/bench_app/tests'],
+            is_wheel_first=True)
+
+    installer_exe = benchmark(render)
+    assert installer_exe == 'bench_app_64bit.exe'
+    # ''' every downloaded wheel is unpacked into pynsist_pkgs, none is left to pynsist '''
+    pynsist_pkgs = tmp_path / 'pynsist_pkgs'
+    staged = sorted(p.name for p in pynsist_pkgs.glob('*.dist-info'))
+    assert len(staged) == len(wheels) > 0
+    assert all((pynsist_pkgs / name.split('-')[0] / '__init__.py').is_file() for name in staged)
+    assert 'pypi_wheels=\n' in pynsist_cfg.read_text(encoding='latin1')
+
+
+def test_read_setup_py_info(benchmark, tmp_path):
+    setup_py = tmp_path / 'setup.py'
+    keywords = '\n'.join(f"    keyword_{i}='value_{i}'," for i in range(REQUIREMENTS_COUNT))
+    setup_py.write_text(SETUP_PY_EXAMPLE.read_text(encoding='utf8') + f'\nsetup(\n{keywords}\n)\n', encoding='utf8')
+    setup_info = benchmark(bw.read_setup_py_info, setup_py)
+    assert setup_info['name'] == 'pyqt6_example'
+    assert setup_info[f'keyword_{REQUIREMENTS_COUNT - 1}'] == f'value_{REQUIREMENTS_COUNT - 1}'
+
+
+def test_update_application_nsi(benchmark, tmp_path):
+    application_nsi = tmp_path / 'application.nsi'
+    result = benchmark(bw.update_application_nsi, NSI_TEMPLATE, application_nsi, app_name='BenchApp')
+    assert result == application_nsi.resolve()
+    assert 'Start BenchApp' in application_nsi.read_text(encoding='utf8')
+
+
+@pytest.mark.parametrize('engine', ['copy_tree', 'shutil'])
+def test_copy_small_files(benchmark, tmp_path, engine):
+    import shutil
+    from bibiinstaller.bibiinstaller_copy import copy_tree
+    source_dir = tmp_path / 'site-packages'
+    for i in range(REQUIREMENTS_COUNT):
+        package_dir = source_dir / f'package_{i % 50}'
+        package_dir.mkdir(parents=True, exist_ok=True)
+        (package_dir / f'module_{i}.py').write_text(f'VALUE = {i}\n' * 64, encoding='utf8')
+    rounds = iter(range(1_000_000))
+
+    def run():
+        target_dir = tmp_path / f'pynsist_pkgs_{next(rounds)}'
+        if engine == 'shutil':
+            shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+        else:
+            copy_tree(source_dir, target_dir)
+        return target_dir
+
+    target_dir = benchmark.pedantic(run, rounds=5)
+    assert sum(1 for p in target_dir.rglob('*.py')) == REQUIREMENTS_COUNT
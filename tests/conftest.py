@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tests: wheels and installed distributions written by hand.
+"""
+import base64
+import hashlib
+import json
+import zipfile
+from pathlib import Path
+
+
+def record_hash(data):
+    return 'sha256=' + base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode()
+
+
+def write_wheel(wheel_file, files=None, requires=(), tamper=None, project_name=None):
+    '''
+    A wheel named like wheel_file, with files ({member: str or bytes}, default an empty <name>/__init__.py),
+    METADATA, WHEEL and a RECORD with sha256 and size. tamper replaces <name>/__init__.py after its hash is
+    recorded, project_name is the Name of METADATA when it is not the one of the filename.
+    '''
+    wheel_file = Path(wheel_file)
+    name, version = wheel_file.name.split('-')[:2]
+    tag = '-'.join(wheel_file.stem.split('-')[-3:])
+    dist_info = f'{name}-{version}.dist-info'
+    metadata = f'Metadata-Version: 2.1\nName: {project_name or name}\nVersion: {version}\n'
+    metadata += ''.join(f'Requires-Dist: {r}\n' for r in requires)
+    files = {f'{dist_info}/METADATA': metadata,
+             f'{dist_info}/WHEEL': f'Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: {tag}\n',
+             **(files if files is not None else {f'{name}/__init__.py': ''})}
+    files = {member: data.encode('utf8') if isinstance(data, str) else data for member, data in files.items()}
+    rows = [f'{member},{record_hash(data)},{len(data)}' for member, data in files.items()]
+    wheel_file.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(wheel_file, 'w') as z:
+        for member, data in files.items():
+            z.writestr(member, tamper if member == f'{name}/__init__.py' and tamper is not None else data)
+        z.writestr(f'{dist_info}/RECORD', '\n'.join(rows + [f'{dist_info}/RECORD,,']) + '\n')
+    return wheel_file
+
+
+def install_distribution(site_dir, name, version, files, direct_url=None):
+    '''
+    A distribution as pip installs it into site_dir: files ({path: text}), METADATA, INSTALLER, RECORD
+    and direct_url.json. RECORD also lists a .pyc and a script that are not written.
+    '''
+    site_dir = Path(site_dir)
+    dist_info = f'{name}-{version}.dist-info'
+    files = dict(files, **{f'{dist_info}/METADATA': f'Name: {name}\nVersion: {version}\n',
+                           f'{dist_info}/INSTALLER': 'pip\n'})
+    for rel_path, content in files.items():
+        (site_dir / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (site_dir / rel_path).write_text(content, encoding='utf8')
+    if direct_url is not None:
+        (site_dir / dist_info / 'direct_url.json').write_text(json.dumps(direct_url), encoding='utf8')
+    rows = [f'{rel_path},,{len(content)}' for rel_path, content in files.items()]
+    rows += [f'{name}/__pycache__/__init__.cpython-39.pyc,,', f'../../Scripts/{name}.exe,,', f'{dist_info}/RECORD,,']
+    (site_dir / dist_info / 'RECORD').write_text('\n'.join(rows) + '\n', encoding='utf8')
+    return site_dir / dist_info
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Installer backends (pip, uv) against a local wheel directory, no network.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bibiinstaller import bibiinstaller_backend
+from bibiinstaller import bibiinstaller_windows as bw
+
+from .conftest import write_wheel
+
+
+@pytest.fixture(scope='module')
+def wheel_dir(tmp_path_factory):
+    wheel_dir = tmp_path_factory.mktemp('wheels')
+    write_wheel(wheel_dir / 'demo_app-0.1.0-py3-none-any.whl', {'demo_app.py': '__version__ = "0.1.0"\n'},
+                requires=['demo-dep>=0.2'], project_name='demo-app')
+    write_wheel(wheel_dir / 'demo_dep-0.2.0-py3-none-any.whl', {'demo_dep.py': '__version__ = "0.2.0"\n'},
+                project_name='demo-dep')
+    return wheel_dir
+
+
+@pytest.fixture(scope='module')
+def venv_python(tmp_path_factory):
+    venv_dir = tmp_path_factory.mktemp('venv')
+    subprocess.run([sys.executable, '-m', 'venv', venv_dir], check=True)
+    return venv_dir / ('Scripts/python.exe' if os.name == 'nt' else 'bin/python')
+
+
+def uv_available():
+    try:
+        bibiinstaller_backend.find_uv_exe()
+        return True
+    except SystemExit:
+        return False
+
+
+@pytest.fixture(params=['pip', pytest.param('uv', marks=pytest.mark.skipif(not uv_available(),
+                                                                              reason='uv not installed'))])
+def backend(request, wheel_dir, monkeypatch):
+    backend = bibiinstaller_backend.create_backend(request.param, find_links=wheel_dir)
+    monkeypatch.setattr(bibiinstaller_backend, '_backend', backend)
+    return backend
+
+
+def test_install_freeze_uninstall(backend, venv_python):
+    assert bw.subprocess_run(backend.pip_command(venv_python, 'install', 'demo-app',
+                                                 '--no-warn-script-location'), exit=False) == 0
+    wanted, wheel, editable = bw.separate_wheels_and_packages(venv_python, ['demo-dep'])
+    assert 'demo-app==0.1.0' in wanted
+    assert 'demo-dep==0.2.0' in wheel and 'demo-dep==0.2.0' not in wanted
+    assert editable == []
+
+    assert bw.subprocess_run(backend.pip_command(venv_python, 'uninstall', '-y', 'demo-app', 'demo-dep'),
+                             exit=False) == 0
+    assert not any(r.startswith('demo-') for r in bw.pip_freeze(venv_python))
+
+
+def test_pip_wheels_in(backend, venv_python, tmp_path):
+    wheels, pip_download_dir = bw.pip_wheels_in(tmp_path, venv_python, ['demo-app==0.1.0'])
+    assert wheels == ['demo-app==0.1.0']
+    assert sorted(f.name for f in pip_download_dir.glob('*.whl')) == [
+        'demo_app-0.1.0-py3-none-any.whl', 'demo_dep-0.2.0-py3-none-any.whl']
+
+
+def test_uv_drops_pip_only_options(tmp_path):
+    backend = bibiinstaller_backend.UvBackend(find_links=tmp_path, uv_exe='uv')
+    command = backend.pip_command('python.exe', 'install', '--upgrade', 'pip', '--no-warn-script-location')
+    assert command == ['uv', 'pip', 'install', '--python', 'python.exe', '--upgrade', 'pip',
+                       '--no-index', '--find-links', str(tmp_path.resolve())]
+    assert backend.pip_command('python.exe', 'download', 'pip')[:3] == ['python.exe', '-m', 'pip']
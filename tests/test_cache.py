@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Reusable work dirs and the garbage collector of the cache.
+"""
+import json
+import os
+import time
+
+import pytest
+
+from bibiinstaller import bibiinstaller_cache as bc
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.delenv(bc.MAX_AGE_DAYS_ENV, raising=False)
+    monkeypatch.delenv(bc.MAX_SIZE_ENV, raising=False)
+    return tmp_path / 'cache'
+
+
+def make_work_dir(key, size, days_ago=0):
+    work_dir, lock = bc.open_work_dir(key, '/project')
+    (work_dir / 'payload.bin').write_bytes(b'\0' * size)
+    bc.record_work_dir(work_dir)
+    lock.release()
+    work_json = work_dir / bc.WORK_JSON
+    work = json.loads(work_json.read_text(encoding='utf8'))
+    work['last_used'] -= days_ago * 24 * 3600
+    work_json.write_text(json.dumps(work), encoding='utf8')
+    return work_dir
+
+
+def test_work_dir_is_reused():
+    work_dir = make_work_dir('key', 10)
+    reused_dir, lock = bc.open_work_dir('key', '/project')
+    lock.release()
+    assert reused_dir == work_dir and (reused_dir / 'payload.bin').exists()
+
+
+def test_work_dir_key_ignores_the_checkout(tmp_path):
+    from bibiinstaller.bibiinstaller_windows import compute_work_dir_key
+    for checkout in ('a', 'b'):
+        (tmp_path / checkout).mkdir()
+        (tmp_path / checkout / 'setup.py').write_text("setup(name='app', version='0.1')\n", encoding='utf8')
+    keys = [compute_work_dir_key('3.9.19', 64, 'app', tmp_path / checkout) for checkout in ('a', 'b')]
+    assert keys[0] == keys[1]
+    # ''' an editable install points into one checkout '''
+    assert (compute_work_dir_key('3.9.19', 64, 'app', tmp_path / 'a', editable_packages=['.'])
+            != compute_work_dir_key('3.9.19', 64, 'app', tmp_path / 'b', editable_packages=['.']))
+    (tmp_path / 'b' / 'setup.py').write_text("setup(name='app', version='0.2')\n", encoding='utf8')
+    assert compute_work_dir_key('3.9.19', 64, 'app', tmp_path / 'b') != keys[0]
+
+
+def test_collect_garbage_age_and_size():
+    old = make_work_dir('old', 100, days_ago=40)
+    recent = make_work_dir('recent', 300, days_ago=2)
+    newest = make_work_dir('newest', 300)
+
+    assert [e.path for e in bc.collect_garbage(dry_run=True)] == [old]
+    assert [e.path for e in bc.collect_garbage(max_size='500', dry_run=True)] == [old, recent]
+    assert [e.path for e in bc.collect_garbage(max_size='500')] == [old, recent]
+    assert not old.exists() and not recent.exists() and newest.exists()
+
+
+def test_collect_garbage_skips_locked_work_dir():
+    work_dir = make_work_dir('busy', 100, days_ago=40)
+    _, lock = bc.open_work_dir('busy', '/project')
+    try:
+        assert bc.collect_garbage() == []
+    finally:
+        lock.release()
+    assert [e.path for e in bc.collect_garbage()] == [work_dir]
+
+
+def test_collect_garbage_counts_removed_entries_only():
+    busy = make_work_dir('busy', 300, days_ago=3)
+    middle = make_work_dir('middle', 300, days_ago=2)
+    newest = make_work_dir('newest', 100)
+    _, lock = bc.open_work_dir('busy', '/project')
+    try:
+        # ''' the locked work dir still takes its space, the next one goes instead '''
+        assert [e.path for e in bc.collect_garbage(max_size='700')] == [middle]
+    finally:
+        lock.release()
+    assert busy.exists() and newest.exists()
+
+
+def test_collect_garbage_keeps_shared_entries_while_building(tmp_path):
+    installer_file = tmp_path / 'app_64bit.exe'
+    installer_file.write_bytes(b'MZ')
+    pynsist_cfg = tmp_path / 'pynsist.cfg'
+    pynsist_cfg.write_text('[Application]\n', encoding='utf8')
+    artifact_dir = bc.store_artifact('fingerprint', installer_file, pynsist_cfg)
+    work_dir, lock = bc.open_work_dir('building', '/project')
+    try:
+        assert bc.collect_garbage(max_age_days=0, max_size=0) == []
+        assert [e.path for e in bc.collect_garbage(max_age_days=0, max_size=0, current_work_dir=work_dir)] == [
+            artifact_dir]
+    finally:
+        lock.release()
+
+
+def test_dir_size_counts_hardlinks_once(tmp_path):
+    from bibiinstaller.bibiinstaller_objects import stage_paths
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'file.bin').write_bytes(b'\0' * 1000)
+    (tmp_path / 'b').mkdir()
+    os.link(tmp_path / 'a' / 'file.bin', tmp_path / 'b' / 'file.bin')
+    seen = set()
+    assert bc.dir_size(tmp_path / 'a', seen) + bc.dir_size(tmp_path / 'b', seen) == 1000
+    assert bc.dir_size(tmp_path / 'b') == 1000
+
+    # ''' files linked to the object store count there, not in the entry '''
+    work_dir, lock = bc.open_work_dir('staged', '/project')
+    lock.release()
+    store = stage_paths([tmp_path / 'a'], work_dir / 'pkgs')
+    (entry,) = bc.list_cache_entries(kinds=('work',))
+    expected = (work_dir / bc.WORK_JSON).stat().st_size + (1000 if store.counts['reflink'] else 0)
+    assert entry.size == expected
+
+
+def test_publish_entry(tmp_path):
+    entry_dir = tmp_path / 'entries' / 'key'
+    (entry_dir / 'partial').mkdir(parents=True)
+    tmp_dir = tmp_path / 'entries' / 'key.tmp-1'
+    tmp_dir.mkdir()
+    (tmp_dir / 'entry.json').write_text('{}', encoding='utf8')
+    # ''' an incomplete entry is replaced, a complete one is kept '''
+    assert bc.publish_entry(tmp_dir, entry_dir, 'entry.json')
+    assert (entry_dir / 'entry.json').exists() and not (entry_dir / 'partial').exists()
+    tmp_dir.mkdir()
+    assert not bc.publish_entry(tmp_dir, entry_dir, 'entry.json')
+    assert not tmp_dir.exists() and (entry_dir / 'entry.json').exists()
+
+
+def test_artifact_last_used_on_restore(tmp_path):
+    installer_file = tmp_path / 'app_64bit.exe'
+    installer_file.write_bytes(b'MZ')
+    pynsist_cfg = tmp_path / 'pynsist.cfg'
+    pynsist_cfg.write_text('[Application]\n', encoding='utf8')
+    artifact_dir = bc.store_artifact('fingerprint', installer_file, pynsist_cfg)
+    old = time.time() - 40 * 24 * 3600
+    os.utime(artifact_dir / bc.ARTIFACT_JSON, (old, old))
+    assert bc.restore_artifact('fingerprint', tmp_path / 'dist') is not None
+    assert bc.collect_garbage() == []
+
+
+@pytest.mark.parametrize('size, expected', [('20G', 20 * 1024 ** 3), ('512M', 512 * 1024 ** 2),
+                                            ('1.5KiB', 1536), ('100', 100), (42, 42)])
+def test_parse_size(size, expected):
+    assert bc.parse_size(size) == expected
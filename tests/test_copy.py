@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Copy engine: trees, metadata and the fallbacks of the kernel copy methods.
+"""
+import errno
+import os
+
+import pytest
+
+from bibiinstaller import bibiinstaller_copy as bcopy
+
+
+@pytest.fixture()
+def source_dir(tmp_path):
+    source_dir = tmp_path / 'assets'
+    for i in range(20):
+        sub_dir = source_dir / f'dir_{i % 4}' / f'sub_{i % 3}'
+        sub_dir.mkdir(parents=True, exist_ok=True)
+        (sub_dir / f'file_{i}.txt').write_text(f'file {i}\n' * i, encoding='utf8')
+    (source_dir / 'big.bin').write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    (source_dir / 'empty').mkdir()
+    old = 1_600_000_000
+    os.utime(source_dir / 'big.bin', (old, old))
+    return source_dir
+
+
+def tree(root):
+    return {p.relative_to(root).as_posix(): (p.read_bytes() if p.is_file() else None) for p in root.rglob('*')}
+
+
+def test_copy_tree(source_dir, tmp_path):
+    target_dir = tmp_path / 'pynsist_pkgs'
+    stats = bcopy.copy_tree(source_dir, target_dir, max_workers=4)
+    assert tree(target_dir) == tree(source_dir)
+    assert stats.files == 21 and stats.bytes == sum(p.stat().st_size for p in source_dir.rglob('*') if p.is_file())
+    assert (target_dir / 'big.bin').stat().st_mtime == 1_600_000_000
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'sendfile'])
+def test_copy_file_falls_back(source_dir, tmp_path, monkeypatch, method):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    if not hasattr(os, method):
+        pytest.skip(f'no os.{method}')
+    monkeypatch.setattr(bcopy, '_kernel_copy', {**dict(copy_file_range=False, sendfile=False), method: True})
+    monkeypatch.setattr(os, method, unsupported)
+    target = bcopy.copy(source_dir / 'big.bin', tmp_path)
+    assert target.read_bytes() == (source_dir / 'big.bin').read_bytes()
+    assert not bcopy._kernel_copy[method]
+
+
+def test_copy_file_buffered(source_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(bcopy, '_kernel_copy', dict(copy_file_range=False, sendfile=False))
+    monkeypatch.setattr(bcopy, 'COPY_BUFFER_SIZE', 1000)
+    target = tmp_path / 'big.bin'
+    assert bcopy.copy_file(source_dir / 'big.bin', target) == target.stat().st_size
+    assert target.read_bytes() == (source_dir / 'big.bin').read_bytes()
+
+
+def test_copy_tree_small_files_in_calling_thread(source_dir, tmp_path, monkeypatch):
+    submitted = []
+    submit = bcopy.ThreadPoolExecutor.submit
+    monkeypatch.setattr(bcopy.ThreadPoolExecutor, 'submit',
+                        lambda pool, fn, rel_path: submitted.append(rel_path) or submit(pool, fn, rel_path))
+    bcopy.copy_tree(source_dir, tmp_path / 'pynsist_pkgs', max_workers=4)
+    assert submitted == (['big.bin'] if (os.cpu_count() or 1) > 1 else [])
+    submitted.clear()
+    assert bcopy.copy_tree(source_dir, tmp_path / 'single', max_workers=1).files == 21 and submitted == []
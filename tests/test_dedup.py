@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Duplicate binaries of the staged payload: report and collapse.
+"""
+import json
+import os
+import zipfile
+
+import pytest
+
+from bibiinstaller import bibiinstaller_dedup as bd
+
+
+@pytest.fixture()
+def payload_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    payload_dir = tmp_path / 'pynsist_pkgs'
+    runtime = os.urandom(4096)
+    files = {
+        'PyQt6/Qt6/bin/vcruntime140.dll': runtime,
+        'numpy.libs/vcruntime140.dll': runtime,
+        'scipy.libs/VCRUNTIME140.dll': runtime,
+        'numpy.libs/libopenblas.abc.dll': b'openblas' * 512,
+        'scipy.libs/libopenblas.def.dll': b'openblas' * 512,
+        'numpy/core/_multiarray.pyd': b'pyd' * 1000,
+        'numpy/core/data.bin': b'pyd' * 1000,
+        'app/__init__.py': b'',
+    }
+    for rel_path, content in files.items():
+        (payload_dir / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (payload_dir / rel_path).write_bytes(content)
+    return payload_dir
+
+
+def test_find_duplicate_binaries(payload_dir):
+    groups = bd.find_duplicate_binaries(payload_dir, max_workers=2)
+    assert [(g.names, len(g.paths), g.is_safe()) for g in groups] == [
+        (['vcruntime140.dll'], 3, True),
+        (['libopenblas.abc.dll', 'libopenblas.def.dll'], 2, False),
+    ]
+    assert groups[0].wasted == 2 * 4096
+
+
+def test_dedup_payload_collapse(payload_dir, tmp_path):
+    files = bd.dedup_payload(payload_dir, tmp_path, mode='collapse')
+    shared_file = tmp_path / bd.SHARED_DIR_NAME / 'vcruntime140.dll'
+    assert files == [f'{shared_file} > {bd.PYTHON_INSTALL_DIR}']
+    assert shared_file.exists()
+    assert sorted(p.name for p in payload_dir.rglob('*.[dD][lL][lL]')) == [
+        'libopenblas.abc.dll', 'libopenblas.def.dll']
+
+    report = json.loads((tmp_path / bd.PAYLOAD_REPORT).read_text(encoding='utf8'))
+    assert report['wasted_bytes'] == 2 * 4096 + 4096 and report['collapsed_bytes'] == 2 * 4096
+    assert [d['collapsed'] for d in report['duplicates']] == [True, False]
+
+
+def test_dedup_payload_keeps_embed_names(payload_dir, tmp_path):
+    # ''' the interpreter's own vcruntime140.dll is never replaced by a package's copy '''
+    embed_archive = tmp_path / 'python-3.9.13-embed-amd64.zip'
+    with zipfile.ZipFile(embed_archive, 'w') as z:
+        for name in ('python.exe', 'python39.dll', 'VCRUNTIME140.dll', 'vcruntime140_1.dll'):
+            z.writestr(name, b'MZ')
+    assert bd.embed_file_names(embed_archive) == {'python.exe', 'python39.dll', 'vcruntime140.dll',
+                                                  'vcruntime140_1.dll'}
+    assert bd.dedup_payload(payload_dir, tmp_path, mode='collapse', embed_archive=embed_archive) == []
+    assert len(list(payload_dir.rglob('*.[dD][lL][lL]'))) == 5
+    report = json.loads((tmp_path / bd.PAYLOAD_REPORT).read_text(encoding='utf8'))
+    assert report['collapsed_bytes'] == 0 and not any(d['collapsed'] for d in report['duplicates'])
+
+
+def test_dedup_payload_report_only(payload_dir, tmp_path):
+    assert bd.dedup_payload(payload_dir, tmp_path) == []
+    assert len(list(payload_dir.rglob('*.[dD][lL][lL]'))) == 5
+    assert bd.dedup_payload(payload_dir, tmp_path / 'off', mode='off') == []
+    assert not (tmp_path / 'off').exists()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Patch installers between two builds, and the base guard applying them.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from bibiinstaller import bibiinstaller_delta as bd
+from bibiinstaller import bibiinstaller_manifest as bm
+
+
+def write_build(work_dir, version, files, python_version='3.9.19'):
+    build_dir = work_dir / 'build' / 'nsis'
+    shutil.rmtree(build_dir / 'pkgs', ignore_errors=True)
+    for rel_path, content in files.items():
+        (build_dir / 'pkgs' / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (build_dir / 'pkgs' / rel_path).write_text(content, encoding='utf8')
+    (build_dir / 'installer.nsi').write_text(
+        f'!define PRODUCT_NAME "demo"\n!define PRODUCT_VERSION "{version}"\n!define BITNESS "64"\n', encoding='utf8')
+    bm.write_upgrade_files(build_dir, python_version)
+    return build_dir
+
+
+OLD_FILES = {'app/__init__.py': 'VERSION = 1\n', 'app/gone.py': 'GONE = 1\n', 'big/lib.pyd': 'x' * 100000}
+NEW_FILES = {'app/__init__.py': 'VERSION = 2\n', 'app/new.py': 'NEW = 1\n', 'big/lib.pyd': 'x' * 100000}
+
+
+@pytest.fixture()
+def builds(tmp_path):
+    old_build = write_build(tmp_path / 'old', '1.0', OLD_FILES)
+    new_build = write_build(tmp_path / 'new', '1.1', NEW_FILES)
+    return old_build, new_build
+
+
+def install_release(build_dir, install_dir):
+    shutil.copytree(build_dir / 'pkgs', install_dir / 'pkgs')
+    shutil.copy2(build_dir / bm.MANIFEST_NAME, install_dir)
+
+
+def apply_patch(patch_dir, install_dir, base):
+    '''
+    What the patch installer does: the guarded upgrade script, then pkgs and the manifest.
+    '''
+    code = subprocess.run([sys.executable, '-Es', str(patch_dir / bm.UPGRADE_SCRIPT_NAME), str(install_dir),
+                           str(patch_dir / bm.MANIFEST_NAME), '--base', base]).returncode
+    if code == 0:
+        shutil.copytree(patch_dir / 'pkgs', install_dir / 'pkgs', dirs_exist_ok=True)
+        shutil.copy2(patch_dir / bm.MANIFEST_NAME, install_dir)
+    return code
+
+
+def manifests(*build_dirs):
+    return [bm.read_manifest(build_dir / bm.MANIFEST_NAME) for build_dir in build_dirs]
+
+
+def tree(root):
+    return {p.relative_to(root).as_posix(): p.read_text(encoding='utf8') for p in root.rglob('*') if p.is_file()}
+
+
+def test_plan_delta(builds):
+    old_build, new_build = builds
+    delta = bd.plan_delta(*manifests(old_build, new_build))
+    assert (delta.added, delta.changed, delta.removed) == (['app/new.py'], ['app/__init__.py'], ['app/gone.py'])
+    assert delta.patch_bytes == 20 and delta.total_bytes == 100020
+
+
+def test_patch_applies_to_its_base_only(builds, tmp_path):
+    old_build, new_build = builds
+    base = bm.manifest_sha256(old_build / bm.MANIFEST_NAME)
+    delta = bd.plan_delta(*manifests(old_build, new_build))
+    patch_dir = bd.stage_patch(new_build, delta, new_build / bm.MANIFEST_NAME, tmp_path / 'patch')
+    assert sorted(tree(patch_dir / 'pkgs')) == ['app/__init__.py', 'app/new.py']
+
+    modified = tmp_path / 'modified'
+    install_release(old_build, modified)
+    (modified / 'pkgs' / 'big' / 'lib.pyd').write_text('y', encoding='utf8')
+    assert apply_patch(patch_dir, modified, base) == bm.EXIT_BASE_MISMATCH
+    assert (modified / 'pkgs' / 'app' / 'gone.py').exists()
+
+    other_base = tmp_path / 'other'
+    install_release(new_build, other_base)
+    assert apply_patch(patch_dir, other_base, base) == bm.EXIT_BASE_MISMATCH
+
+    installed = tmp_path / 'installed'
+    install_release(old_build, installed)
+    assert apply_patch(patch_dir, installed, base) == 0
+    assert tree(installed / 'pkgs') == NEW_FILES
+    assert bm.manifest_sha256(installed / bm.MANIFEST_NAME) == bm.manifest_sha256(new_build / bm.MANIFEST_NAME)
+
+
+def test_incompatible_builds(builds, tmp_path):
+    old_build, _ = builds
+    new_build = write_build(tmp_path / 'py310', '1.1', NEW_FILES, python_version='3.10.11')
+    with pytest.raises(SystemExit, match='CHANGED python'):
+        bd.make_patch(old_build, new_build, tmp_path / 'dist')
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_delta_command(builds, tmp_path, monkeypatch, capsys):
+    from bibiinstaller import bibiinstaller_toolchain
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    old_build, new_build = builds
+    (new_build.parents[1] / 'windows_assets' / 'nsis-3.10-win').mkdir(parents=True)
+    release_dir = tmp_path / 'releases' / '1.0'
+    release_dir.mkdir(parents=True)
+    shutil.copy2(old_build / bm.MANIFEST_NAME, release_dir / bm.release_manifest_name('demo_64bit.exe'))
+
+    assert bd.main(['--from', str(release_dir), '--to', str(new_build.parents[1]),
+                    '--dist', str(tmp_path / 'dist'), '--compression', 'lzma-solid']) == 0
+    patch_installer = tmp_path / 'dist' / 'demo_64bit_patch_1.0_to_1.1.exe'
+    assert capsys.readouterr().out.splitlines() == ['1 added, 1 changed, 1 removed, 20B of 97.7KB',
+                                                    str(patch_installer)]
+    assert patch_installer.is_file()
+    assert [p.name for p in (tmp_path / 'dist').iterdir()] == [patch_installer.name]
+
+
+def test_render_patch_nsi(builds, tmp_path):
+    old_build, new_build = builds
+    old, new = manifests(old_build, new_build)
+    nsi = bd.render_patch_nsi(tmp_path, old, new, old_build / bm.MANIFEST_NAME, 'demo_patch.exe',
+                              bd.Delta(removed=['app/gone.py']), compression='zlib').read_text(encoding='utf8')
+    assert f'!define BASE_MANIFEST_SHA256 "{bm.manifest_sha256(old_build / bm.MANIFEST_NAME)}"' in nsi
+    assert 'SetCompressor zlib' in nsi and 'File /r' not in nsi and '@' not in nsi
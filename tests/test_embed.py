@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Embeddable Python archive cache against a local python.org stand-in.
+"""
+import json
+import shutil
+
+import pytest
+
+from bibiinstaller import bibiinstaller_embed as be
+from bibiinstaller import bibiinstaller_toolchain
+from bibiinstaller.bibiinstaller_simulator import python_org_archive
+
+
+@pytest.fixture()
+def python_org(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain', bibiinstaller_toolchain.WindowsToolchain())
+    for version in ['3.9.13', '3.9.18', '3.10.11']:
+        python_org_archive(tmp_path, be.embed_filename(version, 64))
+    python_org_archive(tmp_path, be.embed_filename('3.9.18', 32))
+    python_org = tmp_path / 'python.org'
+    monkeypatch.setenv(be.PYTHON_FTP_ENV, python_org.as_uri())
+    return python_org
+
+
+def test_fetch_once_then_offline(python_org):
+    version, archive = be.get_embed('3.9', 64)
+    assert version == '3.9.18' and archive == be.get_embed_dir() / 'python-3.9.18-embed-amd64.zip'
+    record = json.loads((be.get_embed_dir() / be.EMBED_JSON).read_text(encoding='utf8'))[archive.name]
+    assert record['sha256'] == be.file_sha256(archive)
+
+    # ''' warm: no python.org at all '''
+    shutil.rmtree(python_org)
+    assert be.get_embed('3.9.19', 64) == (version, archive)
+    assert be.prefetch_embed('3.9', 32).result() == ('3.9', None)
+    assert be.pynsist_env()['PYNSIST_CACHE_DIR'] == str(be.get_embed_dir())
+
+
+def test_corrupt_archive_is_fetched_again(python_org):
+    archive = be.fetch_embed('3.10.11', 64)
+    archive.write_bytes(archive.read_bytes()[:-1] + b'!')
+    assert be.verified_archive('3.10.11', 64) is None
+    assert be.fetch_embed('3.10.11', 64) == archive
+    assert be.verified_archive('3.10.11', 64) == archive
+
+
+def test_invalid_archive_is_rejected(python_org):
+    (python_org / '3.9.13' / be.embed_filename('3.9.13', 32)).write_bytes(b'<html>not found</html>')
+    assert be.fetch_embed('3.9.13', 32) is None
+    assert be.cached_embed_versions('3.9', 32) == []
+
+
+def test_prune_embed(python_org):
+    from bibiinstaller.bibiinstaller_cache import collect_garbage
+    archive = be.fetch_embed('3.9.13', 64)
+    removed = collect_garbage(max_age_days=0, max_size=0)
+    assert [e.path for e in removed if e.kind == 'embed'] == [archive]
+    assert not archive.exists() and be.cached_embed_versions('3.9', 64) == []
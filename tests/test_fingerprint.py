@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Source tree fingerprints: gitignore rules, the digest cache and tree digests.
+"""
+import pytest
+
+from bibiinstaller import bibiinstaller_fingerprint as bf
+
+
+@pytest.mark.parametrize('pattern, rel_path, is_dir, ignored', [
+    ('a/*.txt', 'a/b.txt', False, True),
+    # ''' "*" stays within its segment '''
+    ('a/*.txt', 'a/b/c.txt', False, False),
+    ('*.txt', 'a/b/c.txt', False, True),
+    ('**/tmp/cache', 'tmp/cache', True, True),
+    ('**/tmp/cache', 'x/tmp/cache', True, True),
+    ('**/tmp/cache', 'x/y/tmp/cache', True, True),
+    ('**/tmp/cache', 'x/tmp/cache2', True, False),
+    ('docs/**/gen/', 'docs/gen', True, True),
+    ('docs/**/gen/', 'docs/a/b/gen', True, True),
+    ('docs/**/gen/', 'docs/a/b/gen', False, False),
+    ('logs/**', 'logs/a/b.log', False, True),
+    ('/build/', 'build', True, True),
+    ('/build/', 'src/build', True, False),
+    ('build/', 'src/build', True, True),
+    ('a?c', 'a/c', False, False),
+    ('[!x]y.log', 'ay.log', False, True),
+    ('[!x]y.log', 'xy.log', False, False),
+])
+def test_ignore_rules(pattern, rel_path, is_dir, ignored):
+    assert bf.IgnoreRules().extend([pattern]).is_ignored(rel_path, is_dir) is ignored
+
+
+def test_ignore_rules_negation_and_base():
+    rules = bf.IgnoreRules().extend(['*.log', '!keep.log', '# comment', ''])
+    assert rules.is_ignored('a/b.log', False) and not rules.is_ignored('a/keep.log', False)
+    rules = rules.extend(['/local.txt'], base='sub')
+    assert rules.is_ignored('sub/local.txt', False) and not rules.is_ignored('local.txt', False)
+    assert not rules.is_ignored('sub/deeper/local.txt', False)
+
+
+def test_fingerprint_tree(tmp_path):
+    root = tmp_path / 'project'
+    (root / 'a' / 'b').mkdir(parents=True)
+    (root / 'a' / 'top.txt').write_text('top', encoding='utf8')
+    (root / 'a' / 'b' / 'nested.txt').write_text('nested', encoding='utf8')
+    (root / 'sub').mkdir()
+    (root / 'sub' / '.gitignore').write_text('*.tmp\n', encoding='utf8')
+    (root / 'sub' / 'scratch.tmp').write_text('scratch', encoding='utf8')
+    (root / '__pycache__').mkdir()
+    (root / '__pycache__' / 'm.pyc').write_bytes(b'\0')
+
+    excludes = bf.DEFAULT_EXCLUDES + ['a/*.txt']
+    with bf.DigestCache(tmp_path / 'digests.json') as cache:
+        first = bf.fingerprint_tree(root, excludes=excludes, cache=cache)
+    assert sorted(first.files) == ['a/b/nested.txt', 'sub/.gitignore']
+    assert first.hashed_files == 2
+
+    # ''' unchanged files come from the persistent cache, a nested change changes the digest '''
+    with bf.DigestCache(tmp_path / 'digests.json') as cache:
+        assert bf.fingerprint_tree(root, excludes=excludes, cache=cache).digest == first.digest
+        (root / 'a' / 'b' / 'nested.txt').write_text('nested, changed', encoding='utf8')
+        second = bf.fingerprint_tree(root, excludes=excludes, cache=cache)
+    assert second.digest != first.digest and second.hashed_files == 1
+    (root / 'sub' / 'scratch.tmp').write_text('ignored change', encoding='utf8')
+    assert bf.fingerprint_tree(root, excludes=excludes).digest == second.digest
+
+
+def test_digest_cache(tmp_path):
+    file = tmp_path / 'file.bin'
+    file.write_bytes(b'content')
+    stat = file.stat()
+    cache = bf.DigestCache(tmp_path / 'digests.json').load()
+    assert cache.get(str(file), stat) is None
+    cache.put(str(file), stat, 'digest')
+    cache.save()
+    reloaded = bf.DigestCache(tmp_path / 'digests.json').load()
+    assert reloaded.get(str(file), stat) == 'digest'
+    file.write_bytes(b'other content')
+    assert reloaded.get(str(file), file.stat()) is None
+    (tmp_path / 'digests.json').write_text('not json', encoding='utf8')
+    assert bf.DigestCache(tmp_path / 'digests.json').load().entries == {}
+
+
+def test_digest_cache_drops_missing_paths(tmp_path):
+    kept, removed, other = (tmp_path / f'{name}.bin' for name in ('kept', 'removed', 'other'))
+    for file in (kept, removed, other):
+        file.write_bytes(file.name.encode())
+    with bf.DigestCache(tmp_path / 'digests.json') as cache:
+        for file in (kept, removed):
+            cache.put(str(file), file.stat(), file.name)
+    removed.unlink()
+    with bf.DigestCache(tmp_path / 'digests.json') as cache:
+        # ''' saved only when something changed '''
+        cache.put(str(other), other.stat(), other.name)
+    assert sorted(bf.DigestCache(tmp_path / 'digests.json').load().entries) == [str(kept), str(other)]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Index proxy, offline against a seeded directory: PEP 503/691 pages, Range requests and fetch dedup.
+"""
+import json
+import subprocess
+import sys
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bibiinstaller import bibiinstaller_backend
+from bibiinstaller import bibiinstaller_index as bix
+
+from .conftest import write_wheel
+
+
+def start_proxy(cache):
+    proxy = bix.IndexProxy(cache, '127.0.0.1', 0)
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+    return proxy
+
+
+@pytest.fixture()
+def seeded_proxy(tmp_path):
+    seed_dir = tmp_path / 'seed'
+    seed_dir.mkdir()
+    write_wheel(seed_dir / 'demo_app-0.1.0-py3-none-any.whl', {'demo_app.py': ''}, requires=['demo-dep>=0.2'])
+    write_wheel(seed_dir / 'demo_dep-0.2.0-py3-none-any.whl', {'demo_dep.py': ''})
+    cache = bix.IndexCache(tmp_path / 'index', offline=True)
+    assert cache.seed(seed_dir) == 2
+    proxy = start_proxy(cache)
+    yield proxy
+    proxy.shutdown()
+    proxy.server_close()
+
+
+def get(url, **headers):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+        return response.status, dict(response.headers), response.read()
+
+
+def test_simple_pages(seeded_proxy):
+    status, headers, body = get(seeded_proxy.url)
+    assert status == 200 and b'/simple/demo-app/' in body and b'/simple/demo-dep/' in body
+
+    status, headers, body = get(seeded_proxy.url + 'Demo_App/', Accept=bix.SIMPLE_JSON)
+    page = json.loads(body)
+    assert headers['Content-Type'] == bix.SIMPLE_JSON and page['name'] == 'demo-app'
+    assert [(f['filename'], f['url']) for f in page['files']] == [
+        ('demo_app-0.1.0-py3-none-any.whl', '/files/demo-app/demo_app-0.1.0-py3-none-any.whl')]
+    assert len(page['files'][0]['hashes']['sha256']) == 64
+
+    status, headers, body = get(seeded_proxy.url + 'demo-app/')
+    assert headers['Content-Type'].startswith('text/html')
+    assert b'href="/files/demo-app/demo_app-0.1.0-py3-none-any.whl#sha256=' in body
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(seeded_proxy.url + 'missing/')
+    assert e.value.code == 404
+
+
+def test_range_requests(seeded_proxy):
+    file_url = seeded_proxy.url.replace('/simple/', '/files/demo-dep/demo_dep-0.2.0-py3-none-any.whl')
+    _, _, whole = get(file_url)
+    status, headers, body = get(file_url, Range='bytes=10-19')
+    assert status == 206 and body == whole[10:20]
+    assert headers['Content-Range'] == f'bytes 10-19/{len(whole)}'
+    assert get(file_url, Range='bytes=-5')[2] == whole[-5:]
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(file_url, Range=f'bytes={len(whole)}-')
+    assert e.value.code == 416
+
+
+def test_path_traversal_is_rejected(seeded_proxy, tmp_path):
+    (tmp_path / 'secret.txt').write_text('secret', encoding='utf8')
+    files_url = seeded_proxy.url.replace('/simple/', '/files/')
+    for path in ['demo-dep/..%5C..%5C..%5Csecret.txt', '..%5C..%5C/secret.txt', 'demo-dep/C:%5Csecret.txt',
+                 'demo-dep/..']:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            get(files_url + path)
+        assert e.value.code == 400, path
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(seeded_proxy.url + '..%5C..%5Cpages/')
+    assert e.value.code == 400
+    cache = seeded_proxy.cache
+    assert cache.get_file('demo-dep', '../../../secret.txt') is None
+    assert cache.get_file('..', 'secret.txt') is None
+    assert cache.get_file('demo-dep', 'demo_dep-0.2.0-py3-none-any.whl') is not None
+
+
+def test_pip_download_through_proxy(seeded_proxy, tmp_path):
+    subprocess.run([sys.executable, '-m', 'pip', 'download', 'demo-app', '--dest', tmp_path / 'dest',
+                    '--index-url', seeded_proxy.url, '--no-cache-dir', '--disable-pip-version-check'],
+                   check=True, capture_output=True)
+    assert sorted(f.name for f in (tmp_path / 'dest').iterdir()) == [
+        'demo_app-0.1.0-py3-none-any.whl', 'demo_dep-0.2.0-py3-none-any.whl']
+
+
+def test_concurrent_fetches_are_deduplicated(seeded_proxy, tmp_path):
+    cache = bix.IndexCache(tmp_path / 'agent', upstream=seeded_proxy.url)
+    proxy = start_proxy(cache)
+    try:
+        file_url = proxy.url.replace('/simple/', '/files/demo-dep/demo_dep-0.2.0-py3-none-any.whl')
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            bodies = list(pool.map(lambda _: get(file_url)[2], range(8)))
+        assert len(set(bodies)) == 1 and bodies[0].startswith(b'PK')
+        assert cache.counts['file_fetches'] == 1 and seeded_proxy.cache.counts['file_hits'] == 1
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+
+
+def test_builds_use_running_proxy(seeded_proxy, tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.delenv(bix.INDEX_URL_ENV, raising=False)
+    monkeypatch.delenv(bibiinstaller_backend.FIND_LINKS_ENV, raising=False)
+    assert bix.get_index_url() is None
+    proxy_json = bix.get_proxy_json()
+    proxy_json.parent.mkdir(parents=True)
+    host, port = seeded_proxy.server_address[:2]
+    proxy_json.write_text(json.dumps(dict(url=seeded_proxy.url, host=host, port=port)), encoding='utf8')
+    backend = bibiinstaller_backend.create_backend('pip')
+    assert backend.pip_command('python', 'install', 'demo-app')[-2:] == ['--index-url', seeded_proxy.url]
+    assert backend.freeze_command('python')[-1] == '--all'
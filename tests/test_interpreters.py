@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+User-level interpreter cache on the simulated toolchain.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+if os.name != 'posix':
+    pytest.skip('the simulated toolchain runs on POSIX only', allow_module_level=True)
+
+from bibiinstaller import bibiinstaller_interpreters as bi  # noqa: E402
+from bibiinstaller import bibiinstaller_toolchain  # noqa: E402
+from bibiinstaller import bibiinstaller_windows as bw  # noqa: E402
+from bibiinstaller.bibiinstaller_cache import FileLock  # noqa: E402
+
+
+@pytest.fixture()
+def commands(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    commands = []
+    subprocess_run = bw.subprocess_run
+
+    def recording_subprocess_run(args, exit=True):
+        commands.append([str(a) for a in args])
+        return subprocess_run(args, exit=exit)
+
+    monkeypatch.setattr(bw, 'subprocess_run', recording_subprocess_run)
+    return commands
+
+
+def test_provision_python_is_cached(commands):
+    python_exe = bi.provision_python('3.9.19', 64)
+    assert python_exe == (bi.get_micromamba_root() / 'envs' / 'python_3.9_64bit' / 'python.exe').resolve()
+    assert bi.provision_python('3.9.7', 64) == python_exe
+    assert len(commands) == 1 and '--offline' not in commands[0]
+
+    bi.provision_python('3.9.19', 32)
+    assert commands[-1][-2:] == ['--platform', 'win-32']
+
+
+def test_provision_python_offline_from_package_cache(commands):
+    (bi.get_micromamba_root() / 'pkgs' / 'python-3.11.9-h631f459_0_cpython').mkdir(parents=True)
+    bi.provision_python('3.11', 64)
+    assert commands[-1][-1] == '--offline'
+
+
+def test_prune_interpreters(commands):
+    bi.provision_python('3.10', 64)
+    archive = bi.get_micromamba_root() / 'pkgs' / 'python-3.10.14-h4de0772_0_cpython.conda'
+    archive.parent.mkdir(parents=True)
+    archive.write_bytes(b'conda')
+    assert bi.prune_interpreters(days=1) == [archive]
+    assert bi.prune_interpreters(days=0) == [bi.get_micromamba_root() / 'envs' / 'python_3.10_64bit']
+
+
+def test_file_lock_is_exclusive(tmp_path):
+    events = []
+
+    def hold(name):
+        with FileLock(tmp_path / 'test.lock', poll_interval=0.01):
+            events.append(f'{name} in')
+            time.sleep(0.1)
+            events.append(f'{name} out')
+
+    threads = [threading.Thread(target=hold, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert events[1] == events[0].replace('in', 'out')
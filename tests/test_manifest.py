@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+pkgs manifest of the installer and the in-place upgrade it drives.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_manifest as bm
+
+NSI_TEMPLATE = Path(bm.__file__).parent / 'nsi_templates' / 'bibiinstaller.nsi'
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+def write_tree(root, files):
+    for rel_path, content in files.items():
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text(content, encoding='utf8')
+
+
+def install(build_dir, install_dir):
+    '''
+    What the installer does: upgrade script, pkgs with SetOverwrite off, then the manifest.
+    '''
+    code = subprocess.run([sys.executable, '-Es', str(build_dir / bm.UPGRADE_SCRIPT_NAME),
+                           str(install_dir), str(build_dir / bm.MANIFEST_NAME)]).returncode
+    if code != 0:
+        shutil.rmtree(install_dir / 'pkgs', ignore_errors=True)
+    shutil.copytree(build_dir / 'pkgs', install_dir / 'pkgs', dirs_exist_ok=True,
+                    copy_function=lambda src, dst: os.path.exists(dst) or shutil.copy2(src, dst))
+    shutil.copy2(build_dir / bm.MANIFEST_NAME, install_dir)
+    return code
+
+
+@pytest.fixture()
+def build_dir(tmp_path):
+    build_dir = tmp_path / 'build' / 'nsis'
+    write_tree(build_dir / 'pkgs', {
+        'app/__init__.py': 'VERSION = 1\n',
+        'app/core.py': 'CORE = 1\n',
+        'app/old/gone.py': 'GONE = 1\n',
+        'dep/data.bin': 'x' * 1000,
+    })
+    bm.write_upgrade_files(build_dir, '3.9.19')
+    return build_dir
+
+
+def test_build_manifest(build_dir):
+    manifest = json.loads((build_dir / bm.MANIFEST_NAME).read_text(encoding='utf8'))
+    assert manifest['python'] == '3.9.19'
+    assert sorted(manifest['files']) == ['app/__init__.py', 'app/core.py', 'app/old/gone.py', 'dep/data.bin']
+    assert manifest['files']['dep/data.bin'][1] == 1000
+    assert (build_dir / bm.UPGRADE_SCRIPT_NAME).read_text(encoding='utf8') == Path(bm.__file__).read_text(
+        encoding='utf8')
+
+
+def test_upgrade_writes_only_changed_files(build_dir, tmp_path):
+    install_dir = tmp_path / 'install'
+    assert install(build_dir, install_dir) == bm.EXIT_NO_MANIFEST
+    (install_dir / 'pkgs' / 'app' / 'old' / '__pycache__').mkdir()
+    (install_dir / 'pkgs' / 'app' / 'old' / '__pycache__' / 'gone.cpython-39.pyc').write_bytes(b'')
+    unchanged = (install_dir / 'pkgs' / 'dep' / 'data.bin').stat()
+
+    shutil.rmtree(build_dir / 'pkgs' / 'app' / 'old')
+    write_tree(build_dir / 'pkgs', {'app/core.py': 'CORE = 2\n', 'app/new.py': 'NEW = 1\n'})
+    bm.write_upgrade_files(build_dir, '3.9.19')
+    assert install(build_dir, install_dir) == 0
+
+    files = {p.relative_to(install_dir / 'pkgs').as_posix(): p.read_text(encoding='utf8')
+             for p in (install_dir / 'pkgs').rglob('*') if p.is_file()}
+    assert files == {p.relative_to(build_dir / 'pkgs').as_posix(): p.read_text(encoding='utf8')
+                     for p in (build_dir / 'pkgs').rglob('*') if p.is_file()}
+    assert not (install_dir / 'pkgs' / 'app' / 'old').exists()
+    assert (install_dir / 'pkgs' / 'dep' / 'data.bin').stat().st_mtime_ns == unchanged.st_mtime_ns
+
+
+def test_upgrade_falls_back(build_dir, tmp_path):
+    install_dir = tmp_path / 'install'
+    install(build_dir, install_dir)
+    installed = bm.read_manifest(install_dir / bm.MANIFEST_NAME)
+    # ''' a damaged file is written again '''
+    (install_dir / 'pkgs' / 'app' / 'core.py').write_text('CORE = 100\n', encoding='utf8')
+    assert bm.plan_upgrade(installed, installed, install_dir / 'pkgs') == (['app/core.py'], [])
+
+    bm.write_upgrade_files(build_dir, '3.10.11')
+    assert bm.upgrade(install_dir, build_dir / bm.MANIFEST_NAME) == bm.EXIT_PYTHON_CHANGED
+    (install_dir / bm.MANIFEST_NAME).write_text('{', encoding='utf8')
+    assert bm.upgrade(install_dir, build_dir / bm.MANIFEST_NAME) == bm.EXIT_NO_MANIFEST
+
+
+def test_template_names():
+    nsi = NSI_TEMPLATE.read_text(encoding='utf8')
+    assert f'!define PKGS_MANIFEST {bm.MANIFEST_NAME}' in nsi
+    assert f'!define UPGRADE_SCRIPT {bm.UPGRADE_SCRIPT_NAME}' in nsi
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_run_installer_writes_manifest(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    # ''' prepare_nsis_plugins appends the makensis dir to PATH '''
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    state = bw.run_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=NSI_TEMPLATE,
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+        editable_packages=[], unwanted_packages=[], skip_pypi_packages=[], force=True)
+    assert (project_root / 'dist' / state['installer_exe']).is_file()
+    nsis_build_dir = Path(state['work_dir']) / 'build' / 'nsis'
+    manifest = bm.read_manifest(nsis_build_dir / bm.MANIFEST_NAME)
+    assert manifest['python'] == state['python_version_embed']
+    assert sorted(manifest['files']) == sorted(p.relative_to(nsis_build_dir / 'pkgs').as_posix()
+                                               for p in (nsis_build_dir / 'pkgs').rglob('*') if p.is_file())
+    assert (nsis_build_dir / bm.UPGRADE_SCRIPT_NAME).is_file()
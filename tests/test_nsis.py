@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Compression profiles rendered into the nsi templates.
+"""
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_nsis as bn
+from bibiinstaller import bibiinstaller_windows as bw
+
+NSI_TEMPLATES = Path(bw.CONFIG_HOME) / 'nsi_templates'
+
+
+def compression_lines(nsi_file):
+    return [line for line in Path(nsi_file).read_text(encoding='utf8').splitlines()
+            if line.lstrip().lower().startswith('setcompress')]
+
+
+@pytest.mark.parametrize('compression, dict_size, expected', [
+    (None, None, ['SetCompressor lzma']),
+    ('none', None, ['SetCompress off']),
+    ('zlib', 64, ['SetCompressor zlib']),
+    ('lzma', 16, ['SetCompressor lzma', 'SetCompressorDictSize 16']),
+    ('lzma-solid', 64, ['SetCompressor /SOLID lzma', 'SetCompressorDictSize 64']),
+])
+def test_bundled_template(tmp_path, compression, dict_size, expected):
+    application_nsi = bw.update_application_nsi(NSI_TEMPLATES / 'bibiinstaller.nsi', tmp_path / 'app.nsi', 'Demo',
+                                                compression=compression, compression_dict_size=dict_size)
+    assert compression_lines(application_nsi) == expected
+    assert 'Start Demo' in application_nsi.read_text(encoding='utf8')
+
+
+def test_template_without_placeholder(tmp_path):
+    # ''' spyder.nsi is a rendered template: its SetCompressor line is replaced '''
+    application_nsi = bw.update_application_nsi(NSI_TEMPLATES / 'spyder.nsi', tmp_path / 'app.nsi', 'Demo',
+                                                compression='lzma-solid', compression_dict_size=32)
+    assert compression_lines(application_nsi) == ['SetCompressor /SOLID lzma', 'SetCompressorDictSize 32']
+    assert bn.render_compression('OutFile "a.exe"\n', 'SetCompress off') == 'SetCompress off\nOutFile "a.exe"\n'
+    nsi_text = '; SetCompressor zlib\nName "a"\nSetCompressor zlib\nOutFile "a.exe"\n'
+    assert bn.render_compression(nsi_text, 'SetCompress off') == (
+        '; SetCompressor zlib\nName "a"\nSetCompress off\nOutFile "a.exe"\n')
+
+
+def test_unknown_profile():
+    with pytest.raises(SystemExit):
+        bn.compression_directives('bzip3')
+    with pytest.raises(SystemExit):
+        bn.compression_directives('lzma', 0.5)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed staging: dedup, hardlinks and the copy fallback.
+"""
+import errno
+import os
+import shutil
+
+import pytest
+
+from bibiinstaller import bibiinstaller_objects as bo
+from bibiinstaller.bibiinstaller_fingerprint import DigestCache
+
+
+@pytest.fixture()
+def source_dir(tmp_path):
+    source_dir = tmp_path / 'site-packages'
+    (source_dir / 'app').mkdir(parents=True)
+    (source_dir / 'app' / '__init__.py').write_text('', encoding='utf8')
+    (source_dir / 'app' / 'main.py').write_text('print("app")\n', encoding='utf8')
+    (source_dir / 'lib').mkdir()
+    (source_dir / 'lib' / '__init__.py').write_text('', encoding='utf8')
+    (source_dir / 'lib' / 'data.bin').write_bytes(os.urandom(64 * 1024))
+    return source_dir
+
+
+@pytest.fixture()
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    store = bo.ObjectStore(cache=DigestCache(tmp_path / 'digests.json'))
+    store.reflink = False
+    return store
+
+
+def staged_files(target_dir):
+    return sorted(p.relative_to(target_dir).as_posix() for p in target_dir.rglob('*') if p.is_file())
+
+
+def test_stage_tree_dedups_and_hardlinks(store, source_dir, tmp_path):
+    target_dir = store.stage_tree(source_dir, tmp_path / 'pynsist_pkgs')
+    assert staged_files(target_dir) == staged_files(source_dir)
+    assert (target_dir / 'lib' / 'data.bin').read_bytes() == (source_dir / 'lib' / 'data.bin').read_bytes()
+    # ''' both empty __init__.py share one object '''
+    assert store.counts['stored'] == 3 and store.counts['hardlink'] == 4
+    assert os.stat(target_dir / 'app' / '__init__.py').st_nlink == 3
+
+    store.counts.clear()
+    store.stage_tree(source_dir, tmp_path / 'build')
+    assert store.counts['stored'] == 0 and store.counts['hardlink'] == 4
+
+
+def test_copy_fallback_across_devices(store, source_dir, tmp_path, monkeypatch):
+    def cross_device_link(source, target):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    monkeypatch.setattr(bo.os, 'link', cross_device_link)
+    target_dir = store.stage_tree(source_dir, tmp_path / 'pynsist_pkgs')
+    assert staged_files(target_dir) == staged_files(source_dir)
+    assert store.counts['copy'] == 4 and not store.hardlink
+    assert os.stat(target_dir / 'lib' / 'data.bin').st_nlink == 1
+
+
+def test_prune_objects(store, source_dir, tmp_path):
+    target_dir = store.stage_tree(source_dir, tmp_path / 'pynsist_pkgs')
+    assert bo.prune_objects(max_age_days=0) == (0, 0)
+    shutil.rmtree(target_dir)
+    removed, removed_bytes = bo.prune_objects(max_age_days=0)
+    assert removed == 3 and removed_bytes == 64 * 1024 + len('print("app")\n')
+
+
+def test_prune_objects_keeps_referenced_copies(store, source_dir, tmp_path):
+    from bibiinstaller.bibiinstaller_cache import object_stats
+    # ''' reflinked or copied targets leave the object at one link, like this copy '''
+    store.hardlink = False
+    with store:
+        target_dir = store.stage_tree(source_dir, tmp_path / 'pynsist_pkgs')
+    assert os.stat(target_dir / 'lib' / 'data.bin').st_nlink == 1
+    assert object_stats()[:3] == [3, 64 * 1024 + len('print("app")\n'), 0]
+    assert bo.prune_objects(max_age_days=0) == (0, 0)
+
+    (source_dir / 'lib' / 'data.bin').unlink()
+    with store:
+        other_dir = store.stage_tree(source_dir, tmp_path / 'build')
+    shutil.rmtree(target_dir)
+    assert object_stats()[2] == 1
+    assert bo.prune_objects(max_age_days=0) == (1, 64 * 1024)
+    shutil.rmtree(other_dir)
+    assert bo.prune_objects(max_age_days=0) == (2, len('print("app")\n'))
+    assert not list((tmp_path / 'cache' / 'objects' / bo.REFS_DIR_NAME).iterdir())
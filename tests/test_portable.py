@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Portable dir and zip output, planned from pynsist.cfg without NSIS.
+"""
+import os
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_portable as bp
+from bibiinstaller.bibiinstaller_simulator import python_org_archive
+
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+@pytest.fixture()
+def pynsist_cfg(tmp_path):
+    work_dir = tmp_path / 'work'
+    (work_dir / 'pynsist_pkgs' / 'demo_app' / 'tests').mkdir(parents=True)
+    (work_dir / 'pynsist_pkgs' / 'demo_app' / '__init__.py').write_text('VERSION = 1\n', encoding='utf8')
+    (work_dir / 'pynsist_pkgs' / 'demo_app' / 'tests' / 'test_app.py').write_text('', encoding='utf8')
+    # ''' the wheels, unpacked into pynsist_pkgs by create_pynsist_cfg '''
+    for rel_path, content in {'demo_dep/__init__.py': b'DEP = 2\n', '_demo_dep.pyd': b'MZ',
+                              'demo_dep-0.2.0.dist-info/RECORD': b'', 'demo_cli.py': b'CLI = 1\n'}.items():
+        (work_dir / 'pynsist_pkgs' / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (work_dir / 'pynsist_pkgs' / rel_path).write_bytes(content)
+    site_packages = work_dir / 'packaging-venv' / 'Lib' / 'site-packages'
+    (site_packages / 'demo_pkg').mkdir(parents=True)
+    (site_packages / 'demo_pkg' / '__init__.py').write_text('PKG = 3\n', encoding='utf8')
+    (work_dir / 'windows_assets').mkdir()
+    (work_dir / 'windows_assets' / 'demo.exe').write_bytes(b'MZ launcher')
+    (work_dir / 'shared').mkdir()
+    (work_dir / 'shared' / 'vcruntime140.dll').write_bytes(b'MZ runtime')
+    (tmp_path / 'demo.ico').write_bytes(b'\0\0\1\0')
+    pynsist_cfg = work_dir / 'pynsist.cfg'
+    pynsist_cfg.write_text(f"""
+[Application]
+name=demo
+version=1.0
+entry_point=demo_app.main:main
+icon={tmp_path / 'demo.ico'}
+
+[Python]
+version=3.9.19
+bitness=64
+format=bundled
+
+[Include]
+packages=demo-pkg
+files={work_dir / 'shared' / 'vcruntime140.dll'} > $INSTDIR\\Python
+    {work_dir / 'windows_assets' / 'demo.exe'}
+exclude=pkgs/demo_app/tests
+""", encoding='latin1')
+    embed_archive = python_org_archive(tmp_path, 'python-3.9.19-embed-amd64.zip')
+    return pynsist_cfg, embed_archive, site_packages
+
+
+def test_plan_portable(pynsist_cfg):
+    entries = bp.plan_portable(*pynsist_cfg)
+    assert sorted(e.arcname for e in entries) == [
+        'Python/python.exe', 'Python/python39._pth', 'Python/python39.dll', 'Python/python39.zip',
+        'Python/vcruntime140.dll', 'demo.exe', 'demo.ico', 'demo.launch.pyw',
+        'pkgs/_demo_dep.pyd', 'pkgs/demo_app/__init__.py', 'pkgs/demo_cli.py',
+        'pkgs/demo_dep-0.2.0.dist-info/RECORD', 'pkgs/demo_dep/__init__.py', 'pkgs/demo_pkg/__init__.py',
+    ]
+    entries = {e.arcname: e for e in entries}
+    assert entries['Python/python39._pth'].data.decode('utf8').splitlines()[-1] == '..\\pkgs'
+    assert 'from demo_app.main import main' in entries['demo.launch.pyw'].data.decode('utf8')
+
+
+def test_dir_and_zip_match(pynsist_cfg, tmp_path):
+    portable_dir = bp.assemble_portable(*pynsist_cfg, tmp_path / 'dist', 'demo_64bit', output='dir')
+    portable_zip = bp.assemble_portable(*pynsist_cfg, tmp_path / 'dist', 'demo_64bit', output='zip',
+                                        compression='zlib')
+    assert portable_zip.name == 'demo_64bit.zip'
+    files = {p.relative_to(portable_dir).as_posix(): p.read_bytes() for p in portable_dir.rglob('*') if p.is_file()}
+    with zipfile.ZipFile(portable_zip) as z:
+        assert z.testzip() is None
+        assert {name: z.read(name) for name in z.namelist()} == files
+        assert {i.compress_type for i in z.infolist()} == {zipfile.ZIP_DEFLATED}
+    assert sorted(p.name for p in (tmp_path / 'dist').iterdir()) == ['demo_64bit', 'demo_64bit.zip']
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_run_installer_skips_nsis(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    commands = []
+    subprocess_run = bw.subprocess_run
+
+    def recording_subprocess_run(args, exit=True, env=None):
+        commands.append(' '.join(str(a) for a in args))
+        return subprocess_run(args, exit=exit, env=env)
+
+    monkeypatch.setattr(bw, 'subprocess_run', recording_subprocess_run)
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    state = bw.run_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+        editable_packages=[], unwanted_packages=[], skip_pypi_packages=[], output='zip', force=True)
+    assert state['installer_exe'] == 'pyqt6_example_64bit.zip'
+    assert not any('nsist' in c or 'makensis' in c for c in commands)
+    with zipfile.ZipFile(project_root / 'dist' / 'pyqt6_example_64bit.zip') as z:
+        names = z.namelist()
+    assert {'Python/python.exe', 'pyqt6_example.exe', 'pyqt6_example.launch.pyw'} <= set(names)
+    assert any(n.startswith('pkgs/pyqt6_example/') for n in names)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution for the target platform, without a packaging venv.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_resolve as br
+
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+def test_platform_options():
+    assert br.platform_options('3.9.19', 64) == ['--platform', 'win_amd64', '--python-version', '3.9',
+                                                 '--implementation', 'cp', '--only-binary', ':all:']
+    assert br.platform_options('3.12', 32)[:4] == ['--platform', 'win32', '--python-version', '3.12']
+    assert br.check_project_wheel('app-1.0-py3-none-any.whl', 64) == 'app-1.0-py3-none-any.whl'
+    assert br.check_project_wheel('app-1.0-cp39-cp39-win32.whl', 32)
+    with pytest.raises(SystemExit, match='PLATFORM wheel'):
+        br.check_project_wheel('app-1.0-cp39-cp39-linux_x86_64.whl', 64)
+
+
+def test_missing_requirements(tmp_path):
+    from bibiinstaller.bibiinstaller_simulator import write_wheel
+    write_wheel(tmp_path, 'app', '1.0', 0, requires=[
+        'alpha>=1', 'pywin32>=306; sys_platform == "win32"', 'uvloop; sys_platform != "win32"',
+        'legacy; python_version < "3.10"', 'wow64; platform_machine == "x86"', 'docs; extra == "docs"'])
+    write_wheel(tmp_path, 'alpha', '1.0', 0)
+    environment = br.windows_environment('3.9.19', 64)
+    assert environment['python_full_version'] == '3.9.19' and environment['platform_machine'] == 'AMD64'
+    assert br.missing_requirements(tmp_path, environment) == {'pywin32': ['pywin32>=306'], 'legacy': ['legacy']}
+    assert sorted(br.missing_requirements(tmp_path, br.windows_environment('3.12', 32))) == ['pywin32', 'wow64']
+    # ''' requirements are walked with the target markers too, an extra brings in its Requires-Dist '''
+    assert br.missing_requirements(tmp_path, environment, ['app[docs]', 'uvloop; sys_platform != "win32"']) == {
+        'pywin32': ['pywin32>=306'], 'legacy': ['legacy'], 'docs': ['docs']}
+    with pytest.raises(SystemExit, match=r'CONFLICT \[alpha>=2\] with the downloaded alpha==1.0'):
+        br.missing_requirements(tmp_path, environment, ['alpha>=2'])
+
+
+def test_read_requirements_txt(tmp_path):
+    (tmp_path / 'base.txt').write_text('alpha>=1  # pinned later\n', encoding='utf8')
+    (tmp_path / 'requirements.txt').write_text(
+        '# tools\n--extra-index-url https://example.org/simple\n-r base.txt\n\n'
+        'beta; sys_platform == "win32"\ngamma \\\n    ==2.0\n', encoding='utf8')
+    assert br.read_requirements_txt(tmp_path / 'requirements.txt') == (
+        ['alpha>=1', 'beta; sys_platform == "win32"', 'gamma     ==2.0'],
+        ['--extra-index-url', 'https://example.org/simple'])
+
+
+def test_write_read_lock(tmp_path):
+    (tmp_path / 'alpha-1.0-py3-none-any.whl').write_bytes(b'alpha')
+    (tmp_path / 'beta-2.0-cp39-cp39-win_amd64.whl').write_bytes(b'beta')
+    wheels = {'beta==2.0': tmp_path / 'beta-2.0-cp39-cp39-win_amd64.whl',
+              'alpha==1.0': tmp_path / 'alpha-1.0-py3-none-any.whl'}
+    lock_file = br.write_lock(tmp_path / br.LOCK_NAME, wheels, header='app==0.1 for win_amd64')
+    lines = lock_file.read_text(encoding='utf8').splitlines()
+    assert lines[0] == '# bibiinstaller platform lock of app==0.1 for win_amd64'
+    assert lines[1:3] == ['alpha==1.0 \\',
+                          '    --hash=sha256:8ed3f6ad685b959ead7022518e1af76cd816f8e8ec7ccdda1ed4018e8f2223f8']
+    assert br.read_lock(lock_file) == ['alpha==1.0', 'beta==2.0']
+
+
+def test_check_staged_entrypoint(tmp_path):
+    (tmp_path / 'app' / 'gui').mkdir(parents=True)
+    (tmp_path / 'app' / 'gui' / 'main.py').write_text('', encoding='utf8')
+    assert br.check_staged_entrypoint(tmp_path, 'app.gui.main:main') == tmp_path / 'app' / 'gui' / 'main'
+    with pytest.raises(SystemExit, match='NOT FOUND entrypoint module'):
+        br.check_staged_entrypoint(tmp_path, 'app.cli:main')
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_platform_installer(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    index = {'PyQt6': {'version': '6.6.1', 'requires': ['PyQt6-Qt6', 'PyQt6-sip']},
+             # ''' dropped by pip on this host, required on Windows, then their own dependencies '''
+             'numpy': {'requires': ['colorama; os_name == "nt"']},
+             'colorama': {'version': '0.4.6', 'requires': ['pywin32; sys_platform == "win32"']},
+             # ''' asked for by pip on this host, never on Windows, no wheel to download '''
+             'PyQt6-Qt6': {'requires': ['hostonly; sys_platform != "win32"']}, 'hostonly': {'wheel': False}}
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator', index=index))
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    (project_root / 'extra_requirements.txt').write_text('requests==2.31.0\n', encoding='utf8')
+    state = bw.run_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[],
+        extra_requirements_txt_path=project_root / 'extra_requirements.txt', extra_packages=['numpy'],
+        editable_packages=[], unwanted_packages=['PyQt6-sip'], skip_pypi_packages=[],
+        resolution='platform', force=True)
+    work_dir = Path(state['work_dir'])
+    assert (Path(state['destination_dir']) / state['installer_exe']).stat().st_size > 0
+    assert not (work_dir / 'packaging-venv').exists()
+    assert br.read_lock(Path(state['destination_dir']) / 'pyqt6_example_64bit.lock') == [
+        'colorama==0.4.6', 'numpy==1.0.0', 'pyqt6==6.6.1', 'pyqt6-qt6==1.0.0', 'pywin32==1.0.0', 'requests==2.31.0']
+    pkgs = work_dir / 'build' / 'nsis' / 'pkgs'
+    assert (pkgs / 'PyQt6').is_dir() and (pkgs / 'pyqt6_example').is_dir() and (pkgs / 'numpy').is_dir()
+    assert not (pkgs / 'PyQt6_sip').exists()
+
+    with pytest.raises(SystemExit, match='need the packaging venv'):
+        bw.run_installer(
+            python_version='3.9.19', bitness=64, entrypoint='pyqt6_example.pyqt6_example_burning_widget:main',
+            package='pyqt6_setup_py_example', icon_path=project_root / 'pyqt6_example.png',
+            license_path=project_root / 'license.txt', project_root=project_root, editable_packages=['.'],
+            resolution='platform')
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Shared runtime layer and the thin installers built on it.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_runtime as br
+
+from .conftest import install_distribution
+
+NSI_TEMPLATE = Path(br.__file__).parent / 'nsi_templates' / 'bibiinstaller.nsi'
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+def test_drop_runtime_distributions(tmp_path):
+    site_dir = tmp_path / 'runtime' / 'site-packages'
+    install_distribution(site_dir, 'numpy', '1.0', {'numpy/__init__.py': 'NUMPY = 1\n', 'numpy/core.pyd': 'x'})
+    install_distribution(site_dir, 'qt', '6.0', {'qt/__init__.py': 'QT = 6\n'})
+    runtime = br.Runtime('py39-64bit-test', '3.9.19', 64, 'runtime.exe',
+                         distributions=br.distribution_digests(site_dir))
+    assert sorted(runtime.distributions) == ['numpy-1.0.dist-info', 'qt-6.0.dist-info']
+
+    nsis_build_dir = tmp_path / 'build' / 'nsis'
+    pkgs_dir = nsis_build_dir / 'pkgs'
+    shutil.copytree(site_dir, pkgs_dir)
+    (pkgs_dir / 'numpy' / '__pycache__').mkdir()
+    (pkgs_dir / 'numpy' / '__pycache__' / '__init__.cpython-39.pyc').write_bytes(b'')
+    # ''' pip writes REQUESTED for the packages asked for, the files are the same '''
+    (pkgs_dir / 'numpy-1.0.dist-info' / 'REQUESTED').write_text('', encoding='utf8')
+    (pkgs_dir / 'qt' / '__init__.py').write_text('QT = 6.1\n', encoding='utf8')
+    install_distribution(pkgs_dir, 'app', '0.1', {'app/__init__.py': 'APP = 1\n'})
+    (nsis_build_dir / 'Python').mkdir()
+
+    assert br.drop_runtime_distributions(nsis_build_dir, runtime) == ['numpy-1.0.dist-info']
+    assert sorted(p.name for p in pkgs_dir.iterdir()) == ['app', 'app-0.1.dist-info', 'qt', 'qt-6.0.dist-info']
+    assert not (nsis_build_dir / 'Python').exists()
+
+
+def test_runtime_id():
+    runtime_id = br.compute_runtime_id('3.9.19', 64, ['numpy', 'PyQt6==6.6.1'])
+    assert runtime_id.startswith('py39-64bit-')
+    assert runtime_id == br.compute_runtime_id('3.9.19', 64, ['PyQt6==6.6.1', 'numpy '])
+    assert runtime_id != br.compute_runtime_id('3.9.18', 64, ['numpy', 'PyQt6==6.6.1'])
+
+
+def test_template_links_runtime(tmp_path):
+    nsi = NSI_TEMPLATE.read_text(encoding='utf8')
+    assert f'!ifdef {br.RUNTIME_DEFINE}' in nsi and "mklink /J" in nsi
+    custom_template = tmp_path / 'custom.nsi'
+    custom_template.write_text('!define PRODUCT_NAME "[[ib.appname]]"\n', encoding='utf8')
+    with pytest.raises(SystemExit, match=br.RUNTIME_DEFINE):
+        br.check_template(custom_template)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_layered_installers(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    from bibiinstaller.bibiinstaller_manifest import MANIFEST_NAME, read_manifest
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+
+    def build(name, **kwargs):
+        project_root = tmp_path / name
+        if not project_root.exists():
+            shutil.copytree(EXAMPLE_PROJECT, project_root)
+        return project_root, bw.run_installer(
+            python_version='3.9.19', bitness=64,
+            entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+            icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+            project_root=project_root, nsi_template_path=NSI_TEMPLATE,
+            configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+            editable_packages=[], unwanted_packages=[], skip_pypi_packages=[], runtime_packages=['numpy'],
+            **kwargs)
+
+    project_root, state = build('first', force=True)
+    runtime = state['runtime']
+    assert (project_root / 'dist' / runtime.installer_exe).is_file()
+    assert 'numpy-1.0.0.dist-info' in runtime.distributions
+    nsis_build_dir = Path(state['work_dir']) / 'build' / 'nsis'
+    assert not (nsis_build_dir / 'Python').exists()
+    assert not any(f.startswith('numpy') for f in read_manifest(nsis_build_dir / MANIFEST_NAME)['files'])
+    built = runtime.installer_file.stat().st_mtime_ns
+
+    _, other = build('other', force=True)
+    assert other['runtime'].runtime_id == runtime.runtime_id
+    assert runtime.installer_file.stat().st_mtime_ns == built
+
+    # ''' the artifact brings its runtime installer, which is rebuilt once removed from the cache '''
+    build('first')
+    shutil.rmtree(project_root / 'dist')
+    assert build('first') == (project_root, None)
+    assert (project_root / 'dist' / runtime.installer_exe).is_file()
+    shutil.rmtree(runtime.runtime_dir)
+    _, state = build('first')
+    assert state is not None and state['runtime'].installer_file.is_file()
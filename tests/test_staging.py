@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Hybrid staging: the cheapest source of every distribution.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_staging as bs
+
+from .conftest import install_distribution, write_wheel
+
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+@pytest.fixture()
+def site_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    site_dir = tmp_path / 'site-packages'
+    install_distribution(site_dir, 'alpha', '1.0',
+                         {'alpha/__init__.py': 'ALPHA = 1\n', 'alpha/tests/test_alpha.py': ''})
+    install_distribution(site_dir, 'beta', '2.0', {'beta/__init__.py': 'BETA = 2\n'})
+    # ''' changed after pip installed it, the wheel is staged instead '''
+    (site_dir / 'beta' / '__init__.py').write_text('BETA = 2  # patched\n', encoding='utf8')
+    install_distribution(site_dir, 'gamma', '0.1', {'gamma.pth': '/src/gamma\n'},
+                         direct_url={'url': 'file:///src/gamma', 'dir_info': {'editable': True}})
+    (site_dir / 'leftover' / 'build.log').parent.mkdir()
+    (site_dir / 'leftover' / 'build.log').write_text('junk', encoding='utf8')
+    (tmp_path / 'wheels').mkdir()
+    write_wheel(tmp_path / 'wheels' / 'beta-2.0-py3-none-any.whl', {'beta/__init__.py': 'BETA = 2\n'})
+    return site_dir
+
+
+def test_plan_staging(site_dir, tmp_path):
+    requirements = ['alpha==1.0', 'Beta==2.0', 'gamma @ file:///src/gamma', 'delta==3.0']
+    plan = bs.plan_staging(requirements, site_dir, [tmp_path / 'wheels', None], skip_pypi_packages=['epsilon'])
+    assert [(c.name, c.source) for c in plan] == [
+        ('alpha', 'installed'), ('beta', 'cached'), ('gamma', 'package'), ('delta', 'download')]
+    assert sorted(plan[0].paths) == ['alpha-1.0.dist-info/INSTALLER', 'alpha-1.0.dist-info/METADATA',
+                                     'alpha-1.0.dist-info/RECORD', 'alpha/__init__.py', 'alpha/tests/test_alpha.py']
+    assert plan[0].size == len('ALPHA = 1\n') + len('Name: alpha\nVersion: 1.0\n') + len('pip\n') + os.path.getsize(
+        site_dir / 'alpha-1.0.dist-info' / 'RECORD')
+    assert plan[1].wheel_file == (tmp_path / 'wheels' / 'beta-2.0-py3-none-any.whl').resolve()
+    assert plan[3].seconds == float('inf')
+    assert bs.log_plan(plan) is plan
+
+
+def test_plan_staging_by_target(site_dir, tmp_path):
+    # ''' a cached wheel of another Python or bitness is no candidate for the target '''
+    (tmp_path / 'wheels' / 'delta-3.0-cp311-cp311-win_amd64.whl').write_bytes(b'')
+    write_wheel(tmp_path / 'wheels' / 'delta-3.0-cp39-cp39-win32.whl', {'delta/__init__.py': ''})
+    plan = bs.plan_staging(['delta==3.0'], site_dir, [tmp_path / 'wheels'], python_version='3.9.19', bitness=32)
+    assert plan[0].wheel_file == (tmp_path / 'wheels' / 'delta-3.0-cp39-cp39-win32.whl').resolve()
+    plan = bs.plan_staging(['delta==3.0'], site_dir, [tmp_path / 'wheels'], python_version='3.9.19', bitness=64)
+    assert plan[0].source == 'download'
+
+
+def test_stage_plan(site_dir, tmp_path):
+    requirements = ['alpha==1.0', 'beta==2.0', 'gamma @ file:///src/gamma', 'delta==3.0']
+    plan = bs.plan_staging(requirements, site_dir, [tmp_path / 'wheels'], skip_pypi_packages=['delta'])
+    pynsist_pkgs = tmp_path / 'pynsist_pkgs'
+    wheels, wheel_sources, packages = bs.stage_plan(plan, site_dir, pynsist_pkgs, tmp_path, 'python',
+                                                    excludes=['pkgs/alpha/tests'])
+    assert wheels == ['beta==2.0']
+    assert wheel_sources == [str((tmp_path / 'wheels').resolve())]
+    assert packages == ['gamma', 'delta']
+    staged = sorted(p.relative_to(pynsist_pkgs).as_posix() for p in pynsist_pkgs.rglob('*') if p.is_file())
+    assert staged == ['alpha-1.0.dist-info/INSTALLER', 'alpha-1.0.dist-info/METADATA', 'alpha-1.0.dist-info/RECORD',
+                      'alpha/__init__.py']
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_hybrid_installer(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    state = bw.run_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+        editable_packages=[], unwanted_packages=[], skip_pypi_packages=[], staging='hybrid', force=True)
+    assert (Path(state['destination_dir']) / state['installer_exe']).stat().st_size > 0
+    pkgs = Path(state['work_dir']) / 'build' / 'nsis' / 'pkgs'
+    assert (pkgs / 'PyQt6').is_dir() and (pkgs / 'pyqt6_example').is_dir()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark of the bibiinstaller command line.
+
+`--help`, `--validate` and `--dry_run` must stay within STARTUP_BUDGET_MS on top
+of a bare interpreter start, set BIBIINSTALLER_STARTUP_BUDGET_MS to override it.
+"""
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+EXAMPLE_CONFIGS = (Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example' /
+                   'bibiinstaller_configs.py').resolve()
+STARTUP_BUDGET_MS = float(os.environ.get('BIBIINSTALLER_STARTUP_BUDGET_MS', 300))
+RUNS = 5
+
+CLI = 'import sys; from bibiinstaller import main; sys.argv[0] = "bibiinstaller"; sys.exit(main())'
+LAZY_MODULES = ['requests', 'PIL', 'packaging', 'loguru', 'bibiflags',
+                'bibiinstaller.bibiinstaller_cache', 'bibiinstaller.bibiinstaller_fingerprint']
+
+
+def best_time_ms(args, env=None):
+    best = None
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        cp = subprocess.run(args, capture_output=True, text=True, env=env)
+        elapsed = (time.perf_counter() - started) * 1000
+        assert cp.returncode == 0, cp.stderr
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@pytest.fixture(scope='module')
+def interpreter_ms():
+    return best_time_ms([sys.executable, '-c', 'pass'])
+
+
+@pytest.mark.parametrize('mode', [
+    ['--help'],
+    [str(EXAMPLE_CONFIGS), '--validate'],
+    [str(EXAMPLE_CONFIGS), '--dry_run'],
+], ids=['help', 'validate', 'dry_run'])
+def test_startup_budget(mode, interpreter_ms, tmp_path):
+    env = dict(os.environ, BIBIINSTALLER_CACHE=str(tmp_path))
+    startup_ms = best_time_ms([sys.executable, '-c', CLI, *mode], env=env) - interpreter_ms
+    print(f'{" ".join(mode)}: {startup_ms:.0f}ms (budget {STARTUP_BUDGET_MS:.0f}ms)')
+    assert startup_ms < STARTUP_BUDGET_MS
+
+
+def test_import_is_lazy():
+    code = f'import sys, bibiinstaller; print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    cp = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert cp.stdout.strip() == ''
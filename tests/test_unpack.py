@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, RECORD-checked unpacking of wheels into the cache.
+"""
+import zipfile
+
+import pytest
+
+from bibiinstaller import bibiinstaller_unpack as bu
+
+from .conftest import write_wheel
+
+
+@pytest.fixture()
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+def test_unpack_wheels(tmp_path, cache):
+    wheels = [
+        write_wheel(tmp_path / 'alpha-1.0-py3-none-any.whl', {
+            'alpha/__init__.py': b'ALPHA = 1\n', 'alpha/tests/test_alpha.py': b'',
+            'alpha-1.0.data/purelib/alpha_extra.py': b'EXTRA = 1\n',
+            'alpha-1.0.data/scripts/alpha.exe': b'MZ'}),
+        write_wheel(tmp_path / 'beta-2.0-py3-none-any.whl', {'beta/__init__.py': b'BETA = 2\n'}),
+    ]
+    trees = bu.unpack_wheels(wheels, max_workers=2)
+    assert [t.parent.parent for t in trees] == [bu.get_unpacked_dir()] * 2
+    assert (trees[0] / 'alpha_extra.py').read_bytes() == b'EXTRA = 1\n'
+    assert not (trees[0] / 'alpha.exe').exists() and not (trees[0] / 'alpha-1.0.data').exists()
+    assert (trees[1] / 'beta-2.0.dist-info' / 'RECORD').is_file()
+    assert not list(bu.get_unpacked_dir().glob('*.tmp-*'))
+
+    # ''' cached by content: a copy of the wheel elsewhere is not unpacked again '''
+    built = (trees[1] / 'beta' / '__init__.py').stat().st_mtime_ns
+    (tmp_path / 'copy').mkdir()
+    copied = (tmp_path / 'copy' / wheels[1].name)
+    copied.write_bytes(wheels[1].read_bytes())
+    assert bu.unpack_wheels([copied]) == trees[1:]
+    assert (trees[1] / 'beta' / '__init__.py').stat().st_mtime_ns == built
+
+    pynsist_pkgs = bu.stage_unpacked(trees, tmp_path / 'pynsist_pkgs', excludes=['pkgs/alpha/tests'])
+    assert (pynsist_pkgs / 'alpha' / '__init__.py').read_bytes() == b'ALPHA = 1\n'
+    assert (pynsist_pkgs / 'beta' / '__init__.py').is_file()
+    assert not (pynsist_pkgs / 'alpha' / 'tests').exists()
+
+
+def test_unpack_wheels_refuses_mismatch(tmp_path, cache):
+    good = write_wheel(tmp_path / 'good-1.0-py3-none-any.whl', {'good/__init__.py': b'GOOD = 1\n'})
+    bad = write_wheel(tmp_path / 'bad-1.0-py3-none-any.whl', {'bad/__init__.py': b'BAD = 1\n'}, tamper=b'BAD = 2\n')
+    with pytest.raises(SystemExit, match='BROKEN wheel .*bad-1.0.*MISMATCH'):
+        bu.unpack_wheels([good, bad])
+    assert not list(bu.get_unpacked_dir().glob(f'{bu.wheel_digest(bad)}*'))
+
+    unlisted = tmp_path / 'unlisted-1.0-py3-none-any.whl'
+    write_wheel(unlisted, {'unlisted/__init__.py': b''})
+    with zipfile.ZipFile(unlisted, 'a') as z:
+        z.writestr('unlisted/injected.py', b'')
+    with pytest.raises(SystemExit, match='NOT IN RECORD'):
+        bu.unpack_wheels([unlisted])
+
+
+def test_unpack_keeps_concurrent_entry(tmp_path, cache, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    wheel = write_wheel(tmp_path / 'gamma-1.0-py3-none-any.whl', {'gamma/__init__.py': b'GAMMA = 1\n'})
+    entry_dir = bu.get_unpacked_dir() / bu.wheel_digest(wheel)
+
+    class ConcurrentPool(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            # ''' another build publishes the entry, and stages from it, while this one unpacks '''
+            (entry_dir / bu.TREE_DIR_NAME / 'gamma').mkdir(parents=True)
+            (entry_dir / bu.TREE_DIR_NAME / 'gamma' / 'staging.py').write_bytes(b'')
+            (entry_dir / bu.UNPACKED_JSON).write_text('{}', encoding='utf8')
+            return super().submit(fn, *args)
+
+    monkeypatch.setattr(bu, 'ProcessPoolExecutor', ConcurrentPool)
+    assert bu.unpack_wheels([wheel]) == [entry_dir / bu.TREE_DIR_NAME]
+    assert (entry_dir / bu.TREE_DIR_NAME / 'gamma' / 'staging.py').exists()
+    assert not list(bu.get_unpacked_dir().glob('*.tmp-*'))
+
+
+@pytest.mark.parametrize('python_version, bitness, expected', [
+    ('3.9.19', 64, 'demo-1.0-cp39-cp39-win_amd64.whl'),
+    ('3.9', 32, 'demo-1.0-cp39-cp39-win32.whl'),
+    ('3.11.9', 64, 'demo-1.0-cp311-cp311-win_amd64.whl'),
+    # ''' no binary wheel for the target: the pure wheel '''
+    ('3.12', 32, 'demo-1.0-py3-none-any.whl'),
+])
+def test_index_wheels_by_target(tmp_path, python_version, bitness, expected):
+    for tag in ('cp39-cp39-win32', 'cp39-cp39-win_amd64', 'cp311-cp311-win_amd64', 'py3-none-any',
+                'cp312-cp312-manylinux_2_17_x86_64'):
+        (tmp_path / f'demo-1.0-{tag}.whl').write_bytes(b'')
+    wheels = bu.index_wheels([tmp_path], python_version, bitness)
+    assert wheels[('demo', '1.0')].name == expected
+    assert bu.find_wheels(['demo==1.0'], [tmp_path], python_version, bitness)[0].name == expected
+
+
+def test_find_wheels_without_target_wheel(tmp_path):
+    (tmp_path / 'demo-1.0-cp311-cp311-win_amd64.whl').write_bytes(b'')
+    assert bu.find_wheels(['demo==1.0'], [tmp_path])
+    with pytest.raises(SystemExit, match='for CPython 3.9 64bit'):
+        bu.find_wheels(['demo==1.0'], [tmp_path], '3.9', 64)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-warmed base venvs on the simulated toolchain.
+"""
+import os
+import shutil
+
+import pytest
+
+if os.name != 'posix':
+    pytest.skip('the simulated toolchain runs on POSIX only', allow_module_level=True)
+
+from bibiinstaller import bibiinstaller_toolchain  # noqa: E402
+from bibiinstaller import bibiinstaller_venvs as bv  # noqa: E402
+from bibiinstaller import bibiinstaller_windows as bw  # noqa: E402
+
+
+@pytest.fixture()
+def commands(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.delenv(bv.BASE_TOOLS_ENV, raising=False)
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    commands = []
+    subprocess_run = bw.subprocess_run
+
+    def recording_subprocess_run(args, exit=True):
+        commands.append([str(a) for a in args])
+        return subprocess_run(args, exit=exit)
+
+    monkeypatch.setattr(bw, 'subprocess_run', recording_subprocess_run)
+    return commands
+
+
+def test_clone_base_venv(commands, tmp_path):
+    env_python = bw.create_packaging_venv(tmp_path / 'work_a', '3.9', 'packaging-venv')
+    assert bv.tools_match(env_python, bv.BASE_TOOLS)
+    # ''' micromamba, venv and one pip install of the pins '''
+    assert len(commands) == 3 and commands[-1][-4:-1] == ['pip==24.2', 'setuptools==72.1.0', 'wheel==0.44.0']
+
+    bw.create_packaging_venv(tmp_path / 'work_b', '3.9', 'packaging-venv')
+    assert bw.create_packaging_venv(tmp_path / 'work_a', '3.9', 'packaging-venv') == env_python
+    assert len(commands) == 3
+
+    # ''' installs into a clone stay out of the base venv '''
+    bw.subprocess_run([env_python, '-m', 'pip', 'install', 'demo-dep'])
+    template_dir = next(p for p in bv.get_venvs_dir().iterdir() if p.is_dir())
+    assert (bv.site_packages_of(env_python) / 'demo_dep').is_dir()
+    assert not (template_dir / 'Lib' / 'site-packages' / 'demo_dep').exists()
+
+
+def test_changed_pins_clone_again(commands, tmp_path, monkeypatch):
+    env_python = bw.create_packaging_venv(tmp_path / 'work', '3.9', 'packaging-venv')
+    monkeypatch.setenv(bv.BASE_TOOLS_ENV, 'pip==24.0 setuptools==69.5.1 wheel==0.43.0')
+    assert not bv.tools_match(env_python, bv.get_base_tools())
+    bw.create_packaging_venv(tmp_path / 'work', '3.9', 'packaging-venv')
+    assert bv.tools_match(env_python, {'pip': '24.0', 'setuptools': '69.5.1', 'wheel': '0.43.0'})
+    assert len([p for p in bv.get_venvs_dir().iterdir() if p.is_dir()]) == 2
+
+
+def test_prune_interpreters_then_rebuild(commands, tmp_path):
+    from bibiinstaller import bibiinstaller_interpreters as bi
+    env_python = bw.create_packaging_venv(tmp_path / 'work', '3.9', 'packaging-venv')
+    environment_dir = bi.get_micromamba_root() / 'envs' / 'python_3.9_64bit'
+    last_used = environment_dir / bi.LAST_USED_FILE
+    os.utime(last_used, (0, 0))
+    # ''' a reused venv marks its interpreter as used '''
+    bw.create_packaging_venv(tmp_path / 'work', '3.9', 'packaging-venv')
+    assert last_used.stat().st_mtime > 0 and len(commands) == 3
+    # ''' the base venv still runs on it '''
+    assert bi.prune_interpreters(days=0, archives=False) == []
+
+    shutil.rmtree(bv.get_venvs_dir())
+    assert bi.prune_interpreters(days=0, archives=False) == [environment_dir]
+    assert not bv.tools_match(env_python, bv.BASE_TOOLS)
+    assert bw.create_packaging_venv(tmp_path / 'work', '3.9', 'packaging-venv') == env_python
+    assert bv.tools_match(env_python, bv.BASE_TOOLS) and (environment_dir / 'python.exe').exists()
+    assert len(commands) == 6
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: sync changed package files, rebuild on metadata changes.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_watch as bwatch
+from bibiinstaller.bibiinstaller_cache import FileLock
+
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+def test_sync_project_files(tmp_path):
+    dist_info = tmp_path / 'app-1.0.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'RECORD').write_text('app/__init__.py,,\napp/gui.py,,\napp-1.0.dist-info/RECORD,,\n'
+                                      '../../Scripts/app.exe,,\n', encoding='utf8')
+    top_levels = bwatch.read_top_levels(dist_info)
+    assert top_levels == {'app'}
+    assert bwatch.installed_rel_path('src/app/gui.py', top_levels) == 'app/gui.py'
+    assert bwatch.installed_rel_path('README.md', top_levels) is None
+
+    project_root = tmp_path / 'project'
+    (project_root / 'src' / 'app').mkdir(parents=True)
+    (project_root / 'src' / 'app' / 'gui.py').write_text('changed', encoding='utf8')
+    target_dir = tmp_path / 'target'
+    (target_dir / 'app').mkdir(parents=True)
+    (tmp_path / 'object').write_text('stored', encoding='utf8')
+    os.link(tmp_path / 'object', target_dir / 'app' / 'gui.py')
+    (target_dir / 'app' / 'old.py').write_text('old', encoding='utf8')
+    synced = bwatch.sync_project_files(project_root, ['src/app/gui.py', 'README.md'], ['src/app/old.py'],
+                                       top_levels, [target_dir])
+    assert synced == 2
+    assert (target_dir / 'app' / 'gui.py').read_text(encoding='utf8') == 'changed'
+    # ''' the hardlinked object is replaced, not written through '''
+    assert (tmp_path / 'object').read_text(encoding='utf8') == 'stored'
+    assert not (target_dir / 'app' / 'old.py').exists()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_watch_installer(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    from bibiinstaller import bibiinstaller_windows as bw
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain',
+                        bibiinstaller_toolchain.SimulatedToolchain(tmp_path / 'simulator'))
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    work_dir_locks = []
+
+    def sleep(interval):
+        # ''' every poll of the session runs with the work dir locked '''
+        work_dir = next(p for p in (tmp_path / 'cache' / 'work').iterdir() if p.is_dir())
+        lock = FileLock(work_dir.with_name(f'{work_dir.name}.lock'))
+        work_dir_locks.append(lock.acquire(blocking=False))
+        lock.release()
+        if len(work_dir_locks) == 1:
+            setup_py = project_root / 'setup.py'
+            setup_py.write_text(setup_py.read_text(encoding='utf8').replace("version='0.1.0'", "version='0.2.0'"),
+                                encoding='utf8')
+        else:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(bwatch.time, 'sleep', sleep)
+    bwatch.watch_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+        editable_packages=[], unwanted_packages=[], skip_pypi_packages=[])
+    assert work_dir_locks == [False, False]
+    work_dir = next(p for p in (tmp_path / 'cache' / 'work').iterdir() if p.is_dir())
+    lock = FileLock(work_dir.with_name(f'{work_dir.name}.lock'))
+    assert lock.acquire(blocking=False)
+    lock.release()
+    # ''' pynsist_pkgs staged again: the dist-info of 0.1.0 is gone '''
+    dist_infos = sorted(p.name for p in (work_dir / 'pynsist_pkgs').glob('pyqt6_example-*.dist-info'))
+    assert dist_infos == ['pyqt6_example-0.2.0.dist-info']
+    assert (project_root / 'dist' / 'pyqt6_example_64bit.exe').stat().st_size > 0
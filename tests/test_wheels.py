@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Project wheel cache: built once per source fingerprint, build system and pip.
+"""
+import os
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from bibiinstaller import bibiinstaller_wheels as bwh
+from bibiinstaller import bibiinstaller_windows as bw
+
+EXAMPLE_PROJECT = Path(__file__).parents[1] / 'examples' / 'pyqt6_setup_py_example'
+
+
+@pytest.fixture()
+def project_root(tmp_path):
+    project_root = tmp_path / 'demo'
+    (project_root / 'demo_app').mkdir(parents=True)
+    (project_root / 'demo_app' / '__init__.py').write_text('VERSION = 1\n', encoding='utf8')
+    (project_root / 'pyproject.toml').write_text(
+        '[build-system]\nrequires = ["setuptools>=61", "wheel"]\nbuild-backend = "setuptools.build_meta"\n'
+        '[project]\nname = "demo-app"\nversion = "0.1.0"\n', encoding='utf8')
+    return project_root
+
+
+@pytest.fixture()
+def env_python(tmp_path, monkeypatch):
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    site_packages = tmp_path / 'packaging-venv' / 'Lib' / 'site-packages'
+    (site_packages / 'setuptools-69.0.0.dist-info').mkdir(parents=True)
+    (site_packages / 'pip-24.0.dist-info').mkdir()
+    return tmp_path / 'packaging-venv' / 'Scripts' / 'python.exe'
+
+
+@pytest.fixture()
+def builds(monkeypatch):
+    builds = []
+
+    def pip_wheel(command, **kwargs):
+        wheel_dir = Path(command[command.index('--wheel-dir') + 1])
+        project_root = Path(command[-1])
+        (project_root / 'demo_app.egg-info').mkdir(exist_ok=True)
+        with zipfile.ZipFile(wheel_dir / 'demo_app-0.1.0-py3-none-any.whl', 'w') as z:
+            z.write(project_root / 'demo_app' / '__init__.py', 'demo_app/__init__.py')
+        builds.append(project_root)
+        return 0
+
+    monkeypatch.setattr(bw, 'subprocess_run', pip_wheel)
+    return builds
+
+
+def test_project_wheel_is_cached(project_root, env_python, builds):
+    wheel_file = bwh.get_project_wheel(env_python, project_root, '3.11.9')
+    assert wheel_file.name == 'demo_app-0.1.0-py3-none-any.whl' and wheel_file.exists()
+    assert bwh.get_project_wheel(env_python, project_root, '3.11.9') == wheel_file
+    assert len(builds) == 1
+
+    (project_root / 'demo_app' / '__init__.py').write_text('VERSION = 2\n', encoding='utf8')
+    rebuilt = bwh.get_project_wheel(env_python, project_root, '3.11.9')
+    assert rebuilt != wheel_file and len(builds) == 2
+    assert zipfile.ZipFile(rebuilt).read('demo_app/__init__.py') == b'VERSION = 2\n'
+
+
+def test_project_wheel_key_follows_build_backend(project_root, env_python, builds):
+    key = bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 64)
+    assert bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 32) != key
+    site_packages = env_python.parents[1] / 'Lib' / 'site-packages'
+    # ''' the isolated build does not see the setuptools of the packaging venv '''
+    (site_packages / 'setuptools-69.0.0.dist-info').rename(site_packages / 'setuptools-70.1.0.dist-info')
+    assert bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 64) == key
+    (site_packages / 'pip-24.0.dist-info').rename(site_packages / 'pip-24.1.dist-info')
+    assert bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 64) != key
+    key = bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 64)
+    pyproject_toml = project_root / 'pyproject.toml'
+    pyproject_toml.write_text(pyproject_toml.read_text(encoding='utf8').replace('setuptools>=61', 'setuptools>=70'),
+                              encoding='utf8')
+    assert bwh.compute_project_wheel_key(env_python, project_root, '3.11.9', 64) != key
+    assert bwh.installed_versions(site_packages, bwh.read_build_system(project_root)['requires']) == {
+        'setuptools': '70.1.0', 'wheel': None}
+
+
+@pytest.fixture()
+def dependency_builds(monkeypatch):
+    builds = []
+
+    def pip(command, exit=True, **kwargs):
+        if 'download' in command:
+            dest = Path(command[command.index('--dest') + 1])
+            dest.mkdir(parents=True, exist_ok=True)
+            name, _, version = command[-1].partition('==')
+            if name != 'missing':
+                (dest / f'{name}-{version}.tar.gz').write_bytes(command[-1].encode())
+            return 0
+        wheel_dir = Path(command[command.index('--wheel-dir') + 1])
+        name = Path(command[-1]).name.split('-')[0] if Path(command[-1]).exists() else command[-1].split(' ')[0]
+        with zipfile.ZipFile(wheel_dir / f'{name}-1.0-py3-none-any.whl', 'w') as z:
+            z.writestr(f'{name}/__init__.py', '')
+        builds.append(command[-1])
+        return 0
+
+    monkeypatch.setattr(bw, 'subprocess_run', pip)
+    return builds
+
+
+def test_dependency_wheels_are_cached(env_python, dependency_builds, tmp_path):
+    source_dir = tmp_path / 'src' / 'local_dep'
+    source_dir.mkdir(parents=True)
+    (source_dir / 'setup.py').write_text('VERSION = 1\n', encoding='utf8')
+    wheelhouse = tmp_path / 'work' / 'pip_download_only_binaries'
+    requirements = ['legacy==1.0', 'missing==2.0', f'local_dep @ {source_dir.as_uri()}',
+                    'pinned @ git+https://github.com/owner/pinned@41b95ec', 'moving @ git+https://github.com/owner/moving']
+    wheels = bwh.get_dependency_wheels(env_python, requirements, wheelhouse, max_workers=2)
+    assert sorted(wheels) == sorted(r for r in requirements if r != 'missing==2.0')
+    assert all(w.parent == wheelhouse and w.exists() for w in wheels.values())
+    assert len(dependency_builds) == 4
+
+    # ''' only the url not pinned to a commit is built again '''
+    assert bwh.get_dependency_wheels(env_python, requirements, wheelhouse) == wheels
+    assert len(dependency_builds) == 5 and dependency_builds[-1] == requirements[-1]
+
+    (source_dir / 'setup.py').write_text('VERSION = 2\n', encoding='utf8')
+    site_packages = env_python.parents[1] / 'Lib' / 'site-packages'
+    bwh.get_dependency_wheels(env_python, requirements[2:3], wheelhouse)
+    (site_packages / 'setuptools-69.0.0.dist-info').rename(site_packages / 'setuptools-70.1.0.dist-info')
+    bwh.get_dependency_wheels(env_python, requirements[:1], wheelhouse)
+    assert len(dependency_builds) == 7
+
+
+def test_requirement_url():
+    assert bwh.requirement_url('numpy @ file:///D:/bld/numpy_1610324703282/work') == (
+        'numpy', Path('D:/bld/numpy_1610324703282/work'))
+    assert bwh.requirement_url('pkg @ file:///home/me/pkg%20dir ; python_version >= "3.8"') == (
+        'pkg', Path('/home/me/pkg dir'))
+    assert bwh.requirement_url('two @ git+https://github.com/owner/repo@41b95ec') == (
+        'two', 'git+https://github.com/owner/repo@41b95ec')
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the simulated toolchain runs on POSIX only')
+def test_sdist_only_dependency_takes_the_wheel_path(tmp_path, monkeypatch):
+    from bibiinstaller import bibiinstaller_toolchain
+    monkeypatch.setenv('BIBIINSTALLER_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setattr(bibiinstaller_toolchain, '_toolchain', bibiinstaller_toolchain.SimulatedToolchain(
+        tmp_path / 'simulator', index={'PyQt6': {'version': '6.7.0', 'wheel': False}}))
+    project_root = tmp_path / 'project'
+    shutil.copytree(EXAMPLE_PROJECT, project_root)
+    state = bw.run_installer(
+        python_version='3.9.19', bitness=64,
+        entrypoint='pyqt6_example.pyqt6_example_burning_widget:main', package='pyqt6_setup_py_example',
+        icon_path=project_root / 'pyqt6_example.png', license_path=project_root / 'license.txt',
+        project_root=project_root, nsi_template_path=Path(bw.CONFIG_HOME) / 'nsi_templates' / 'bibiinstaller.nsi',
+        configs_py_file=project_root / 'bibiinstaller_configs.py', files=[], extra_packages=[],
+        editable_packages=[], unwanted_packages=[], skip_pypi_packages=[], is_wheel_first=True, force=True)
+    work_dir = Path(state['work_dir'])
+    assert (work_dir / 'pip_download_only_binaries' / 'PyQt6-6.7.0-py3-none-any.whl').is_file()
+    assert (work_dir / 'build' / 'nsis' / 'pkgs' / 'PyQt6' / 'payload.bin').is_file()
+    assert 'PyQt6' not in (work_dir / 'pynsist.cfg').read_text(encoding='latin1')